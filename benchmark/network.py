@@ -0,0 +1,203 @@
+#  Copyright 2012 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""End-to-end benchmarks of sending and receiving messages over localhost.
+
+Usage:  python -m benchmark network [options] [pattern ...]
+
+A client sends a message with `Client Sends Message`, the server receives
+it with `Server Receives Message` and sends it back, and the client receives
+the echo with `Client Receives Message`. This is run over TCP, UDP, Unix
+domain stream sockets and the in-process loopback transport, which leaves
+out the network stack, with small, medium and large messages, both
+lock-step, one message in flight at a time, and pipelined, a window of
+messages in flight.
+
+Reports round trips per second, round trip latency percentiles and CPU
+time per round trip. Servers bind to a free port on 127.0.0.1 or to a
+socket file in a temporary directory, so runs need no network and do not
+collide with other tests. Message counts and contents are fixed, so results
+of different commits are comparable. See `python -m benchmark --help` for
+saving and comparing results.
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+from optparse import OptionParser
+
+from Rammbock.core import RammbockCore
+from Rammbock.metrics import LatencyHistogram, monotonic
+from runner import compare, save
+from templates import _example_protocol
+
+
+LOCALHOST = '127.0.0.1'
+# Payload sizes and default number of round trips. Large messages still fit
+# in one UDP datagram.
+SIZES = [('small', 64, 1000), ('medium', 1400, 500), ('large', 60000, 100)]
+TRANSPORTS = ['tcp', 'udp', 'unix', 'loopback']
+MODES = ['lockstep', 'pipelined']
+PIPELINE_DEPTH = 16
+# Pipelined messages must fit in the default socket buffers, as the server
+# reads them only after the whole window has been sent. Otherwise sending
+# blocks, or UDP drops the datagrams, and the benchmark never finishes.
+UDP_WINDOW_BYTES = 100000
+STREAM_WINDOW_BYTES = 65536
+WINDOW_BYTES = {'udp': UDP_WINDOW_BYTES, 'tcp': STREAM_WINDOW_BYTES, 'unix': STREAM_WINDOW_BYTES,
+                'loopback': STREAM_WINDOW_BYTES}
+
+
+class TransportBenchmark(object):
+
+    def __init__(self, transport, size, messages, pipelined=False, depth=PIPELINE_DEPTH, socket_options=None):
+        self._transport = transport
+        self._socket_options = socket_options or {}
+        self._messages = int(messages)
+        self._depth = self._window(transport, size, depth) if pipelined else 1
+        self._core = RammbockCore()
+        self._directory = tempfile.mkdtemp()
+        self._define_message(size)
+        self._connect()
+        self.latency = LatencyHistogram()
+
+    def _window(self, transport, size, depth):
+        if transport in WINDOW_BYTES:
+            return max(min(depth, WINDOW_BYTES[transport] // size), 1)
+        return depth
+
+    def _define_message(self, size):
+        _example_protocol(self._core)
+        self._core.new_message('Echo', 'Example', 'header:messageType:0xe001')
+        self._core.chars(size, 'payload', 'x' * size)
+
+    def _connect(self):
+        core = self._core
+        if self._transport == 'loopback':
+            core.start_loopback_server(protocol='Example')
+            core.start_loopback_client(protocol='Example')
+            core.accept_connection()
+            return
+        if self._transport == 'unix':
+            path = os.path.join(self._directory, 'benchmark.sock')
+            core.start_unix_server(path, protocol='Example', **self._socket_options)
+            core.start_unix_client(protocol='Example', **self._socket_options)
+            core.connect(path)
+            core.accept_connection()
+            return
+        getattr(core, 'start_%s_server' % self._transport)(LOCALHOST, 0, protocol='Example', **self._socket_options)
+        _, port = core._servers.get().get_own_address()
+        getattr(core, 'start_%s_client' % self._transport)(protocol='Example', **self._socket_options)
+        core.connect(LOCALHOST, port)
+        if self._transport == 'tcp':
+            core.accept_connection()
+
+    def run(self):
+        """Runs the round trips and returns the statistics."""
+        core = self._core
+        cpu_start, start = _cpu_time(), monotonic()
+        sent = 0
+        try:
+            while sent < self._messages:
+                window = min(self._depth, self._messages - sent)
+                send_times = []
+                for _ in range(window):
+                    send_times.append(monotonic())
+                    core.client_sends_message()
+                for _ in range(window):
+                    core.server_receives_message()
+                    core.server_sends_message()
+                for send_time in send_times:
+                    core.client_receives_message()
+                    self.latency.record(monotonic() - send_time)
+                sent += window
+        finally:
+            core.reset_rammbock()
+            shutil.rmtree(self._directory)
+        elapsed, cpu = monotonic() - start, _cpu_time() - cpu_start
+        summary = self.latency.summary()
+        return {'ops_per_sec': sent / elapsed if elapsed else 0.0,
+                'cpu_us': cpu * 1000000 / sent,
+                'p50': summary['p50'], 'p90': summary['p90'], 'p99': summary['p99'],
+                'messages': sent, 'depth': self._depth}
+
+
+def _cpu_time():
+    user, system = os.times()[:2]
+    return user + system
+
+
+def all_benchmarks(messages=None, socket_options=None):
+    """Returns names and factories of all loopback benchmarks. `messages`
+    overrides the number of round trips of each benchmark. `socket_options`
+    are given to servers and clients of socket transports."""
+    benchmarks = []
+    for transport in TRANSPORTS:
+        for size_name, size, count in SIZES:
+            for mode in MODES:
+                benchmarks.append(('%s.%s.%s' % (transport, size_name, mode),
+                                   _factory(transport, size, messages or count, mode == 'pipelined',
+                                            socket_options)))
+    return benchmarks
+
+
+def _factory(transport, size, messages, pipelined, socket_options):
+    if transport == 'loopback':
+        socket_options = None
+    return lambda: TransportBenchmark(transport, size, messages, pipelined, socket_options=socket_options)
+
+
+def report(results, baseline=None, regressions=(), output=sys.stdout):
+    output.write('%-24s %12s %10s %10s %10s %12s%s\n' %
+                 ('Benchmark', 'msgs/sec', 'p50 ms', 'p90 ms', 'p99 ms', 'CPU us/msg',
+                  '   vs baseline' if baseline else ''))
+    for name in sorted(results):
+        result = results[name]
+        line = '%-24s %12.1f %10.3f %10.3f %10.3f %12.1f' % (name, result['ops_per_sec'], result['p50'],
+                                                            result['p90'], result['p99'], result['cpu_us'])
+        if baseline and name in baseline:
+            line += '   %+7.1f%%' % ((result['ops_per_sec'] / baseline[name]['ops_per_sec'] - 1) * 100)
+            if name in regressions:
+                line += '  REGRESSION'
+        output.write(line + '\n')
+
+
+def main(args):
+    parser = OptionParser(usage=__doc__.strip().splitlines()[2].strip())
+    parser.add_option('--save', metavar='FILE', help='Save results as JSON to FILE.')
+    parser.add_option('--baseline', metavar='FILE', help='Compare results to JSON results in FILE.')
+    parser.add_option('--tolerance', type='float', default=10.0,
+                      help='Allowed slowdown and growth of allocated objects compared to '
+                           'baseline in percent. Default is 10.')
+    parser.add_option('--messages', type='int',
+                      help='Number of round trips in each benchmark. Default depends on message size.')
+    parser.add_option('--socket-option', action='append', default=[], metavar='NAME=VALUE',
+                      help='Socket option for servers and clients, e.g. nodelay=true or rcvbuf=4M. '
+                           'Can be given multiple times.')
+    options, patterns = parser.parse_args(args)
+    socket_options = dict(option.split('=', 1) for option in options.socket_option)
+    results = {}
+    for name, benchmark in all_benchmarks(options.messages, socket_options):
+        if not patterns or any(pattern in name for pattern in patterns):
+            results[name] = benchmark().run()
+    baseline, regressions = None, []
+    if options.baseline:
+        baseline = json.load(open(options.baseline))
+        regressions = compare(results, baseline, options.tolerance)
+    report(results, baseline, regressions)
+    if options.save:
+        save(results, options.save)
+    return 1 if regressions else 0
@@ -0,0 +1,178 @@
+#  Copyright 2012 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Micro-benchmarks of encoding, decoding and validating messages.
+
+Usage:  python -m benchmark [options] [pattern ...]
+
+Runs benchmarks whose names contain any of the given patterns, or all
+benchmarks, and reports operations per second and objects allocated per
+operation. Objects are the garbage collected objects kept alive by the
+result of one operation, e.g. the fields of a decoded message.
+
+Results can be saved as JSON with --save and later runs compared against
+them with --baseline. Benchmarks slower than the baseline, or allocating
+more objects, by more than the tolerance are flagged as regressions and make
+the run exit with a non-zero status.
+"""
+
+import gc
+import json
+import sys
+import timeit
+from optparse import OptionParser
+
+from Rammbock.binary_tools import to_bin, to_bin_of_length, to_hex, to_0xhex, to_int, \
+    to_tbcd_value, to_tbcd_binary
+from templates import BUILDERS
+
+
+def template_benchmarks(case):
+    template, protocol = case.template, case.protocol
+    fields, headers, validation_fields = case.fields, case.headers, case.validation_fields
+    raw = template.encode(fields, headers)._raw
+
+    def encode():
+        msg = template.encode(fields, headers)
+        msg._raw
+        return msg
+
+    def decode():
+        header, pdu_bytes = protocol.read_frame(raw)
+        if template.only_header:
+            return header
+        return template.decode(pdu_bytes, parent=header)
+    msg = decode()
+
+    def validate():
+        return template.validate(msg, validation_fields)
+    return [('%s.encode' % case.name, encode),
+            ('%s.decode' % case.name, decode),
+            ('%s.validate' % case.name, validate)]
+
+
+BINARY_TOOLS = [('binary_tools.to_bin', lambda: to_bin('0xcafebabe')),
+                ('binary_tools.to_bin_of_length', lambda: to_bin_of_length(8, '0xcafe')),
+                ('binary_tools.to_hex', lambda: to_hex('\xca\xfe\xba\xbe')),
+                ('binary_tools.to_0xhex', lambda: to_0xhex('\xca\xfe\xba\xbe')),
+                ('binary_tools.to_int', lambda: to_int('0xcafe')),
+                ('binary_tools.to_tbcd_value', lambda: to_tbcd_value('\x21\x43\xf5')),
+                ('binary_tools.to_tbcd_binary', lambda: to_tbcd_binary('12345'))]
+
+
+def all_benchmarks():
+    benchmarks = []
+    for build in BUILDERS:
+        benchmarks.extend(template_benchmarks(build()))
+    return benchmarks + BINARY_TOOLS
+
+
+def measure(function, min_time=0.2, repeat=3):
+    """Returns the best rate of `repeat` runs of at least `min_time` seconds
+    and objects allocated per operation."""
+    number = _calibrate(function, min_time)
+    timer = timeit.Timer(function)
+    best = min(timer.timeit(number) for _ in range(repeat))
+    return {'ops_per_sec': number / best if best else float(number),
+            'objects': retained_objects(function)}
+
+
+def _calibrate(function, min_time):
+    timer = timeit.Timer(function)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time / 10:
+            return max(int(number * min_time / elapsed), 1)
+        number *= 10
+
+
+def retained_objects(function, count=100):
+    """Returns the number of garbage collected objects kept alive by the
+    result of one call of `function`."""
+    while gc.collect():
+        pass
+    before = len(gc.get_objects())
+    results = [function() for _ in range(count)]
+    gc.collect()
+    # The results list itself is not counted.
+    retained = len(gc.get_objects()) - before - 1
+    del results
+    return round(retained / float(count), 1)
+
+
+def compare(results, baseline, tolerance=10.0):
+    """Returns names of benchmarks that regressed compared to `baseline`.
+
+    A benchmark regresses if its rate dropped or the objects it allocates per
+    operation grew more than `tolerance` percent.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        if result['ops_per_sec'] < baseline[name]['ops_per_sec'] * (1 - tolerance / 100.0) or \
+                result.get('objects', 0) > baseline[name].get('objects', 0) * (1 + tolerance / 100.0):
+            regressions.append(name)
+    return sorted(regressions)
+
+
+def _change(result, base):
+    return '%+.1f%%' % ((result['ops_per_sec'] / base['ops_per_sec'] - 1) * 100)
+
+
+def report(results, baseline=None, regressions=(), output=sys.stdout):
+    output.write('%-32s %14s %12s %10s%s\n' % ('Benchmark', 'ops/sec', 'us/op', 'objects',
+                                               '   vs baseline' if baseline else ''))
+    for name in sorted(results):
+        result = results[name]
+        line = '%-32s %14.1f %12.2f %10.1f' % (name, result['ops_per_sec'],
+                                               1000000.0 / result['ops_per_sec'], result['objects'])
+        if baseline and name in baseline:
+            line += '   %8s' % _change(result, baseline[name])
+            if name in regressions:
+                line += '  REGRESSION'
+        output.write(line + '\n')
+
+
+def main(args):
+    parser = OptionParser(usage=__doc__.strip().splitlines()[2].strip())
+    parser.add_option('--save', metavar='FILE', help='Save results as JSON to FILE.')
+    parser.add_option('--baseline', metavar='FILE', help='Compare results to JSON results in FILE.')
+    parser.add_option('--tolerance', type='float', default=10.0,
+                      help='Allowed slowdown and growth of allocated objects compared to '
+                           'baseline in percent. Default is 10.')
+    parser.add_option('--min-time', type='float', default=0.2,
+                      help='Minimum time of one measurement in seconds. Default is 0.2.')
+    options, patterns = parser.parse_args(args)
+    results = {}
+    for name, function in all_benchmarks():
+        if not patterns or any(pattern in name for pattern in patterns):
+            results[name] = measure(function, options.min_time)
+    baseline, regressions = None, []
+    if options.baseline:
+        baseline = json.load(open(options.baseline))
+        regressions = compare(results, baseline, options.tolerance)
+    report(results, baseline, regressions)
+    if options.save:
+        save(results, options.save)
+    return 1 if regressions else 0
+
+
+def save(results, path):
+    output = open(path, 'w')
+    try:
+        json.dump(results, output, indent=2, sort_keys=True)
+    finally:
+        output.close()
@@ -0,0 +1,397 @@
+#  Copyright 2012 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+"""Message templates of the acceptance tests rebuilt with library keywords.
+
+Every `build_*` function defines the protocol and message of one acceptance
+test suite with a fresh `RammbockCore` and returns it with the message
+template and field values ready to be encoded.
+"""
+
+import struct
+
+from Rammbock.core import RammbockCore
+from Rammbock.binary_tools import to_0xhex
+
+
+class TemplateCase(object):
+
+    def __init__(self, name, core):
+        self.name = name
+        self.template = core._get_message_template()
+        _, fields, headers = core._get_parameters_with_defaults([])
+        self.fields = dict(fields)
+        self.headers = dict(headers)
+        self.validation_fields = dict(fields)
+        self.protocol = self.template._protocol
+
+
+def _ip(value):
+    return to_0xhex(struct.pack('BBBB', *(int(number) for number in value.split('.'))))
+
+
+def _label_sequence(domain):
+    return ''.join(chr(len(label)) + label for label in domain.split('.'))
+
+
+def _example_protocol(core):
+    core.new_protocol('Example')
+    core.uint(1, 'version', '0x01')
+    core.uint(1, 'reserved', '0x00')
+    core.uint(2, 'messageType')
+    core.uint(2, 'length')
+    core.uint(2, 'flags', '0x0000')
+    core.pdu('length-8')
+    core.end_protocol()
+
+
+def build_ntp():
+    core = RammbockCore()
+    core.new_protocol('NTP')
+    core.new_binary_container('Flags')
+    core.bin(2, 'Leap indicator', '3')
+    core.bin(3, 'Version number', '3')
+    core.bin(3, 'Mode', '1')
+    core.end_binary_container()
+    core.uint(1, 'Peer clock stratum', '0')
+    core.uint(1, 'Peer polling Interval', '10')
+    core.int(1, 'Peer clock precision', '-20')
+    core.int(4, 'Root delay', '303')
+    core.int(4, 'Root dispersion', '1855')
+    core.uint(4, 'Reference id', _ip('192.168.0.1'))
+    for name in ('Reference', 'Origin', 'Receive', 'Transmit'):
+        core.uint(8, '%s timestamp' % name, '0xc4a2f3b542504000')
+    core.end_protocol()
+    core.new_message('time request', 'NTP')
+    return TemplateCase('ntp', core)
+
+
+def build_dns():
+    core = RammbockCore()
+    core.new_protocol('DNS')
+    core.uint(2, 'transaction_id')
+    core.new_binary_container('flags')
+    core.bin(1, 'response')
+    for size, name in ((4, 'opcode'), (1, 'spare_1'), (1, 'truncated'), (1, 'recursion_desired'),
+                       (1, 'spare_2'), (1, 'Z'), (1, 'spare'), (1, 'non_authenticated_data'), (4, 'spare_3')):
+        core.bin(size, name, '0')
+    core.end_binary_container()
+    for name in ('questions', 'answer_rrs', 'authority_rrs', 'additional_rrs'):
+        core.uint(2, name, '0')
+    core._new_list('questions', 'queries')
+    core.new_struct('DNS query', '')
+    core.chars('*', 'name', terminator='0x00')
+    core.uint(2, 'type')
+    core.uint(2, 'class')
+    core.end_struct()
+    core._end_list()
+    core._new_list('answer_rrs', 'answers')
+    core.new_struct('DNS answer', '')
+    core.uint(2, 'name', '0xc00c')
+    core.uint(2, 'type')
+    core.uint(2, 'class')
+    core.uint(4, 'time_to_live')
+    core.uint(2, 'data_length')
+    core.uint('data_length', 'address')
+    core.end_struct()
+    core._end_list()
+    for size, name in (('authority_rrs', 'authorities'), ('additional_rrs', 'additionals')):
+        core._new_list(size, name)
+        core.uint(1, '')
+        core._end_list()
+    core.end_protocol()
+    core.new_message('name', 'DNS', 'header:questions:1', 'header:answer_rrs:1')
+    core.value('transaction_id', '0xbabe')
+    core.value('flags.response', '0')
+    core.value('queries[0].name', _label_sequence('example.com'))
+    core.value('queries[0].type', '0x0001')
+    core.value('queries[0].class', '0x0001')
+    core.value('answers[0].type', '1')
+    core.value('answers[0].class', '1')
+    core.value('answers[0].time_to_live', '1200')
+    core.value('answers[0].data_length', '4')
+    core.value('answers[0].address', _ip('192.168.0.1'))
+    return TemplateCase('dns', core)
+
+
+GTPV2_IE_TYPES = {'IMSI': 1, 'Recovery': 3, 'APN': 71, 'Aggregate maximum bit rate': 72,
+                  'EPS bearer id': 73, 'MSISDN': 76, 'Indication': 77, 'PDN Address Allocation': 79,
+                  'Bearer level qos': 80, 'Rat type': 82, 'Serving network': 83, 'ULI': 86,
+                  'F-TEID': 87, 'Bearer context': 93, 'Charging characteristics': 95,
+                  'PDN Type': 99, 'Ue time zone': 114, 'APN Restriction': 127, 'Selection mode': 128}
+
+
+class _GTPv2(object):
+    """Create Session Request of the GTPv2 acceptance tests."""
+
+    def __init__(self, core):
+        self._core = core
+
+    def define_protocol(self):
+        core = self._core
+        core.new_protocol('gtpv2')
+        core.uint(1, 'flags', '72')
+        core.uint(1, 'message type')
+        core.uint(2, 'message length')
+        core.uint(4, 'tunnel endpoint identifier', '0')
+        core.uint(3, 'sequence number')
+        core.uint(1, 'spare', '0')
+        core.pdu('message length-12')
+        core.end_protocol()
+
+    def create_session_request(self):
+        self._core.new_message('create session request', 'gtpv2', 'header:message type:32')
+        for name in ('IMSI', 'MSISDN', 'ULI', 'Serving network', 'Rat type', 'Indication'):
+            self._ie(name)
+        self._ie('F-TEID', 'f-teid1')
+        self._ie('F-TEID', 'f-teid2')
+        for name in ('APN', 'Selection mode', 'PDN Type', 'PDN Address Allocation', 'APN Restriction',
+                     'Aggregate maximum bit rate', 'Bearer context', 'Recovery', 'Ue time zone',
+                     'Charging characteristics'):
+            self._ie(name)
+
+    def _ie(self, name, field_name=None):
+        core = self._core
+        core.new_struct('IE', field_name or name)
+        core.uint(1, 'ie type', str(GTPV2_IE_TYPES[name]))
+        core.uint(2, 'ie_length')
+        core.new_binary_container('instance')
+        core.bin(4, 'spare', '0')
+        core.bin(4, 'value', '0')
+        core.end_binary_container()
+        core.new_struct('Container', 'value', 'length=ie_length')
+        getattr(self, '_' + name.lower().replace(' ', '_').replace('-', '_'))()
+        core.end_struct()
+        core.end_struct()
+
+    def _tbcd(self, name, size, value=None):
+        self._core.new_tbcd_container(name)
+        self._core.tbcd(size, 'value', value)
+        self._core.end_tbcd_container()
+
+    def _binary(self, name, *fields):
+        self._core.new_binary_container(name)
+        for size, field, value in fields:
+            self._core.bin(size, field, value)
+        self._core.end_binary_container()
+
+    def _imsi(self):
+        self._tbcd('imsi', 15)
+
+    def _msisdn(self):
+        self._core.new_tbcd_container('msisdn')
+        self._core.tbcd(3, 'country_code', '358')
+        self._core.tbcd('*', 'address_digits', '6100000000001')
+        self._core.end_tbcd_container()
+
+    def _uli(self):
+        core = self._core
+        core.uint(1, 'flags')
+        core.new_struct('tai', 'tai')
+        self._tbcd('mcc', 3)
+        self._tbcd('mnc', 2)
+        core.uint(2, 'tracking_area_code')
+        core.end_struct()
+        core.new_struct('E-UTRAN Cell Global Identifier', 'ecgi')
+        self._tbcd('mcc', 3)
+        self._tbcd('mnc', 2)
+        self._binary('eci', (4, 'spare', '0'), (28, 'ecgi', None))
+        core.end_struct()
+
+    def _serving_network(self):
+        self._tbcd('mcc', 3)
+        self._tbcd('mnc', 2)
+
+    def _rat_type(self):
+        self._core.uint(1, 'rat_type')
+
+    def _indication(self):
+        names = ['DAF', 'DTF', 'HI', 'DFI', 'OI', 'ISRSI', 'ISRAI', 'SGWCI', 'SQCI', 'UIMSI',
+                 'CFSI', 'CRSI', 'PS', 'PT', 'SI', 'MSV']
+        fields = [(1, name, '0') for name in names] + [(3, 'SPARE', '0')] + \
+            [(1, name, '0') for name in ('S6AF', 'S4AF', 'MBMDT', 'ISRAU', 'CCRSI')]
+        self._binary('fields', *fields)
+
+    def _f_teid(self):
+        self._binary('values', (1, 'v4', '1'), (1, 'v6', '0'), (6, 'interface type', None))
+        self._core.uint(4, 'teid_gre_key', '0x00')
+        self._core.uint(4, 'f-teid_ipv4')
+
+    def _apn(self):
+        self._core.chars('*', 'access_point_name')
+
+    def _selection_mode(self):
+        self._binary('selection_mode', (6, 'spare', '0b111111'), (2, 'value', '0'))
+
+    def _pdn_type(self):
+        self._binary('pdn_type', (5, 'spare', '0'), (3, 'value', '1'))
+
+    def _pdn_address_allocation(self):
+        self._pdn_type()
+        self._core.uint(4, 'pdn_address_and_prefix', '0')
+
+    def _apn_restriction(self):
+        self._core.uint(1, 'apn_restriction', '0')
+
+    def _aggregate_maximum_bit_rate(self):
+        self._core.uint(4, 'ambr_uplink')
+        self._core.uint(4, 'ambr_downlink')
+
+    def _bearer_context(self):
+        self._ie('EPS bearer id', 'eps_bearer_id')
+        self._ie('Bearer level qos', 'bearer_level_qos')
+
+    def _eps_bearer_id(self):
+        self._binary('epsbid', (4, 'spare', '0'), (4, 'value', None))
+
+    def _bearer_level_qos(self):
+        self._binary('arp', (1, 'spare', '0'), (1, 'pci', '0'), (4, 'pl', None), (1, 'spare_2', '0'), (1, 'pvi', '0'))
+        self._core.uint(1, 'label')
+        for name in ('mbr_uplink', 'mbr_downlink', 'gbr_uplink', 'gbr_downlink'):
+            self._core.uint(5, name, '0')
+
+    def _recovery(self):
+        self._core.uint(1, 'recovery')
+
+    def _ue_time_zone(self):
+        self._binary('timezone', (6, 'spare', '0b111111'), (2, 'value', '0'))
+        self._binary('dst', (6, 'spare', '0'), (2, 'value', '0'))
+
+    def _charging_characteristics(self):
+        self._core.uint(2, 'charging_characteristic', '0x3200')
+
+    def values(self):
+        for name, value in (('IMSI.instance.value', '0x01'),
+                            ('IMSI.value.imsi.value', '262120000000001'),
+                            ('ULI.value.flags', '0b00011000'),
+                            ('ULI.value.tai.mcc.value', '262'),
+                            ('ULI.value.tai.mnc.value', '12'),
+                            ('ULI.value.ecgi.mcc.value', '262'),
+                            ('ULI.value.ecgi.mnc.value', '12'),
+                            ('ULI.value.ecgi.eci.ecgi', '234'),
+                            ('ULI.value.tai.tracking_area_code', '1'),
+                            ('Serving network.value.mcc.value', '262'),
+                            ('Serving network.value.mnc.value', '12'),
+                            ('Rat type.value.rat_type', '6'),
+                            ('Indication.value.fields.DAF', '1'),
+                            ('f-teid1.value.f-teid_ipv4', _ip('192.168.0.1')),
+                            ('f-teid1.value.values.interface type', '7'),
+                            ('f-teid2.instance.value', '1'),
+                            ('f-teid2.value.f-teid_ipv4', _ip('127.0.0.1')),
+                            ('f-teid2.value.values.interface type', '10'),
+                            ('APN.value.access_point_name', _label_sequence('sgw.foo.com.mnc012.mcc262.gprs')),
+                            ('Aggregate maximum bit rate.value.ambr_uplink', '2'),
+                            ('Aggregate maximum bit rate.value.ambr_downlink', '1'),
+                            ('Bearer context.value.eps_bearer_id.value.epsbid.value', '5'),
+                            ('Bearer context.value.bearer_level_qos.value.arp.pl', '1'),
+                            ('Bearer context.value.bearer_level_qos.value.label', '9'),
+                            ('Recovery.value.recovery', '1'),
+                            ('header:sequence number', '48')):
+            self._core.value(name, value)
+
+
+def build_gtpv2():
+    core = RammbockCore()
+    gtpv2 = _GTPv2(core)
+    gtpv2.define_protocol()
+    gtpv2.create_session_request()
+    gtpv2.values()
+    return TemplateCase('gtpv2', core)
+
+
+def build_diameter():
+    core = RammbockCore()
+    core.new_protocol('Diameter')
+    core.uint(1, 'message version', '0x01')
+    core.uint(3, 'message length')
+    core.uint(1, 'message flags', '0x80')
+    core.uint(3, 'command code', '257')
+    core.uint(4, 'application id', '0')
+    core.uint(4, 'Hop-By-Hop Identifier', '0xe36006e2')
+    core.uint(4, 'End-To-End Identifier', '0x00003bab')
+    core.pdu('message length-20')
+    core.end_protocol()
+    core.new_message('Capabilities-Exchange-Request', 'Diameter')
+    for name, code, value in (('origin_host', '264', 'client.example.com'),
+                              ('origin_realm', '296', 'example.com'),
+                              ('product_name', '269', 'Rammbock')):
+        core.new_struct('AVP', name)
+        core.uint(4, 'code', code)
+        core.uint(1, 'flags', '0x40')
+        core.uint(3, 'length', str(8 + len(value)))
+        core.chars(len(value), 'data', value)
+        core.end_struct()
+    return TemplateCase('diameter', core)
+
+
+def build_list():
+    core = RammbockCore()
+    _example_protocol(core)
+    core.new_message('ListMessage', 'Example', 'header:messageType:0x1111')
+    core._new_list(20, 'numbers')
+    core.uint(2, '', '1')
+    core._end_list()
+    core._new_list(10, 'pairs')
+    core.new_struct('Pair', '')
+    core.uint(2, 'first', '1')
+    core.uint(2, 'second', '2')
+    core.end_struct()
+    core._end_list()
+    return TemplateCase('list', core)
+
+
+def build_union():
+    core = RammbockCore()
+    _example_protocol(core)
+    core.new_message('ComplexUnion', 'Example', 'header:messageType:0xb00b')
+    core.new_union('Complex', 'complexU')
+    core.uint(1, 'basicType')
+    core.new_struct('Tuple', 'complexType')
+    core.uint(2, 'first')
+    core.uint(2, 'second')
+    core.end_struct()
+    core.end_union()
+    for name, value in (('complexU', 'complexType'), ('complexU.complexType.first', '1'),
+                        ('complexU.complexType.second', '2')):
+        core.value(name, value)
+    case = TemplateCase('union', core)
+    # Union arm cannot be chosen when validating.
+    del case.validation_fields['complexU']
+    return case
+
+
+def build_binary_container():
+    core = RammbockCore()
+    _example_protocol(core)
+    core.new_message('BinaryMessage', 'Example', 'header:messageType:0x2222')
+    core.new_binary_container('flags')
+    for index in range(16):
+        core.bin(2, 'flag%d' % index, str(index % 4))
+    core.end_binary_container()
+    return TemplateCase('binary_container', core)
+
+
+def build_tbcd():
+    core = RammbockCore()
+    _example_protocol(core)
+    core.new_message('tbcd testing', 'Example', 'header:messageType:0xdddd')
+    core.new_tbcd_container('tbcd_cont')
+    core.tbcd(4, 'first', '1234')
+    core.tbcd(5, 'second', '56789')
+    core.end_tbcd_container()
+    return TemplateCase('tbcd', core)
+
+
+BUILDERS = [build_ntp, build_dns, build_gtpv2, build_diameter, build_list, build_union,
+            build_binary_container, build_tbcd]
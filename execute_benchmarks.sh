@@ -0,0 +1,4 @@
+#!/bin/bash
+base=`dirname $0`
+export PYTHONPATH="$base:$PYTHONPATH"
+python -m benchmark "$@"
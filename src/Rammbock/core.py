@@ -16,8 +16,14 @@ from __future__ import with_statement
 from contextlib import contextmanager
 from robot.api import logger
 from message import _StructuredElement
-from networking import TCPServer, TCPClient, UDPServer, UDPClient, SCTPServer, SCTPClient, _NamedCache
+from networking import TCPServer, TCPClient, UDPServer, UDPClient, SCTPServer, SCTPClient, LoopbackServer, \
+    LoopbackClient, UnixStreamServer, UnixStreamClient, UnixDatagramServer, UnixDatagramClient, _NamedCache, \
+    connect_clients
+from metrics import latency_summary, LatencyTracker
+from traffic import MessageEncoder, TrafficGenerator, TRAFFIC_CONFIGS
+from workers import run_in_workers, LoadWorker, WorkerError, ShardedUDPServer, aggregate
 from message_sequence import MessageSequence
+from profiling import PhaseTimer, KeywordProfiler
 from templates import Protocol, UInt, Int, PDU, MessageTemplate, Char, Binary, \
     StructTemplate, ListTemplate, UnionTemplate, BinaryContainerTemplate
 from binary_tools import to_0xhex, to_bin
@@ -29,8 +35,24 @@ class RammbockCore(object):
 
     ROBOT_LIBRARY_SCOPE = 'GLOBAL'
 
-    def __init__(self):
+    def __init__(self, profile_phases=False):
+        """Setting `profile_phases` to true enables timing the phases of
+        sending and receiving messages. See `Log Phase Timings` for details.
+
+        Examples:
+        | Library | Rammbock | profile_phases=True |
+        """
         self._init_caches()
+        self._profiler = KeywordProfiler()
+        self._phase_timer = None
+        if str(profile_phases).lower() not in ('', 'false', 'no', 'none', '0'):
+            self._enable_phase_timer()
+
+    def _enable_phase_timer(self):
+        self._phase_timer = PhaseTimer()
+        self._phase_timer.install(self, [('parameters', '_parse_parameters'),
+                                         ('validate', '_validate_message')])
+        self.ROBOT_LIBRARY_LISTENER = self._phase_timer
 
     def _init_caches(self):
         self._protocol_in_progress = None
@@ -42,6 +64,7 @@ class RammbockCore(object):
         self._field_values = {}
         self._message_sequence = MessageSequence()
         self._message_templates = {}
+        self._latencies = LatencyTracker()
 
     @property
     def _current_container(self):
@@ -69,7 +92,9 @@ class RammbockCore(object):
         for client in self._clients:
             client.empty()
         for server in self._servers:
-            server.empty()
+            # Shards of sharded UDP servers handle all their messages.
+            if not isinstance(server, ShardedUDPServer):
+                server.empty()
 
     def new_protocol(self, protocol_name):
         """Start defining a new protocol template.
@@ -90,38 +115,61 @@ class RammbockCore(object):
         self._protocols[protocol.name] = protocol
         self._protocol_in_progress = False
 
-    def start_udp_server(self, ip, port, name=None, timeout=None, protocol=None):
+    def start_udp_server(self, ip, port, name=None, timeout=None, protocol=None, **socket_options):
         """Starts a new UDP server to given `ip` and `port`.
 
         Server can be given a `name`, default `timeout` and a `protocol`.
+        Socket options can be given as extra named arguments like with
+        `Start TCP Server`.
 
         Examples:
         | Start UDP server | 10.10.10.2 | 53 |
         | Start UDP server | 10.10.10.2 | 53 | Server1 |
         | Start UDP server | 10.10.10.2 | 53 | name=Server1 | protocol=GTPV2 |
         | Start UDP server | 10.10.10.2 | 53 | timeout=5 |
+        | Start UDP server | 10.10.10.2 | 53 | rcvbuf=4M | reuseport=true |
         """
-        self._start_server(UDPServer, ip, port, name, timeout, protocol)
+        self._start_server(UDPServer, ip, port, name, timeout, protocol, socket_options=socket_options)
 
-    def start_tcp_server(self, ip, port, name=None, timeout=None, protocol=None):
+    def start_tcp_server(self, ip, port, name=None, timeout=None, protocol=None, backlog=None, idle_timeout=None,
+                         **socket_options):
         """Starts a new TCP server to given `ip` and `port`.
 
         Server can be given a `name`, default `timeout` and a `protocol`.
+        `backlog` is the number of pending connections the operating system
+        queues before refusing new ones (default 5). Connections that have not
+        sent or received anything in `idle_timeout` seconds are closed by
+        `Remove Closed Connections`.
         Notice that you have to use `Accept Connection` keyword for server to
         receive connections.
 
+        Socket options can be given as extra named arguments. `nodelay=true`
+        sends small messages immediately instead of waiting to combine them
+        (Nagle's algorithm), `quickack=true` acknowledges received data
+        immediately, `rcvbuf` and `sndbuf` set the kernel buffer sizes in
+        bytes with optional `K`, `M` or `G` suffix, `reuseport=true` allows
+        several sockets to bind to the same port and `busy_poll` sets the
+        busy polling time in microseconds. Options that are not available on
+        the platform or for the transport cause an error. Accepted
+        connections get the options of the server.
+
         Examples:
         | Start TCP server | 10.10.10.2 | 53 |
         | Start TCP server | 10.10.10.2 | 53 | Server1 |
         | Start TCP server | 10.10.10.2 | 53 | name=Server1 | protocol=GTPV2 |
         | Start TCP server | 10.10.10.2 | 53 | timeout=5 |
+        | Start TCP server | 10.10.10.2 | 53 | backlog=1024 | idle_timeout=60 |
+        | Start TCP server | 10.10.10.2 | 53 | nodelay=true | rcvbuf=4M | sndbuf=4M |
         """
-        self._start_server(TCPServer, ip, port, name, timeout, protocol)
+        self._start_server(TCPServer, ip, port, name, timeout, protocol,
+                           backlog=backlog, idle_timeout=idle_timeout, socket_options=socket_options)
 
-    def start_sctp_server(self, ip, port, name=None, timeout=None, protocol=None):
+    def start_sctp_server(self, ip, port, name=None, timeout=None, protocol=None, backlog=None, idle_timeout=None,
+                          **socket_options):
         """Starts a new STCP server to given `ip` and `port`.
         pysctp (https://github.com/philpraxis/pysctp) need to be installed your system.
-        Server can be given a `name`, default `timeout` and a `protocol`.
+        Server can be given a `name`, default `timeout`, a `protocol`, listen
+        `backlog`, `idle_timeout` and socket options like with `Start TCP Server`.
         Notice that you have to use `Accept Connection` keyword for server to
         receive connections.
 
@@ -131,49 +179,58 @@ class RammbockCore(object):
         | Start STCP server | 10.10.10.2 | 53 | name=Server1 | protocol=GTPV2 |
         | Start STCP server | 10.10.10.2 | 53 | timeout=5 |
         """
-        self._start_server(SCTPServer, ip, port, name, timeout, protocol)
+        self._start_server(SCTPServer, ip, port, name, timeout, protocol,
+                           backlog=backlog, idle_timeout=idle_timeout, socket_options=socket_options)
 
-    def _start_server(self, server_class, ip, port, name=None, timeout=None, protocol=None):
+    def _start_server(self, server_class, ip, port, name=None, timeout=None, protocol=None, **options):
         protocol = self._get_protocol(protocol)
-        server = server_class(ip=ip, port=port, timeout=timeout, protocol=protocol)
+        server = server_class(ip=ip, port=port, timeout=timeout, protocol=protocol, **options)
         return self._servers.add(server, name)
 
-    def start_udp_client(self, ip=None, port=None, name=None, timeout=None, protocol=None):
+    def start_udp_client(self, ip=None, port=None, name=None, timeout=None, protocol=None, **socket_options):
         """Starts a new UDP client.
 
         Client can be optionally given `ip` and `port` to bind to, as well as
         `name`, default `timeout` and a `protocol`. You should use `Connect`
         keyword to connect client to a host.
+        Socket options can be given as extra named arguments like with
+        `Start TCP Server`.
 
         Examples:
         | Start UDP client |
         | Start UDP client | name=Client1 | protocol=GTPV2 |
         | Start UDP client | 10.10.10.2 | 53 | name=Server1 | protocol=GTPV2 |
         | Start UDP client | timeout=5 |
+        | Start UDP client | rcvbuf=4M |
         """
-        self._start_client(UDPClient, ip, port, name, timeout, protocol)
+        self._start_client(UDPClient, ip, port, name, timeout, protocol, socket_options)
 
-    def start_tcp_client(self, ip=None, port=None, name=None, timeout=None, protocol=None):
+    def start_tcp_client(self, ip=None, port=None, name=None, timeout=None, protocol=None, **socket_options):
         """Starts a new TCP client.
 
         Client can be optionally given `ip` and `port` to bind to, as well as
         `name`, default `timeout` and a `protocol`. You should use `Connect`
         keyword to connect client to a host.
+        Socket options can be given as extra named arguments like with
+        `Start TCP Server`.
 
         Examples:
         | Start TCP client |
         | Start TCP client | name=Client1 | protocol=GTPV2 |
         | Start TCP client | 10.10.10.2 | 53 | name=Server1 | protocol=GTPV2 |
         | Start TCP client | timeout=5 |
+        | Start TCP client | nodelay=true | quickack=true |
         """
-        self._start_client(TCPClient, ip, port, name, timeout, protocol)
+        self._start_client(TCPClient, ip, port, name, timeout, protocol, socket_options)
 
-    def start_sctp_client(self, ip=None, port=None, name=None, timeout=None, protocol=None):
+    def start_sctp_client(self, ip=None, port=None, name=None, timeout=None, protocol=None, **socket_options):
         """Starts a new SCTP client.
 
         Client can be optionally given `ip` and `port` to bind to, as well as
         `name`, default `timeout` and a `protocol`. You should use `Connect`
         keyword to connect client to a host.
+        Socket options can be given as extra named arguments like with
+        `Start TCP Server`.
 
         Examples:
         | Start TCP client |
@@ -181,15 +238,114 @@ class RammbockCore(object):
         | Start TCP client | 10.10.10.2 | 53 | name=Server1 | protocol=GTPV2 |
         | Start TCP client | timeout=5 |
         """
-        self._start_client(SCTPClient, ip, port, name, timeout, protocol)
+        self._start_client(SCTPClient, ip, port, name, timeout, protocol, socket_options)
 
-    def _start_client(self, client_class, ip=None, port=None, name=None, timeout=None, protocol=None):
+    def _start_client(self, client_class, ip=None, port=None, name=None, timeout=None, protocol=None,
+                      socket_options=None):
         protocol = self._get_protocol(protocol)
-        client = client_class(timeout=timeout, protocol=protocol)
+        client = client_class(timeout=timeout, protocol=protocol, socket_options=socket_options)
         if ip or port:
             client.set_own_ip_and_port(ip=ip, port=port)
         return self._clients.add(client, name)
 
+    def start_unix_server(self, path, name=None, timeout=None, protocol=None, type='stream', backlog=None,
+                          idle_timeout=None, **socket_options):
+        """Starts a new Unix domain socket server bound to socket file `path`.
+
+        Unix domain sockets connect processes on the same host without the
+        overhead of TCP or UDP over the loopback interface. `type` is either
+        `stream` (default), which works like TCP, or `datagram`, which works
+        like UDP. Server can be given a `name`, default `timeout` and a
+        `protocol`, and stream servers also a listen `backlog` and an
+        `idle_timeout` like with `Start TCP Server`. Of the socket options of
+        `Start TCP Server`, `rcvbuf` and `sndbuf` apply to Unix domain
+        sockets. The socket file is removed when the server is closed.
+
+        Examples:
+        | Start Unix server | /tmp/rammbock.sock |
+        | Start Unix server | /tmp/rammbock.sock | name=Server1 | protocol=GTPV2 |
+        | Start Unix server | /tmp/rammbock.sock | type=datagram |
+        """
+        protocol = self._get_protocol(protocol)
+        if self._unix_classes(type)[0] is UnixStreamServer:
+            server = UnixStreamServer(path, timeout=timeout, protocol=protocol, backlog=backlog,
+                                      idle_timeout=idle_timeout, socket_options=socket_options)
+        else:
+            server = UnixDatagramServer(path, timeout=timeout, protocol=protocol, socket_options=socket_options)
+        self._servers.add(server, name)
+
+    def start_unix_client(self, path=None, name=None, timeout=None, protocol=None, type='stream', **socket_options):
+        """Starts a new Unix domain socket client.
+
+        Client can be optionally bound to socket file `path` and given a
+        `name`, default `timeout`, a `protocol`, socket `type` and socket
+        options like with `Start Unix Server`. Clients are connected to a server with `Connect`
+        using the socket file of the server as the host.
+
+        Examples:
+        | Start Unix client |
+        | Start Unix client | name=Client1 | protocol=GTPV2 | type=datagram |
+        | Connect | /tmp/rammbock.sock |
+        """
+        client = self._unix_classes(type)[1](timeout=timeout, protocol=self._get_protocol(protocol),
+                                             socket_options=socket_options)
+        if path:
+            client.set_own_path(path)
+        self._clients.add(client, name)
+
+    def _unix_classes(self, type):
+        classes = {'stream': (UnixStreamServer, UnixStreamClient),
+                   'datagram': (UnixDatagramServer, UnixDatagramClient)}
+        try:
+            return classes[type.lower()]
+        except KeyError:
+            raise AssertionError("Unknown Unix socket type '%s'. Use 'stream' or 'datagram'." % type)
+
+    def start_loopback_server(self, name=None, timeout=None, protocol=None, idle_timeout=None):
+        """Starts a new loopback server for clients in the same test process.
+
+        Loopback servers and clients exchange messages over socket pairs, so
+        no ports are bound and messages do not pass through the network
+        stack. They are handy for testing message templates and benchmarking
+        Rammbock itself, and parallel test runs can not collide on ports.
+        Server can be given a `name`, default `timeout`, a `protocol` and an
+        `idle_timeout` like with `Start TCP Server`. Connections from
+        `Start Loopback Client` are accepted with `Accept Connection`.
+
+        Examples:
+        | Start loopback server |
+        | Start loopback server | name=Server1 | protocol=GTPV2 |
+        """
+        server = LoopbackServer(timeout=timeout, protocol=self._get_protocol(protocol),
+                                idle_timeout=idle_timeout)
+        self._servers.add(server, name)
+
+    def start_loopback_client(self, server=None, name=None, timeout=None, protocol=None):
+        """Starts a new loopback client connected to loopback `server` or the
+        latest server if `server` is not given.
+
+        Client can be given a `name`, default `timeout` and a `protocol`. The
+        client is connected when it is started, so `Connect` is not used with
+        loopback clients. See `Start Loopback Server`.
+
+        Examples:
+        | Start loopback client |
+        | Start loopback client | Server1 | name=Client1 | protocol=GTPV2 |
+        """
+        loopback_server = self._get_loopback_server(server)
+        client = LoopbackClient(timeout=timeout, protocol=self._get_protocol(protocol))
+        client.connect_to_server(loopback_server)
+        self._clients.add(client, name)
+
+    def _get_loopback_server(self, name):
+        try:
+            server = self._servers.get(name)
+        except KeyError:
+            raise AssertionError("No server named '%s'." % name)
+        if not isinstance(server, LoopbackServer):
+            raise AssertionError("Server '%s' is not a loopback server." % self._servers.get_name(name))
+        return server
+
     def _get_protocol(self, protocol):
         try:
             protocol = self._protocols[protocol] if protocol else None
@@ -210,6 +366,10 @@ class RammbockCore(object):
         If given an `alias`, the connection is named and can be later referenced
         with that name.
 
+        On UDP servers this names the peer that sent the oldest unread
+        datagram and has not been accepted before. Messages can then be sent
+        to and received from that peer with the alias.
+
         Examples:
         | Accept connection |
         | Accept connection | Server1 | my_connection |
@@ -217,17 +377,134 @@ class RammbockCore(object):
         server = self._servers.get(name)
         server.accept_connection(alias)
 
-    def connect(self, host, port, name=None):
+    def accept_connections(self, name=None, count=None, alias=None, timeout=None):
+        """Accepts several connections to server identified by `name` or the
+        latest server if `name` is empty. Returns the number of accepted
+        connections.
+
+        Without `count` all connections that are already pending are
+        accepted. With `count` the server waits at most `timeout` for each
+        connection until `count` connections have been accepted. If given an
+        `alias`, the connections are named with the alias followed by a
+        running number, e.g. `conn1`, `conn2`.
+
+        Examples:
+        | Accept connections |
+        | ${accepted} = | Accept connections | Server1 | count=1000 | alias=conn | timeout=5 |
+        """
+        server = self._servers.get(name)
+        return len(server.accept_connections(count, alias, timeout))
+
+    def start_accepting_connections(self, name=None, alias=None):
+        """Starts accepting connections to server identified by `name` in the
+        background until `Stop Accepting Connections` is called.
+
+        Connections are named like with `Accept Connections`. They do not
+        change the default connection of the server, unless the server has no
+        connections yet, so use their names to receive from them. Connections
+        cannot be accepted with `Accept Connection` or `Accept Connections`
+        while accepting in background.
+
+        Examples:
+        | Start accepting connections | Server1 | alias=conn |
+        | Connect TCP clients | 1000 | 127.0.0.1 | 8080 |
+        | Stop accepting connections | Server1 |
+        """
+        self._servers.get(name).start_accepting(alias)
+
+    def stop_accepting_connections(self, name=None):
+        """Stops accepting connections started with `Start Accepting Connections`.
+        """
+        self._servers.get(name).stop_accepting()
+
+    def close_connection(self, name=None, alias=None):
+        """Closes a connection of server identified by `name` or the latest
+        server if `name` is empty. Closes the connection with `alias` or the
+        latest connection if `alias` is not given.
+
+        Examples:
+        | Close connection |
+        | Close connection | Server1 | my_connection |
+        """
+        self._servers.get(name).close_connection(alias)
+
+    def remove_closed_connections(self, name=None):
+        """Closes and removes connections of server identified by `name` that
+        have been closed by the client or have been idle longer than the
+        `idle_timeout` given when starting the server. Returns the number of
+        removed connections. Connections having received messages that have
+        not been read yet are not removed.
+
+        Connections are never removed automatically, only when this keyword
+        is used.
+
+        Examples:
+        | ${removed} = | Remove closed connections | Server1 |
+        """
+        return len(self._servers.get(name).reap_connections())
+
+    def connect(self, host, port=None, name=None):
         """Connects a client to given `host` and `port`. If client `name` is not
-        given then connects the latest client.
+        given then connects the latest client. Unix domain socket clients are
+        connected to the socket file of the server given as `host`.
 
         Examples:
         | Connect | 127.0.0.1 | 8080 |
         | Connect | 127.0.0.1 | 8080 | Client1 |
+        | Connect | /tmp/rammbock.sock | name=Client1 |
         """
         client = self._clients.get(name)
         client.connect_to(host, port)
 
+    def connect_tcp_clients(self, count, host, port, name=None, timeout=None, protocol=None):
+        """Starts `count` new TCP clients and connects them concurrently to
+        given `host` and `port`.
+
+        Connects do not block each other, so setting up thousands of clients
+        takes about as long as the slowest connect. Clients are named `name`
+        followed by a running number, or with default client names if `name`
+        is not given. `timeout` is the default timeout of the clients and the
+        maximum time to wait for the connects. Clients that fail to connect
+        are closed and not added.
+
+        Returns a dictionary with `connected` and `failed` client counts,
+        connect latency percentiles `p50`, `p90`, `p99` and `max` in
+        milliseconds and `errors` with count of each failure reason.
+
+        Examples:
+        | ${stats} = | Connect TCP clients | 1000 | 127.0.0.1 | 8080 |
+        | ${stats} = | Connect TCP clients | 1000 | 127.0.0.1 | 8080 | name=Client | protocol=GTPV2 |
+        | Should be equal as integers | ${stats['failed']} | 0 |
+        """
+        return self._connect_clients(TCPClient, count, host, port, name, timeout, protocol)
+
+    def connect_sctp_clients(self, count, host, port, name=None, timeout=None, protocol=None):
+        """Starts `count` new SCTP clients and connects them concurrently to
+        given `host` and `port`.
+
+        See `Connect TCP clients` for details.
+        """
+        return self._connect_clients(SCTPClient, count, host, port, name, timeout, protocol)
+
+    def _connect_clients(self, client_class, count, host, port, name, timeout, protocol):
+        protocol = self._get_protocol(protocol)
+        clients = [client_class(timeout=timeout, protocol=protocol) for _ in range(int(count))]
+        results = connect_clients(clients, host, port, timeout=timeout)
+        latencies, errors = [], {}
+        for index, (client, result) in enumerate(zip(clients, results)):
+            if isinstance(result, Exception):
+                errors[str(result)] = errors.get(str(result), 0) + 1
+            else:
+                latencies.append(result)
+                self._clients.add(client, '%s%d' % (name, index + 1) if name else None)
+        stats = latency_summary(latencies)
+        stats.update({'connected': len(latencies), 'failed': len(clients) - len(latencies), 'errors': errors})
+        logger.info('Connected %d clients to %s:%s, %d failed. Connect latency p50 %s ms, p99 %s ms, max %s ms.' %
+                    (stats['connected'], host, port, stats['failed'], stats['p50'], stats['p99'], stats['max']))
+        for error, count in errors.items():
+            logger.info('%d connects failed: %s' % (count, error))
+        return stats
+
     def _register_send(self, sender, label, name, connection=None):
         self._message_sequence.send(name, sender.get_own_address(), sender.get_peer_address(alias=connection),
                                     sender.protocol_name, label)
@@ -320,8 +597,14 @@ class RammbockCore(object):
         Optional parameters are default values for message header separated with
         colon.
 
+        With config `lazy=true` received messages are decoded lazily: fields
+        with a static length are decoded only when they are accessed, for
+        example when they are validated. This makes receiving large messages
+        of which only a few fields are checked faster.
+
         Examples:
         | New message | MyMessage | MyProtocol | header_field:value |
+        | New message | MyMessage | MyProtocol | header_field:value | lazy=true |
         """
         proto = self._get_protocol(protocol)
         if not proto:
@@ -329,8 +612,9 @@ class RammbockCore(object):
         if self._protocol_in_progress:
             raise Exception("Protocol definition in progress. Please finish it before starting to define a message.")
         configs, fields, header_fields = self._parse_parameters(parameters)
+        lazy = str(configs.pop('lazy', '')).lower() not in ('', 'false', 'no', 'none', '0')
         self._raise_error_if_configs_or_fields(configs, fields, 'New message')
-        self._init_new_message_stack(MessageTemplate(message_name, proto, header_fields))
+        self._init_new_message_stack(MessageTemplate(message_name, proto, header_fields, lazy=lazy))
 
     def _raise_error_if_configs_or_fields(self, configs, fields, function):
         if configs or fields:
@@ -392,7 +676,7 @@ class RammbockCore(object):
         | Client sends message | field_name:value | field_name2:value |
         | Client sends message | name=Client1 | header:message_code:0x32 |
         """
-        self._send_message(self.client_sends_binary, parameters)
+        self._send_message(self._clients, self.client_sends_binary, parameters)
 
     # FIXME: support "send to" somehow. A new keyword?
     def server_sends_message(self, *parameters):
@@ -407,12 +691,363 @@ class RammbockCore(object):
         | Server sends message | field_name:value | field_name2:value |
         | Server sends message | name=Server1 | connection=my_connection | header:message_code:0x32 |
         """
-        self._send_message(self.server_sends_binary, parameters)
+        self._send_message(self._servers, self.server_sends_binary, parameters)
 
-    def _send_message(self, callback, parameters):
+    def _send_message(self, nodes, callback, parameters):
         configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
         msg = self._encode_message(message_fields, header_fields)
-        callback(msg._raw, label=self._current_container.name, **configs)
+        # Segments are sent without joining them to one string first.
+        callback(msg._raw_segments, label=self._current_container.name, **configs)
+        if self._latencies.is_tracked(self._current_container.name):
+            self._latencies.seen(nodes.get_name(configs.get('name')), self._current_container.name, msg)
+
+    def client_streams_message(self, *parameters):
+        """Send a message defined with `New Message` while it is being encoded.
+
+        The message is sent in chunks as it is encoded instead of building it
+        in memory first. Lists directly in the message are encoded one
+        element at a time, so messages of hundreds of megabytes can be sent
+        with bounded memory. Over UDP the message is still sent as one
+        datagram.
+
+        The header is sent first, so the PDU `length` in bytes must be given
+        unless all fields of the message have a static length. Fields that
+        other fields refer to as their length must also be given a value.
+        Streamed messages are not logged and their latency is not measured.
+
+        Optional parameters are client `name` and `length` separated with
+        equals and message field values like with `Client Sends Message`.
+
+        Examples:
+        | Client streams message |
+        | Client streams message | length=104857604 | count:26214400 | name=Client1 |
+        """
+        self._stream_message(self._clients, parameters)
+
+    def server_streams_message(self, *parameters):
+        """Send a message defined with `New Message` while it is being encoded.
+
+        Optional parameters are server `name` and `connection` alias in
+        addition to parameters described in `Client Streams Message`.
+
+        Examples:
+        | Server streams message | length=104857604 | connection=my_connection |
+        """
+        self._stream_message(self._servers, parameters)
+
+    def _stream_message(self, nodes, parameters):
+        configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
+        node, name = nodes.get_with_name(configs.pop('name', None))
+        connection = configs.pop('connection', None)
+        length = configs.pop('length', None)
+        if configs:
+            raise AssertionError('Unknown configs when streaming message: %s' %
+                                 ', '.join('%s=%s' % item for item in sorted(configs.items())))
+        chunks = self._get_message_template().encode_stream(message_fields, header_fields, length=length)
+        node.send_stream(chunks, alias=connection)
+        self._register_send(node, self._current_container.name, name, connection=connection)
+
+    def client_sends_messages_at_rate(self, rate, *parameters):
+        """Sends messages defined with `New Message` at given `rate` of messages
+        per second.
+
+        Optional parameters are client `name`, `count` of messages to send,
+        `duration` of sending in seconds and `burst`, the number of messages
+        that may be sent back to back to catch up with the rate (default is
+        10 milliseconds worth of messages), separated with equals. Either
+        `count` or `duration` must be given. Message field values are given
+        like with `Client Sends Message`.
+
+        Field values can be generated separately for each message:
+        `{counter}`, `{counter:start}` and `{counter:start:step}` produce a
+        running number and `{random:min:max}` a random number. Messages are
+        sent without logging each of them. Returns a dictionary with the
+        number of `sent` and `failed` messages, socket `errors`, sending
+        `duration`, achieved `rate` and send `jitter` percentiles in
+        milliseconds.
+
+        Examples:
+        | ${stats} = | Client sends messages at rate | 1000 | count=5000 |
+        | ${stats} = | Client sends messages at rate | 500 | duration=10 | name=Client1 | sequence:{counter:1} |
+        | Should be equal as integers | ${stats['failed']} | 0 |
+        """
+        return self._send_messages_at_rate(self._clients, rate, parameters)
+
+    def server_sends_messages_at_rate(self, rate, *parameters):
+        """Sends messages defined with `New Message` at given `rate` of messages
+        per second.
+
+        Optional parameters are server `name` and `connection` alias in
+        addition to parameters described in `Client Sends Messages At Rate`.
+
+        Examples:
+        | ${stats} = | Server sends messages at rate | 1000 | duration=10 | connection=my_connection |
+        """
+        return self._send_messages_at_rate(self._servers, rate, parameters)
+
+    def _send_messages_at_rate(self, nodes, rate, parameters):
+        configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
+        self._raise_error_if_unknown_traffic_configs(configs, ('name', 'connection'))
+        node, name = nodes.get_with_name(configs.pop('name', None))
+        connection = configs.pop('connection', None)
+        encoder = MessageEncoder(self._get_message_template(), message_fields, header_fields)
+        generator = TrafficGenerator(lambda msg: node.send(msg, alias=connection, log=False),
+                                     encoder.encode, rate, **configs)
+        stats = generator.run()
+        logger.info('%s sent %d messages in %.3f s at %.1f messages/s (target %s), %d failed. '
+                    'Send jitter p50 %s ms, p99 %s ms, max %s ms.' %
+                    (name, stats['sent'], stats['duration'], stats['rate'], rate, stats['failed'],
+                     stats['jitter']['p50'], stats['jitter']['p99'], stats['jitter']['max']))
+        return stats
+
+    def _raise_error_if_unknown_traffic_configs(self, configs, node_configs):
+        valid = node_configs + TRAFFIC_CONFIGS
+        unknown = sorted(name for name in configs if name not in valid)
+        if unknown:
+            raise AssertionError('Unknown configs when sending messages at rate: %s. Valid configs are %s.' %
+                                 (', '.join(unknown), ', '.join(valid)))
+
+    def workers_send_messages_at_rate(self, workers, rate, host, port, *parameters):
+        """Sends messages defined with `New Message` to `host` and `port` from
+        `workers` parallel processes at given total `rate` of messages per
+        second.
+
+        Worker processes are forked from the test process, so they share the
+        protocols and message templates defined before calling this. Each
+        worker connects its own clients and sends its share of the `rate` and
+        `count`. The keyword returns after all workers have finished.
+
+        Optional parameters are `transport` of the clients (`udp` (default),
+        `tcp` or `sctp`), number of `clients` in each worker (default 1),
+        client `timeout` and `count`, `duration` and `burst` like with `Client
+        Sends Messages At Rate`, separated with equals. Message field values,
+        including generators, are given like with `Client Sends Messages At
+        Rate`. Generated values are unique over all workers.
+
+        Returns the combined counters and send `jitter` percentiles of all
+        workers like `Client Sends Messages At Rate`, and the statistics of
+        each worker in `workers`. Fails if a worker fails to start its clients.
+        Requires a platform with `os.fork`.
+
+        Examples:
+        | ${stats} = | Workers send messages at rate | 4 | 100000 | 127.0.0.1 | 8080 | duration=10 | sequence:{counter} |
+        | ${stats} = | Workers send messages at rate | 2 | 5000 | 127.0.0.1 | 8080 | transport=tcp | clients=50 | count=50000 |
+        | Should be equal as integers | ${stats['failed']} | 0 |
+        """
+        workers = int(workers)
+        configs, message_fields, header_fields = self._get_parameters_with_defaults(parameters)
+        self._raise_error_if_unknown_traffic_configs(configs, ('transport', 'clients', 'timeout'))
+        client_class = self._get_client_class(configs.pop('transport', 'udp'))
+        clients = int(configs.pop('clients', 1))
+        timeout = configs.pop('timeout', None)
+        encoder = MessageEncoder(self._get_message_template(), message_fields, header_fields)
+
+        def task(worker):
+            nodes = [client_class(timeout=timeout) for _ in range(clients)]
+            for node in nodes:
+                node.connect_to(host, port)
+            return LoadWorker(worker, workers, nodes, encoder.encode, rate, **configs).run()
+        results = run_in_workers(workers, task)
+        failures = [str(result) for result in results if isinstance(result, WorkerError)]
+        if failures:
+            raise AssertionError('\n'.join(failures))
+        stats = aggregate(results)
+        logger.info('%d workers sent %d messages to %s:%s in %.3f s at %.1f messages/s (target %s), %d failed. '
+                    'Send jitter p50 %s ms, p99 %s ms, max %s ms.' %
+                    (workers, stats['sent'], host, port, stats['duration'], stats['rate'], rate, stats['failed'],
+                     stats['jitter']['p50'], stats['jitter']['p99'], stats['jitter']['max']))
+        for index, worker_stats in enumerate(stats['workers']):
+            logger.info('Worker %d sent %d messages at %.1f messages/s, %d failed.' %
+                        (index, worker_stats['sent'], worker_stats['rate'], worker_stats['failed']))
+        return stats
+
+    def start_sharded_udp_server(self, shards, ip, port, *parameters):
+        """Starts a UDP server with `shards` sockets bound to `ip` and `port`,
+        each served by its own process.
+
+        The sockets share the address with `SO_REUSEPORT` and the operating
+        system spreads datagrams over them by sender address, so one server
+        is not limited to one CPU core. Every shard receives messages with the
+        template defined with `New Message` or `Load Template`, and counts
+        messages that do not match the field values like with `Server
+        Receives Message`. Shard processes are forked from the test process,
+        so they share the protocols and templates defined before this.
+
+        Optional parameters are server `name`, `timeout`, `response` and
+        socket options like with `Start UDP Server`, separated with equals.
+        `response` is the name of a template saved with `Save Template` that
+        shards send back to the sender of every received message.
+
+        Shards run until `Stop Sharded UDP Server`, which returns their
+        statistics. Requires a platform with `os.fork` and `SO_REUSEPORT`.
+
+        Examples:
+        | Start sharded UDP server | 4 | 127.0.0.1 | 53 | name=Resolver | response=DNS answer |
+        | Start sharded UDP server | 8 | 127.0.0.1 | 53 | id:0x1234 | rcvbuf=4M |
+        """
+        configs, message_fields, _ = self._get_parameters_with_defaults(parameters)
+        name = configs.pop('name', None)
+        timeout = configs.pop('timeout', None)
+        response = configs.pop('response', None)
+        respond = self._get_saved_template_encoder(response).encode if response else None
+        server = ShardedUDPServer(ip, port, shards, self._get_message_template(), dict(message_fields), respond,
+                                  timeout=timeout, socket_options=configs)
+        self._servers.add(server, name)
+
+    def _get_saved_template_encoder(self, name):
+        if name not in self._message_templates:
+            raise AssertionError("No template '%s' saved." % name)
+        template, fields = self._message_templates[name]
+        return MessageEncoder(template, dict(fields), {})
+
+    def stop_sharded_udp_server(self, name=None):
+        """Stops the shards of server `name` started with `Start Sharded UDP
+        Server` and returns their combined statistics.
+
+        Statistics contain the node counters of `Get Node Statistics` and the
+        number of `received`, `responded` and `invalid` messages summed over
+        all shards, and the statistics of each shard in `shards`. Datagrams
+        that could not be decoded or handled, or did not match the template,
+        are counted as `failed`. The counters
+        are also available with `Get Node Statistics` after this.
+
+        Examples:
+        | ${stats} = | Stop sharded UDP server | Resolver |
+        | Should be equal as integers | ${stats['invalid']} | 0 |
+        """
+        server, name = self._servers.get_with_name(name)
+        if not isinstance(server, ShardedUDPServer):
+            raise AssertionError("Server '%s' is not a sharded UDP server." % name)
+        stats = server.stop()
+        logger.info('%s received %d messages in %d shards, %d invalid, %d failed, %d responded.' %
+                    (name, stats['received'], len(stats['shards']), stats['invalid'], stats['failed'],
+                     stats['responded']))
+        for index, shard in enumerate(stats['shards']):
+            logger.info('Shard %d received %d messages in %.3f s.' % (index, shard['received'], shard['duration']))
+        return stats
+
+    def _get_client_class(self, transport):
+        try:
+            return {'udp': UDPClient, 'tcp': TCPClient, 'sctp': SCTPClient}[transport.lower()]
+        except KeyError:
+            raise AssertionError("Unknown transport '%s'. Use udp, tcp or sctp." % transport)
+
+    def measure_latency(self, start, end, correlation=None):
+        """Starts measuring latency from messages of template `start` to
+        messages of template `end` on the same client or server.
+
+        Both sent and received messages count, so a client sending a request
+        and receiving a response measures round trip time and a server
+        receiving a request and sending the response measures its processing
+        time. Messages are paired using the value of the optional
+        `correlation` field, e.g. a sequence number, and otherwise in the
+        order they are seen. Header fields are referred with `header.` prefix.
+
+        Latencies are collected per node and `start` template and can be read
+        with `Get Latency`. Only messages sent and received with message
+        keywords are measured, not binary messages or messages sent at rate.
+
+        Examples:
+        | Measure latency | FooRequest | FooResponse |
+        | Measure latency | EchoRequest | EchoResponse | correlation=header.sequence |
+        """
+        self._latencies.track(start, end, correlation)
+
+    def get_latency(self, template, name=None):
+        """Returns latency statistics of messages of `template` measured with
+        `Measure Latency`.
+
+        Statistics are combined over all clients and servers unless node
+        `name` is given. Returns a dictionary with `count` of measurements and
+        `mean`, `p50`, `p90`, `p99` and `max` latencies in milliseconds.
+
+        Examples:
+        | ${latency} = | Get latency | FooRequest |
+        | ${latency} = | Get latency | FooRequest | name=Client1 |
+        | Should be true | ${latency['p99']} < 10 |
+        """
+        stats = self._latencies.combined(template, name).summary()
+        logger.info('%s latency of %d messages: p50 %s ms, p99 %s ms, max %s ms.' %
+                    (template, stats['count'], stats['p50'], stats['p99'], stats['max']))
+        return stats
+
+    def reset_latencies(self):
+        """Discards measured latencies and unanswered messages. Latency
+        measurements defined with `Measure Latency` are kept.
+        """
+        self._latencies.reset()
+
+    def get_node_statistics(self, name=None):
+        """Returns traffic counters of server or client `name`.
+
+        Counters are `messages_sent`, `bytes_sent`, `messages_received`,
+        `bytes_received`, `decode_failures`, `cache_hits`, `cache_misses`,
+        `timeouts`, `evictions` and `connections_reaped`. Messages received
+        with binary keywords only count to `bytes_received`. Cache hits are
+        messages found among earlier received messages that did not match the
+        template then and evictions are such messages discarded unread.
+        Counters of a TCP or SCTP server include all its connections.
+
+        If `name` is not given, returns a dictionary with counters of all
+        servers and clients by their names. If a server and a client have the
+        same name, the server is used.
+
+        Examples:
+        | ${stats} = | Get node statistics | Client1 |
+        | Should be equal as integers | ${stats['decode_failures']} | 0 |
+        | ${all} = | Get node statistics |
+        """
+        if name:
+            stats = self._get_node(name).get_statistics()
+            logger.info('%s: %s' % (name, ', '.join('%s %d' % item for item in sorted(stats.items()))))
+            return stats
+        return dict((node_name, node.get_statistics())
+                    for node_name, node in self._clients.items() + self._servers.items())
+
+    def reset_node_statistics(self, name=None):
+        """Resets traffic counters of server or client `name`, or of all servers
+        and clients if `name` is not given.
+
+        Examples:
+        | Reset node statistics |
+        | Reset node statistics | Server1 |
+        """
+        nodes = [self._get_node(name)] if name else list(self._clients) + list(self._servers)
+        for node in nodes:
+            node.reset_statistics()
+
+    def log_phase_timings(self):
+        """Logs time spent in each phase of sending and receiving messages per
+        keyword.
+
+        Phases are parsing keyword `parameters`, template `encode`, `raw
+        assembly` of the encoded message, `socket I/O`, `framing` messages
+        from received data, `decode` and `validate`. Time of the keyword not
+        spent in any of these, e.g. logging, is reported as `other`. Times of
+        nested phases are not included in the outer phase.
+
+        Phases are only timed when the library is imported with
+        `profile_phases=True`, otherwise the timing costs nothing and this
+        keyword only logs a note.
+
+        Examples:
+        | Log phase timings |
+        """
+        if not self._phase_timer:
+            logger.info('Phase timing is not enabled. Import Rammbock with profile_phases=True to enable it.')
+            return
+        logger.info(self._phase_timer.format_breakdown())
+
+    def reset_phase_timings(self):
+        """Discards phase timings collected so far. See `Log Phase Timings`."""
+        if self._phase_timer:
+            self._phase_timer.reset()
+
+    def _get_node(self, name):
+        for nodes in (self._servers, self._clients):
+            if name in nodes:
+                return nodes.get(name)
+        raise AssertionError("No server or client named '%s'." % name)
 
     def client_receives_message(self, *parameters):
         """Receive a message with template defined using `New Message` and
@@ -478,6 +1113,55 @@ class RammbockCore(object):
         with self._receive(self._servers, *parameters) as (msg, _):
             return msg
 
+    def client_receives_message_incrementally(self, *parameters):
+        """Receive a message whose last field is a list and validate the list
+        elements one at a time as their data arrives.
+
+        Unlike with `Client Receives Message`, the elements are not kept in
+        memory, so messages with millions of elements, e.g. bulk measurement
+        uploads, can be validated and counted. Fields before the list and the
+        list elements must have static lengths. The list can also have free
+        length (`*`), in which case it ends at the end of the message.
+
+        Parameters are given like with `Client Receives Message`. Values given
+        to every list element use `*` in place of the element index. Validation
+        fails if any field or element does not match. Returns the number of
+        list elements.
+
+        Examples:
+        | ${count} = | Client receives message incrementally |
+        | ${count} = | Client receives message incrementally | timeout=60 | records.*.status:0 |
+        """
+        return self._receive_incrementally(self._clients, parameters)
+
+    def server_receives_message_incrementally(self, *parameters):
+        """Receive a message whose last field is a list and validate the list
+        elements one at a time as their data arrives.
+
+        Optional parameters are server `name`, connection `alias` and possible
+        `timeout` separated with equals and message field values for
+        validation like with `Client Receives Message Incrementally`.
+
+        Examples:
+        | ${count} = | Server receives message incrementally | alias=uploader | records.*.status:0 |
+        """
+        return self._receive_incrementally(self._servers, parameters)
+
+    def _receive_incrementally(self, nodes, parameters):
+        configs, message_fields, _ = self._get_parameters_with_defaults(parameters)
+        node, name = nodes.get_with_name(configs.pop('name', None))
+        connection = configs.get('alias')
+        template = self._get_message_template()
+        msg, elements = node.get_message(template, incremental=True, **configs)
+        count, invalid, errors = template.validate_incrementally(msg, elements, dict(message_fields))
+        logger.info('Received %s with %d list elements, %d invalid.' % (self._current_container.name, count, invalid))
+        if errors:
+            logger.info('\n'.join(errors))
+            self._register_receive(node, self._current_container.name, name, error=errors[0], connection=connection)
+            raise AssertionError(errors[0])
+        self._register_receive(node, self._current_container.name, name, connection=connection)
+        return count
+
     def validate_message(self, msg, *parameters):
         """Validates given message using template defined with `New Message` and
         field values given as optional arguments.
@@ -500,11 +1184,18 @@ class RammbockCore(object):
     def _receive(self, nodes, *parameters):
         configs, message_fields, _ = self._get_parameters_with_defaults(parameters)
         node, name = nodes.get_with_name(configs.pop('name', None))
-        msg = node.get_message(self._get_message_template(), **configs)
+        template = self._get_message_template()
+        msg = node.get_message(template, **configs)
+        if self._latencies.is_tracked(self._current_container.name):
+            self._latencies.seen(name, self._current_container.name, msg)
         try:
             yield msg, message_fields
             self._register_receive(node, self._current_container.name, name)
-            logger.debug("Received %s" % repr(msg))
+            # Logging all fields would decode the fields of lazily decoded messages.
+            if template.lazy:
+                logger.debug("Received %s, %d bytes decoded lazily" % (msg, len(msg)))
+            else:
+                logger.debug("Received %s" % repr(msg))
         except AssertionError, e:
             self._register_receive(node, self._current_container.name, name, error=e.args[0])
             raise e
@@ -56,13 +56,28 @@ class _StructuredElement(object):
     def _raw(self):
         return self._get_raw_bytes()
 
+    @property
+    def _raw_segments(self):
+        """Raw bytes as a list of segments, which joined together are equal
+        to `_raw`. Collecting the segments copies field values only once,
+        unlike joining the raw bytes of every nested element."""
+        segments = []
+        self._collect_raw_segments(segments)
+        return segments
+
     def _get_name(self):
         return '%s %s' % (self._type, self._name)
 
     def _get_raw_bytes(self):
         return ''.join((field._raw for field in self._fields.values()))
 
+    def _collect_raw_segments(self, segments):
+        for field in self._fields.values():
+            field._collect_raw_segments(segments)
+
     def __len__(self):
+        if isinstance(self._fields, LazyFields):
+            return self._fields.byte_length()
         return sum(len(field) for field in self._fields.values())
 
     def __nonzero__(self):
@@ -72,6 +87,69 @@ class _StructuredElement(object):
         return (self._parent._get_recursive_name() if self._parent else '') + self._name + '.'
 
 
+class LazyFields(OrderedDict):
+    """Fields of a lazily decoded element.
+
+    Fields added with `add_lazy` are only indexed by their offset and length
+    in `data`. They are decoded with `decode(template, data, element, name)`
+    when first accessed, so fields that are never looked at are never
+    created.
+    """
+
+    def __init__(self, element, data, decode):
+        OrderedDict.__init__(self)
+        self._element = element
+        self._data = data
+        self._decode = decode
+        self._index = {}
+        self._lengths = {}
+
+    def add_lazy(self, name, template, offset, length):
+        self._index[name] = (template, offset)
+        self._lengths[name] = length
+        OrderedDict.__setitem__(self, name, None)
+
+    def __getitem__(self, name):
+        if name in self._index:
+            template, offset = self._index[name]
+            data = self._data[offset:offset + self._lengths[name]]
+            field = self._decode(template, data, self._element, name)
+            field._parent = self._element
+            OrderedDict.__setitem__(self, name, field)
+            # Fields failing to decode stay indexed and fail again when accessed.
+            del self._index[name]
+            return field
+        return OrderedDict.__getitem__(self, name)
+
+    def __setitem__(self, name, value):
+        self._index.pop(name, None)
+        self._lengths.pop(name, None)
+        OrderedDict.__setitem__(self, name, value)
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
+
+    def byte_length(self):
+        """Length of all fields in bytes without decoding the indexed ones."""
+        return sum(self._lengths[name] if name in self._lengths else len(OrderedDict.__getitem__(self, name))
+                   for name in self)
+
+    @property
+    def materialized(self):
+        """Names of the fields that have been decoded."""
+        return [name for name in self if name not in self._index]
+
+    def prepended(self, name, value):
+        """Returns a copy of these fields with `value` as the first field."""
+        fields = LazyFields(self._element, self._data, self._decode)
+        OrderedDict.__setitem__(fields, name, value)
+        for key in self:
+            OrderedDict.__setitem__(fields, key, dict.__getitem__(self, key))
+        fields._index.update(self._index)
+        fields._lengths.update(self._lengths)
+        return fields
+
+
 class List(_StructuredElement):
 
     _type = 'List'
@@ -81,6 +159,13 @@ class List(_StructuredElement):
         self._fields = OrderedDict()
         self._parent = None
 
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(self.len))]
+        if isinstance(index, int) and index < 0:
+            index += self.len
+        return _StructuredElement.__getitem__(self, index)
+
     def _get_name(self):
         return '%s %s[]' % (self._type, self._name)
 
@@ -115,6 +200,9 @@ class Union(_StructuredElement):
                 max_raw = field._raw
         return max_raw.ljust(self._length, '\x00')
 
+    def _collect_raw_segments(self, segments):
+        segments.append(self._raw)
+
     def __len__(self):
         return self._length
 
@@ -140,6 +228,9 @@ class BinaryContainer(_StructuredElement):
             return result[::-1]
         return result
 
+    def _collect_raw_segments(self, segments):
+        segments.append(self._raw)
+
 
 class TBCDContainer(BinaryContainer):
 
@@ -157,6 +248,9 @@ class Message(_StructuredElement):
     _type = 'Message'
 
     def _add_header(self, header):
+        if isinstance(self._fields, LazyFields):
+            self._fields = self._fields.prepended('_header', header)
+            return
         new = OrderedDict({'_header': header})
         new.update(self._fields)
         self._fields = new
@@ -244,6 +338,13 @@ class Field(object):
     def _raw(self):
         return self._original_value.ljust(self._length, '\x00')
 
+    @property
+    def _raw_segments(self):
+        return [self._raw]
+
+    def _collect_raw_segments(self, segments):
+        segments.append(self._raw)
+
     def __str__(self):
         return str(self.__getattribute__(self._type))
 
@@ -0,0 +1,216 @@
+#  Copyright 2012 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import math
+import time
+from collections import deque
+
+# Python 2 has no monotonic clock in the standard library.
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+def percentile(sorted_values, percent):
+    """Returns the nearest-rank percentile of already sorted values."""
+    if not sorted_values:
+        return None
+    rank = int(math.ceil(len(sorted_values) * percent / 100.0))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def latency_summary(latencies, percents=(50, 90, 99)):
+    """Returns percentiles and maximum of latencies given in seconds as
+    milliseconds."""
+    latencies = sorted(latencies)
+    result = {}
+    for percent in percents:
+        result['p%d' % percent] = _to_ms(percentile(latencies, percent))
+    result['max'] = _to_ms(latencies[-1] if latencies else None)
+    return result
+
+
+def _to_ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+class LatencyHistogram(object):
+    """Compact log-linear latency histogram in the spirit of HdrHistogram.
+
+    Latencies are given in seconds and stored in microsecond buckets with
+    about 3% precision, so recording is constant time and memory stays small
+    regardless of the number of samples.
+    """
+
+    _SUB_BUCKET_BITS = 5
+    _SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+    _LINEAR_LIMIT = 2 * _SUB_BUCKETS
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        index = self._index(int(seconds * 1000000) if seconds > 0 else 0)
+        self._counts[index] = self._counts.get(index, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def merge(self, other):
+        for index, count in other._counts.items():
+            self._counts[index] = self._counts.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percent):
+        """Returns the highest latency of the bucket containing the nearest-rank
+        percentile, in seconds."""
+        if not self.count:
+            return None
+        rank = max(int(math.ceil(self.count * percent / 100.0)), 1)
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= rank:
+                return min(self._highest_value(index) / 1000000.0, self.max)
+
+    def summary(self, percents=(50, 90, 99)):
+        """Returns count, mean, percentiles and maximum in milliseconds."""
+        result = {'count': self.count,
+                  'mean': _to_ms(self.total / self.count if self.count else None),
+                  'max': _to_ms(self.max if self.count else None)}
+        for percent in percents:
+            result['p%d' % percent] = _to_ms(self.percentile(percent))
+        return result
+
+    def _index(self, micros):
+        if micros < self._LINEAR_LIMIT:
+            return micros
+        shift = micros.bit_length() - self._SUB_BUCKET_BITS - 1
+        return self._LINEAR_LIMIT + (shift - 1) * self._SUB_BUCKETS + \
+            (micros >> shift) - self._SUB_BUCKETS
+
+    def _highest_value(self, index):
+        if index < self._LINEAR_LIMIT:
+            return index
+        shift, sub_bucket = divmod(index - self._LINEAR_LIMIT, self._SUB_BUCKETS)
+        return ((sub_bucket + self._SUB_BUCKETS + 1) << (shift + 1)) - 1
+
+
+class LatencyTracker(object):
+    """Measures latencies between messages of a start template and an end
+    template seen on the same node, e.g. a request sent by a client and the
+    response it receives.
+
+    Messages are paired by the raw value of an optional correlation field,
+    otherwise in the order they are seen. Latencies are collected to
+    histograms per node and start template.
+    """
+
+    def __init__(self, clock=monotonic):
+        self._clock = clock
+        self._starts = {}
+        self._ends = {}
+        self._pending = {}
+        self._histograms = {}
+
+    def track(self, start, end, correlation=None):
+        pair = (start, end, correlation)
+        self._starts.setdefault(start, []).append(pair)
+        self._ends.setdefault(end, []).append(pair)
+
+    def is_tracked(self, template):
+        return template in self._starts or template in self._ends
+
+    def seen(self, node, template, msg):
+        """Records that `msg` of `template` was sent or received by `node`."""
+        now = self._clock()
+        for start, _, correlation in self._ends.get(template, ()):
+            started = self._pop_pending((node, start, _correlation_key(msg, correlation)))
+            if started is not None:
+                self.histogram(node, start).record(now - started)
+        for start, end, correlation in self._starts.get(template, ()):
+            key = (node, start, _correlation_key(msg, correlation))
+            self._pending.setdefault(key, deque()).append(now)
+
+    def _pop_pending(self, key):
+        queue = self._pending.get(key)
+        if not queue:
+            return None
+        started = queue.popleft()
+        if not queue:
+            del self._pending[key]
+        return started
+
+    def histogram(self, node, template):
+        key = (node, template)
+        if key not in self._histograms:
+            self._histograms[key] = LatencyHistogram()
+        return self._histograms[key]
+
+    def combined(self, template, node=None):
+        """Returns histogram of `template` latencies of `node`, or of all nodes
+        if `node` is not given."""
+        result = LatencyHistogram()
+        for (hist_node, hist_template), histogram in self._histograms.items():
+            if hist_template == template and node in (None, hist_node):
+                result.merge(histogram)
+        return result
+
+    def reset(self):
+        self._pending.clear()
+        self._histograms.clear()
+
+
+def _correlation_key(msg, field):
+    if not field:
+        return None
+    element = msg
+    try:
+        for name in field.split('.'):
+            element = element['_header' if name == 'header' else name]
+    except KeyError:
+        raise AssertionError("Correlation field '%s' not found in %s." % (field, msg._name))
+    return element._raw
+
+
+class NodeStatistics(object):
+    """Traffic counters of a client or server.
+
+    `messages_received` counts messages received with a template, binary
+    receives only add to `bytes_received`. `cache_hits` and `cache_misses`
+    tell whether a received message was found among earlier received
+    messages or had to be read from the socket. `evictions` counts cached
+    messages discarded unread when the node is emptied.
+    """
+
+    COUNTERS = ('messages_sent', 'bytes_sent', 'messages_received', 'bytes_received',
+                'decode_failures', 'cache_hits', 'cache_misses', 'timeouts', 'evictions',
+                'connections_reaped')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        for name in self.COUNTERS:
+            setattr(self, name, 0)
+
+    def snapshot(self):
+        return dict((name, getattr(self, name)) for name in self.COUNTERS)
@@ -13,10 +13,19 @@
 #  limitations under the License.
 
 
+import errno
+import os
+import select
 import socket
+import sys
 import time
+from collections import deque
+from itertools import count
+from threading import Thread, Event, Lock, RLock
 from robot.api import logger
 from binary_tools import to_hex
+from ordered_dict import OrderedDict
+from metrics import NodeStatistics
 
 try:
     from sctp import sctpsocket_tcp
@@ -27,6 +36,117 @@ except ImportError:
 UDP_BUFFER_SIZE = 65536
 TCP_BUFFER_SIZE = 1000000
 TCP_MAX_QUEUED_CONNECTIONS = 5
+BACKGROUND_ACCEPT_INTERVAL = 0.1
+
+
+# Values of socket options that the socket module of older Python versions
+# does not define.
+_LINUX_SOCKET_OPTIONS = {'SO_REUSEPORT': 15, 'SO_BUSY_POLL': 46, 'TCP_QUICKACK': 12}
+
+
+def _to_bool(value):
+    return str(value).lower() not in ('', 'false', 'no', 'none', '0')
+
+
+def _to_size(value):
+    """Converts sizes like `65536`, `64K` and `4M` to bytes."""
+    value = str(value).strip().upper()
+    multiplier = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}.get(value[-1:], 1)
+    return int(value[:-1] if multiplier > 1 else value) * multiplier
+
+
+class SocketOptions(object):
+    """Socket options given as configs like `nodelay=true` and `rcvbuf=4M`
+    when starting servers and clients.
+
+    `nodelay` disables Nagle's algorithm, `quickack` disables delayed
+    acknowledgements, `rcvbuf` and `sndbuf` set the kernel buffer sizes,
+    `reuseport` lets several sockets bind to the same port and `busy_poll`
+    sets the busy polling time in microseconds. Options not available on the
+    platform raise an error when set.
+    """
+
+    _options = {'nodelay': (socket.IPPROTO_TCP, 'TCP_NODELAY', _to_bool),
+                'quickack': (socket.IPPROTO_TCP, 'TCP_QUICKACK', _to_bool),
+                'rcvbuf': (socket.SOL_SOCKET, 'SO_RCVBUF', _to_size),
+                'sndbuf': (socket.SOL_SOCKET, 'SO_SNDBUF', _to_size),
+                'reuseport': (socket.SOL_SOCKET, 'SO_REUSEPORT', _to_bool),
+                'busy_poll': (socket.SOL_SOCKET, 'SO_BUSY_POLL', int)}
+
+    def __init__(self, options=None):
+        self._values = [self._parse(name, value) for name, value in sorted((options or {}).items())]
+        # Option number of TCP_QUICKACK if quick acknowledgements are enabled.
+        self.quickack = None
+        for name, level, option, value in self._values:
+            if name == 'quickack' and value:
+                self.quickack = option
+
+    def _parse(self, name, value):
+        if name not in self._options:
+            raise Exception("Unknown socket option '%s'. Available options are %s."
+                            % (name, ', '.join(sorted(self._options))))
+        level, constant, convert = self._options[name]
+        option = getattr(socket, constant, None)
+        if option is None and sys.platform.startswith('linux'):
+            option = _LINUX_SOCKET_OPTIONS.get(constant)
+        if option is None:
+            raise Exception("Socket option '%s' is not available on this platform." % name)
+        return name, level, option, int(convert(value))
+
+    def __nonzero__(self):
+        return bool(self._values)
+
+    def apply(self, sock):
+        for name, level, option, value in self._values:
+            try:
+                sock.setsockopt(level, option, value)
+            except socket.error, e:
+                raise Exception("Setting socket option '%s' failed: %s" % (name, e))
+
+    def rearm_quickack(self, sock):
+        # Linux turns quick acknowledgements off again while receiving, so
+        # they are enabled again after every receive.
+        sock.setsockopt(socket.IPPROTO_TCP, self.quickack, 1)
+
+
+def _join(msg):
+    """Returns `msg` given as a string or as a list of segments as a string."""
+    if isinstance(msg, basestring):
+        return msg
+    return ''.join(msg)
+
+
+def _length(msg):
+    if isinstance(msg, basestring):
+        return len(msg)
+    return sum(len(segment) for segment in msg)
+
+
+def _send_all(sock, msg):
+    """Sends `msg` given as a string or as a list of segments.
+
+    Python 2 sockets have no scatter-gather `sendmsg`, so segments are joined
+    once here, right before sending, instead of at every nesting level of the
+    encoded message.
+    """
+    sock.sendall(_join(msg))
+
+
+def _send_to(sock, msg, address=None):
+    """Sends `msg` given as a string or as a list of segments as one
+    datagram to `address`, or to the connected peer if `address` is None."""
+    if address is None:
+        sock.sendall(_join(msg))
+    else:
+        sock.sendto(_join(msg), address)
+
+
+def _to_hex(msg):
+    """Hex of `msg` given as a string or as a list of segments. Segments are
+    converted one by one, so the message is not joined just for logging."""
+    if isinstance(msg, basestring):
+        return to_hex(msg)
+    return ''.join(to_hex(segment) for segment in msg)
 
 
 class _WithTimeouts(object):
@@ -46,13 +166,16 @@ class _WithTimeouts(object):
 
 class _NetworkNode(_WithTimeouts):
 
+    _socket_options = SocketOptions()
+    log_traffic = True
+
     def get_own_address(self):
-        return self._socket.getsockname()
+        return _address(self._socket.getsockname())
 
     def get_peer_address(self, alias=None):
         if alias:
             raise AssertionError('Named connections not supported.')
-        return self._socket.getpeername()
+        return _address(self._socket.getpeername())
 
     def close(self):
         if self._is_connected:
@@ -63,57 +186,109 @@ class _NetworkNode(_WithTimeouts):
     def _get_message_stream(self):
         if not self._protocol:
             return None
-        return self._protocol.get_message_stream(BufferedStream(self, self._default_timeout))
+        return self._protocol.get_message_stream(BufferedStream(self, self._default_timeout), self.statistics)
+
+    def get_message(self, message_template, timeout=None, header_filter=None, incremental=False):
+        self._raise_error_if_protocol_mismatch(message_template)
+        return self._get_from_stream(message_template, self._message_stream, timeout=timeout,
+                                     header_filter=header_filter, incremental=incremental)
 
-    def get_message(self, message_template, timeout=None, header_filter=None):
+    def _raise_error_if_protocol_mismatch(self, message_template):
         if not self._protocol:
             raise AssertionError('Can not receive messages without protocol. Initialize network node with "protocol=<protocl name>"')
         if self._protocol != message_template._protocol:
             raise AssertionError('Template protocol does not match network node protocol %s!=%s' % (self.protocol_name, message_template._protocol.name))
-        return self._get_from_stream(message_template, self._message_stream, timeout=timeout, header_filter=header_filter)
 
-    def _get_from_stream(self, message_template, stream, timeout, header_filter):
-        return stream.get(message_template, timeout=timeout, header_filter=header_filter)
+    def _get_from_stream(self, message_template, stream, timeout, header_filter, incremental=False):
+        return self._count_received(stream.get, message_template, timeout=timeout, header_filter=header_filter,
+                                    incremental=incremental)
+
+    def _count_received(self, receive, *args, **kwargs):
+        try:
+            result = receive(*args, **kwargs)
+        except socket.timeout:
+            self.statistics.timeouts += 1
+            raise
+        self.statistics.messages_received += 1
+        return result
+
+    def get_statistics(self):
+        """Returns a snapshot of the traffic counters of this node as a
+        dictionary. See `NodeStatistics` for the counters."""
+        return self.statistics.snapshot()
+
+    def reset_statistics(self):
+        self.statistics.reset()
 
     def log_send(self, binary, ip, port):
-        logger.debug("Send %d bytes: %s to %s:%s over %s" % (len(binary), to_hex(binary), ip, port, self._transport_layer_name))
+        if not self.log_traffic:
+            return
+        logger.debug("Send %d bytes: %s to %s:%s over %s" % (_length(binary), _to_hex(binary), ip, port, self._transport_layer_name))
 
     def log_receive(self, binary, ip, port):
+        if not self.log_traffic:
+            return
         logger.debug("Trying to read %d bytes: %s from %s:%s over %s" % (len(binary), to_hex(binary), ip, port, self._transport_layer_name))
 
     def empty(self):
+        self._empty_socket()
+        if self._message_stream:
+            self._message_stream.empty()
+
+    def _empty_socket(self):
         result = True
         try:
             while result:
-                result = self.receive(timeout=0.0)
+                result = self._receive_from_socket(timeout=0.0)[0]
         except (socket.timeout, socket.error):
             pass
-        if self._message_stream:
-            self._message_stream.empty()
 
     def receive(self, timeout=None, alias=None):
         return self.receive_from(timeout, alias)[0]
 
     def receive_from(self, timeout=None, alias=None):
         self._raise_error_if_alias_given(alias)
-        timeout = self._get_timeout(timeout)
-        self._socket.settimeout(timeout)
-        return self._receive_msg_ip_port()
+        return self._receive_from_socket(timeout)
+
+    def _receive_from_socket(self, timeout=None):
+        self._socket.settimeout(self._get_timeout(timeout))
+        result = self._receive_msg_ip_port()
+        if self._socket_options.quickack:
+            self._socket_options.rearm_quickack(self._socket)
+        self.statistics.bytes_received += len(result[0])
+        return result
 
     def _receive_msg_ip_port(self):
         msg = self._socket.recv(self._size_limit)
-        ip, port = self._socket.getpeername()
+        ip, port = self.get_peer_address()
         self.log_receive(msg, ip, port)
         return msg, ip, port
 
-    def send(self, msg, alias=None):
+    def send(self, msg, alias=None, log=True):
         self._raise_error_if_alias_given(alias)
-        ip, port = self.get_peer_address()
-        self.log_send(msg, ip, port)
+        if log:
+            ip, port = self.get_peer_address()
+            self.log_send(msg, ip, port)
         self._sendall(msg)
+        self.statistics.messages_sent += 1
+        self.statistics.bytes_sent += _length(msg)
 
     def _sendall(self, msg):
-        self._socket.sendall(msg)
+        _send_all(self._socket, msg)
+
+    def send_stream(self, chunks, alias=None):
+        """Sends one message given as an iterable of `chunks`, sending each
+        chunk as soon as it is produced."""
+        self._raise_error_if_alias_given(alias)
+        sent = 0
+        for chunk in chunks:
+            self._sendall(chunk)
+            sent += len(chunk)
+        self.statistics.messages_sent += 1
+        self.statistics.bytes_sent += sent
+        if self.log_traffic:
+            ip, port = self.get_peer_address()
+            logger.debug("Streamed %d bytes to %s:%s over %s" % (sent, ip, port, self._transport_layer_name))
 
     def _raise_error_if_alias_given(self, alias):
         if alias:
@@ -155,12 +330,43 @@ class _SCTPNode(object):
         self._socket = sctpsocket_tcp(socket.AF_INET)
 
 
+UNIX_HOST = 'unix'
+
+
+def _address(name):
+    """Returns socket address `name` as ip and port. Unix domain socket
+    addresses are paths, which are returned as the port of host `unix`."""
+    if isinstance(name, basestring):
+        return UNIX_HOST, name
+    return name
+
+
+class _UnixStreamNode(object):
+
+    _transport_layer_name = 'Unix'
+    _size_limit = TCP_BUFFER_SIZE
+
+    def _init_socket(self):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+
+class _UnixDatagramNode(object):
+
+    _transport_layer_name = 'Unix'
+    _size_limit = UDP_BUFFER_SIZE
+
+    def _init_socket(self):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+
 class _Server(_NetworkNode):
 
-    def __init__(self, ip, port, timeout=None):
+    def __init__(self, ip, port, timeout=None, socket_options=None):
         self._ip = ip
         self._port = int(port)
         self._set_default_timeout(timeout)
+        self._socket_options = SocketOptions(socket_options)
+        self.statistics = NodeStatistics()
 
     def _bind_socket(self):
         try:
@@ -172,65 +378,239 @@ class _Server(_NetworkNode):
 
 class UDPServer(_Server, _UDPNode):
 
-    def __init__(self, ip, port, timeout=None, protocol=None):
-        _Server.__init__(self, ip, port, timeout)
+    def __init__(self, ip, port, timeout=None, protocol=None, socket_options=None):
+        _Server.__init__(self, ip, port, timeout, socket_options)
         self._protocol = protocol
         self._last_client = None
         self._init_socket()
+        self._socket_options.apply(self._socket)
         self._bind_socket()
-        self._message_stream = self._get_message_stream()
+        self._datagrams = DatagramStream(self, self._default_timeout)
+        self._message_streams = OrderedDict()
+        self._message_stream = None
+        self._init_peers()
+
+    def _init_peers(self):
+        self._peers = _NamedCache('peer')
+        self._peer_addresses = set()
+
+    def accept_connection(self, alias=None, timeout=None):
+        """Names the sender of the oldest unread datagram from a peer that
+        has not been accepted yet. The datagram itself is not consumed."""
+        address = self._datagrams.next_address(timeout, accept=self._is_new_peer)
+        self._peers.add(address, alias)
+        self._peer_addresses.add(address)
+        return address
+
+    def _is_new_peer(self, address):
+        return address not in self._peer_addresses
+
+    def receive_from(self, timeout=None, alias=None):
+        address = self._get_alias_address(alias)
+        msg, (ip, port) = self._datagrams.read_frame(address, timeout=timeout)
+        self._last_client = (ip, port)
+        return msg, ip, port
+
+    def get_message(self, message_template, timeout=None, header_filter=None, alias=None, incremental=False):
+        self._raise_error_if_protocol_mismatch(message_template)
+        address = self._get_alias_address(alias)
+        if address:
+            stream = self._get_peer_message_stream(address)
+            msg = self._count_received(stream.get, message_template, timeout=timeout, header_filter=header_filter,
+                                       incremental=incremental)
+        else:
+            msg, address = self._count_received(self._get_from_any_peer, message_template, timeout, header_filter,
+                                                incremental)
+        self._last_client = address
+        return msg
+
+    def _get_from_any_peer(self, message_template, timeout, header_filter, incremental=False):
+        for address, stream in self._message_streams.items():
+            msg = stream.get_from_cache(message_template, header_filter, incremental)
+            if msg:
+                self.statistics.cache_hits += 1
+                self._release_message_stream(address, stream)
+                return msg, address
+        self.statistics.cache_misses += 1
+        while True:
+            address = self._datagrams.next_address(timeout)
+            stream = self._get_peer_message_stream(address)
+            try:
+                msg = stream.read_next(message_template, timeout, header_filter, incremental)
+            finally:
+                self._release_message_stream(address, stream)
+            if msg:
+                return msg, address
+
+    def _get_peer_message_stream(self, address):
+        if address not in self._message_streams:
+            self._message_streams[address] = \
+                self._protocol.get_datagram_message_stream(self._datagrams, address, self.statistics)
+        return self._message_streams[address]
+
+    def _release_message_stream(self, address, stream):
+        # Streams of senders that are not accepted peers are kept only while
+        # they have cached messages, so that servers receiving from many
+        # source addresses do not keep a stream for each of them.
+        if address not in self._peer_addresses and stream.is_empty():
+            del self._message_streams[address]
+
+    def clear_message_caches(self):
+        """Discards messages cached for later receives, but not datagrams
+        that have not been read yet. Returns the number of discarded
+        messages."""
+        discarded = 0
+        for address, stream in self._message_streams.items():
+            discarded += stream.clear_cache()
+            self._release_message_stream(address, stream)
+        return discarded
+
+    def empty(self):
+        self._empty_socket()
+        for stream in self._message_streams.values():
+            stream.empty()
+        self._datagrams.empty()
+        self._message_streams = OrderedDict()
+
+    def close(self):
+        _NetworkNode.close(self)
+        self._message_streams = OrderedDict()
+        self._init_peers()
 
     def _receive_msg_ip_port(self):
         msg, (ip, port) = self._socket.recvfrom(self._size_limit)
         self.log_receive(msg, ip, port)
-        self._last_client = (ip, int(port))
-        return msg, ip, port
-
-    def _check_no_alias(self, alias):
-        if alias:
-            raise Exception('Connection aliases are not supported on UDP Servers')
+        return msg, ip, int(port)
 
     def send_to(self, msg, ip, port):
         self._last_client = (ip, int(port))
         self.send(msg)
 
-    def _sendall(self, msg):
-        self._socket.sendto(msg, self.get_peer_address())
+    def send(self, msg, alias=None, log=True):
+        ip, port = self.get_peer_address(alias)
+        if log:
+            self.log_send(msg, ip, port)
+        self._sendto(msg, (ip, port))
+        self.statistics.messages_sent += 1
+        self.statistics.bytes_sent += _length(msg)
+
+    def _sendto(self, msg, address):
+        _send_to(self._socket, msg, address)
+
+    def send_stream(self, chunks, alias=None):
+        # A message is always sent as one datagram.
+        self.send(list(chunks), alias)
 
     def get_peer_address(self, alias=None):
-        self._check_no_alias(alias)
+        if alias:
+            return self._get_alias_address(alias)
         if not self._last_client:
             raise Exception('Server has no default client, because it has not received messages from clients yet.')
         return self._last_client
 
+    def _get_alias_address(self, alias):
+        if not alias:
+            return None
+        try:
+            return self._peers.get(alias)
+        except KeyError:
+            raise AssertionError("No peer with alias '%s' accepted." % alias)
+
 
 class StreamServer(_Server):
 
-    def __init__(self, ip, port, timeout=None, protocol=None):
-        _Server.__init__(self, ip, port, timeout)
+    _connection_class = None
+
+    def __init__(self, ip, port, timeout=None, protocol=None, backlog=None, idle_timeout=None,
+                 socket_options=None):
+        _Server.__init__(self, ip, port, timeout, socket_options)
         self._init_socket()
+        self._socket_options.apply(self._socket)
         self._bind_socket()
-        self._socket.listen(TCP_MAX_QUEUED_CONNECTIONS)
+        self._socket.listen(int(backlog) if backlog else TCP_MAX_QUEUED_CONNECTIONS)
         self._connections = _NamedCache('connection')
         self._protocol = protocol
+        self._acceptor = None
+        self._accept_lock = Lock()
+        self._idle_timeout = float(idle_timeout) if idle_timeout else None
 
     def receive_from(self, timeout=None, alias=None):
         connection = self._connections.get(alias)
         return connection.receive_from(timeout=timeout)
 
     def accept_connection(self, alias=None):
-        connection, client_address = self._socket.accept()
-        self._connections.add(_TCPConnection(connection, protocol=self._protocol), alias)
+        self._raise_error_if_accepting()
+        with self._accept_lock:
+            connection, client_address = self._socket.accept()
+            self._add_connection(connection, alias)
         return client_address
 
-    def send(self, msg, alias=None):
+    def _raise_error_if_accepting(self):
+        if self._acceptor:
+            raise Exception('Server is accepting connections in background.')
+
+    def _add_connection(self, connection, alias=None, select=True):
+        self._connections.add(self._connection_class(connection, protocol=self._protocol, statistics=self.statistics,
+                                                     socket_options=self._socket_options), alias, select)
+
+    def accept_connections(self, count=None, alias=None, timeout=None):
+        """Accepts up to `count` connections and returns their addresses.
+
+        Without `count` only connections that are already pending are
+        accepted. Otherwise waits at most `timeout` for each connection.
+        If `alias` is given, connections are named `alias` followed by a
+        running number.
+        """
+        self._raise_error_if_accepting()
+        timeout = self._get_timeout(timeout) if count else 0.0
+        return self._accept_pending(int(count) if count else None, timeout,
+                                    _AliasGenerator(alias))
+
+    def _accept_pending(self, count, timeout, aliases, select=True):
+        addresses = []
+        with self._accept_lock:
+            self._socket.settimeout(timeout)
+            try:
+                while count is None or len(addresses) < count:
+                    connection, client_address = self._socket.accept()
+                    self._add_connection(connection, aliases.next(), select)
+                    addresses.append(client_address)
+            except socket.error, e:
+                if not _is_timeout(e):
+                    raise
+            finally:
+                self._socket.settimeout(None)
+        return addresses
+
+    def start_accepting(self, alias=None):
+        """Starts accepting connections continuously in a background thread.
+
+        Connections accepted in background become the default connection of
+        the server only if it has no connections yet. Connections cannot be
+        accepted manually until accepting in background is stopped.
+        """
+        if self._acceptor:
+            raise Exception('Server is already accepting connections in background.')
+        self._acceptor = _BackgroundAcceptor(self, _AliasGenerator(alias))
+        self._acceptor.start()
+
+    def stop_accepting(self):
+        if self._acceptor:
+            self._acceptor.stop()
+            self._acceptor = None
+
+    def send(self, msg, alias=None, log=True):
         connection = self._connections.get(alias)
-        connection.send(msg)
+        connection.send(msg, log=log)
+
+    def send_stream(self, chunks, alias=None):
+        self._connections.get(alias).send_stream(chunks)
 
     def send_to(self, *args):
         raise Exception("Stream server cannot send to a specific address.")
 
     def close(self):
+        self.stop_accepting()
         if self._is_connected:
             self._is_connected = False
             for connection in self._connections:
@@ -239,11 +619,41 @@ class StreamServer(_Server):
             self._connections = _NamedCache('connection')
 
     def close_connection(self, alias=None):
-        raise Exception("Not yet implemented")
-
-    def get_message(self, message_template, timeout=None, alias=None, header_filter=None):
+        connection = self._connections.remove(alias)
+        connection.close()
+
+    def reap_connections(self):
+        """Closes and removes connections that have been closed by the peer
+        or that have been idle longer than the idle timeout of the server.
+        Connections having received messages that are not yet read are kept.
+        Returns the names of the removed connections."""
+        names = set(self._closed_connection_names() + self._idle_connection_names())
+        names = [name for name in names if not self._connections.get(name).has_cached_messages()]
+        for name in names:
+            self.close_connection(name)
+        self.statistics.connections_reaped += len(names)
+        if names:
+            logger.debug('Removed connections %s' % ', '.join(sorted(names)))
+        return names
+
+    def _closed_connection_names(self):
+        connections = dict((connection.fileno(), (name, connection))
+                           for name, connection in self._connections.items())
+        readable = _Poller(connections.keys(), readable=True).wait(0)
+        return [connections[fileno][0] for fileno in readable
+                if connections[fileno][1].is_closed_by_peer()]
+
+    def _idle_connection_names(self):
+        if not self._idle_timeout:
+            return []
+        idle_since = time.time() - self._idle_timeout
+        return [name for name, connection in self._connections.items()
+                if connection.last_activity < idle_since]
+
+    def get_message(self, message_template, timeout=None, alias=None, header_filter=None, incremental=False):
         connection = self._connections.get(alias)
-        return connection.get_message(message_template, timeout=timeout, header_filter=header_filter)
+        return connection.get_message(message_template, timeout=timeout, header_filter=header_filter,
+                                      incremental=incremental)
 
     def empty(self):
         for connection in self._connections:
@@ -254,31 +664,267 @@ class StreamServer(_Server):
         return connection.get_peer_address()
 
 
+def _is_timeout(error):
+    return isinstance(error, socket.timeout) or \
+        error.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK)
+
+
+class _AliasGenerator(object):
+
+    def __init__(self, alias=None):
+        self._alias = alias
+        self._counter = 0
+
+    def next(self):
+        if not self._alias:
+            return None
+        self._counter += 1
+        return '%s%d' % (self._alias, self._counter)
+
+
+class _BackgroundAcceptor(Thread):
+
+    def __init__(self, server, aliases):
+        Thread.__init__(self)
+        self.setDaemon(True)
+        self._server = server
+        self._aliases = aliases
+        self._stopped = Event()
+
+    def run(self):
+        while not self._stopped.isSet():
+            try:
+                self._server._accept_pending(1, BACKGROUND_ACCEPT_INTERVAL, self._aliases, select=False)
+            except socket.error, e:
+                logger.debug('Accepting connections in background failed: %s' % e)
+                return
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
 class _TCPConnection(_NetworkNode, _TCPNode):
 
-    def __init__(self, socket, protocol=None):
+    def __init__(self, socket, protocol=None, statistics=None, socket_options=None):
         self._socket = socket
         self._protocol = protocol
+        if socket_options:
+            # Not all platforms copy the options of the listening socket.
+            self._socket_options = socket_options
+            socket_options.apply(socket)
+        # Connections of a server share the counters of the server.
+        self.statistics = statistics or NodeStatistics()
         self._message_stream = self._get_message_stream()
         self._is_connected = True
+        self.last_activity = time.time()
+
+    def has_cached_messages(self):
+        return bool(self._message_stream) and not self._message_stream.is_empty()
+
+    def _receive_msg_ip_port(self):
+        result = _NetworkNode._receive_msg_ip_port(self)
+        self.last_activity = time.time()
+        return result
+
+    def _sendall(self, msg):
+        _NetworkNode._sendall(self, msg)
+        self.last_activity = time.time()
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def is_closed_by_peer(self):
+        timeout = self._socket.gettimeout()
+        self._socket.settimeout(0.0)
+        try:
+            return self._socket.recv(1, socket.MSG_PEEK) == ''
+        except socket.error, e:
+            return not _is_timeout(e)
+        finally:
+            self._socket.settimeout(timeout)
 
 
 class SCTPServer(StreamServer, _SCTPNode):
-    pass
+    _connection_class = _TCPConnection
 
 
 class TCPServer(StreamServer, _TCPNode):
-    pass
+    _connection_class = _TCPConnection
+
+
+class _UnixServer(object):
+
+    def _bind_socket(self):
+        try:
+            self._socket.bind(self._path)
+        except socket.error, e:
+            raise Exception("error: [Errno %d] %s for address %s" % (e[0], e[1], self._path))
+        self._is_connected = True
+
+    def get_own_address(self):
+        return UNIX_HOST, self._path
+
+    def _remove_socket_file(self):
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+
+
+class _UnixConnection(_TCPConnection):
+    _transport_layer_name = 'Unix'
+
+
+class UnixStreamServer(_UnixServer, _UnixStreamNode, StreamServer):
+    """Stream server bound to Unix domain socket `path`. The socket file is
+    removed when the server is closed."""
+
+    _connection_class = _UnixConnection
+
+    def __init__(self, path, timeout=None, protocol=None, backlog=None, idle_timeout=None, socket_options=None):
+        self._path = path
+        StreamServer.__init__(self, UNIX_HOST, 0, timeout, protocol, backlog, idle_timeout, socket_options)
+
+    def close(self):
+        was_connected = self._is_connected
+        StreamServer.close(self)
+        if was_connected:
+            self._remove_socket_file()
+
+
+class UnixDatagramServer(_UnixServer, _UnixDatagramNode, UDPServer):
+    """Datagram server bound to Unix domain socket `path`. The socket file is
+    removed when the server is closed."""
+
+    def __init__(self, path, timeout=None, protocol=None, socket_options=None):
+        self._path = path
+        UDPServer.__init__(self, UNIX_HOST, 0, timeout, protocol, socket_options)
+
+    def close(self):
+        was_connected = self._is_connected
+        UDPServer.close(self)
+        if was_connected:
+            self._remove_socket_file()
+
+    def _receive_msg_ip_port(self):
+        msg, address = self._socket.recvfrom(self._size_limit)
+        self.log_receive(msg, UNIX_HOST, address)
+        return msg, UNIX_HOST, address
+
+    def _sendto(self, msg, address):
+        _send_to(self._socket, msg, address[1])
+
+
+LOOPBACK_HOST = 'loopback'
+# Loopback nodes are addressed with a running number instead of a port.
+_loopback_ports = count(1)
+
+
+class _LoopbackNode(object):
+
+    _transport_layer_name = 'Loopback'
+    _size_limit = TCP_BUFFER_SIZE
+
+    def get_own_address(self):
+        return self._own_address
+
+    def get_peer_address(self, alias=None):
+        if alias:
+            raise AssertionError('Named connections not supported.')
+        return self._peer_address
+
+
+class _LoopbackConnection(_LoopbackNode, _TCPConnection):
+
+    def __init__(self, socket, own_address, peer_address, protocol=None, statistics=None):
+        self._own_address = own_address
+        self._peer_address = peer_address
+        _TCPConnection.__init__(self, socket, protocol, statistics)
+
+
+class LoopbackServer(StreamServer):
+    """Server of in-process connections from `LoopbackClient`s.
+
+    Connections are socket pairs, so no ports are bound and messages do not
+    pass through the network stack. Connecting never blocks, so pending
+    connections can always be accepted immediately.
+    """
+
+    _transport_layer_name = 'Loopback'
+
+    def __init__(self, timeout=None, protocol=None, idle_timeout=None):
+        _Server.__init__(self, LOOPBACK_HOST, _loopback_ports.next(), timeout)
+        self._pending = deque()
+        self._connections = _NamedCache('connection')
+        self._protocol = protocol
+        self._acceptor = None
+        self._idle_timeout = float(idle_timeout) if idle_timeout else None
+        self._is_connected = True
+
+    def get_own_address(self):
+        return self._ip, self._port
+
+    def connect(self, client_address):
+        """Returns the client end of a new connection from `client_address`."""
+        if not self._is_connected:
+            raise socket.error(errno.ECONNREFUSED, os.strerror(errno.ECONNREFUSED))
+        client_end, server_end = socket.socketpair()
+        self._pending.append(_LoopbackConnection(server_end, self.get_own_address(), client_address,
+                                                 protocol=self._protocol, statistics=self.statistics))
+        if self._acceptor:
+            self._accept_pending(None, 0.0, self._acceptor, select=False)
+        return client_end
+
+    def accept_connection(self, alias=None):
+        self._raise_error_if_accepting()
+        if not self._pending:
+            raise AssertionError('No pending connections to loopback server %s:%d.' % self.get_own_address())
+        return self._accept_one(alias)
+
+    def _accept_one(self, alias, select=True):
+        connection = self._pending.popleft()
+        self._add_connection(connection, alias, select)
+        return connection.get_peer_address()
+
+    def _accept_pending(self, count, timeout, aliases, select=True):
+        addresses = []
+        while self._pending and (count is None or len(addresses) < count):
+            addresses.append(self._accept_one(aliases.next(), select))
+        return addresses
+
+    def _add_connection(self, connection, alias=None, select=True):
+        self._connections.add(connection, alias, select)
+
+    def start_accepting(self, alias=None):
+        """Accepts pending and new connections as they are made."""
+        if self._acceptor:
+            raise Exception('Server is already accepting connections in background.')
+        self._acceptor = _AliasGenerator(alias)
+        self._accept_pending(None, 0.0, self._acceptor, select=False)
+
+    def stop_accepting(self):
+        self._acceptor = None
+
+    def close(self):
+        self.stop_accepting()
+        if self._is_connected:
+            self._is_connected = False
+            for connection in list(self._connections) + list(self._pending):
+                connection.close()
+            self._connections = _NamedCache('connection')
+            self._pending = deque()
 
 
 class _Client(_NetworkNode):
 
-    def __init__(self, timeout=None, protocol=None):
+    def __init__(self, timeout=None, protocol=None, socket_options=None):
         self._is_connected = False
         self._init_socket()
+        self._socket_options = SocketOptions(socket_options)
+        self._socket_options.apply(self._socket)
         self._set_default_timeout(timeout)
         self._protocol = protocol
         self._message_stream = None
+        self.statistics = NodeStatistics()
 
     def set_own_ip_and_port(self, ip=None, port=None):
         if ip and port:
@@ -291,17 +937,57 @@ class _Client(_NetworkNode):
             raise Exception("You must specify host or port")
 
     def connect_to(self, server_ip, server_port):
-        if self._is_connected:
-            raise Exception('Client already connected!')
+        self._raise_error_if_connected()
         self._server_ip = server_ip
         self._socket.connect((server_ip, int(server_port)))
+        return self._connected()
+
+    def start_connect(self, server_ip, server_port):
+        """Starts a non-blocking connect. Use `finish_connect` when the socket
+        is writable."""
+        self._raise_error_if_connected()
+        self._server_ip = server_ip
+        self._socket.setblocking(0)
+        self._raise_socket_error(self._socket.connect_ex((server_ip, int(server_port))),
+                                 allowed=(errno.EINPROGRESS, errno.EWOULDBLOCK))
+
+    def finish_connect(self):
+        self._raise_socket_error(self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR))
+        self._socket.setblocking(1)
+        return self._connected()
+
+    def abort_connect(self):
+        if not self._is_connected:
+            self._socket.close()
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def _raise_socket_error(self, error, allowed=()):
+        if error and error not in allowed:
+            raise socket.error(error, os.strerror(error))
+
+    def _raise_error_if_connected(self):
+        if self._is_connected:
+            raise Exception('Client already connected!')
+
+    def _connected(self):
         self._message_stream = self._get_message_stream()
         self._is_connected = True
         return self
 
 
 class UDPClient(_Client, _UDPNode):
-    pass
+
+    def _get_message_stream(self):
+        if not self._protocol:
+            return None
+        return self._protocol.get_datagram_message_stream(DatagramStream(self, self._default_timeout),
+                                                          statistics=self.statistics)
+
+    def send_stream(self, chunks, alias=None):
+        # A message is always sent as one datagram.
+        self.send(list(chunks), alias)
 
 
 class TCPClient(_Client, _TCPNode):
@@ -312,34 +998,191 @@ class SCTPClient(_Client, _SCTPNode):
     pass
 
 
+class _UnixClient(object):
+
+    def set_own_path(self, path):
+        self._socket.bind(path)
+
+    def set_own_ip_and_port(self, ip=None, port=None):
+        raise Exception('Unix domain socket clients are bound to a path, not to an ip and port.')
+
+    def connect_to(self, path, port=None):
+        self._raise_error_if_connected()
+        if not self._socket.getsockname():
+            # Binds to a unique abstract address so that servers can tell
+            # clients apart and reply to datagram clients.
+            self._socket.bind('')
+        self._server_ip = path
+        self._socket.connect(path)
+        return self._connected()
+
+
+class UnixStreamClient(_UnixClient, _UnixStreamNode, _Client):
+    pass
+
+
+class UnixDatagramClient(_UnixClient, _UnixDatagramNode, UDPClient):
+    pass
+
+
+class LoopbackClient(_LoopbackNode, _Client):
+    """Client connected to a `LoopbackServer` in the same process."""
+
+    def __init__(self, timeout=None, protocol=None):
+        _Client.__init__(self, timeout, protocol)
+        self._own_address = (LOOPBACK_HOST, _loopback_ports.next())
+        self._peer_address = None
+
+    def _init_socket(self):
+        # The socket is created when connecting.
+        self._socket = None
+
+    def set_own_ip_and_port(self, ip=None, port=None):
+        raise Exception('Loopback clients cannot be bound to an address.')
+
+    def connect_to(self, server_ip, server_port):
+        raise Exception('Loopback clients are connected to a loopback server when started.')
+
+    def connect_to_server(self, server):
+        self._raise_error_if_connected()
+        self._socket = server.connect(self._own_address)
+        self._peer_address = server.get_own_address()
+        return self._connected()
+
+
+def connect_clients(clients, server_ip, server_port, timeout=None):
+    """Connects all `clients` to the server concurrently.
+
+    All connects are started without blocking and finished as the sockets
+    become writable. Returns a list with either the connect latency in
+    seconds or the error for each client. Clients that fail are closed.
+    `timeout` is parsed like node timeouts.
+    """
+    timeout = _WithTimeouts()._get_timeout(timeout)
+    results = [None] * len(clients)
+    started, pending = {}, {}
+    for index, client in enumerate(clients):
+        started[index] = time.time()
+        try:
+            client.start_connect(server_ip, server_port)
+            pending[client.fileno()] = index
+        except socket.error, e:
+            results[index] = _abort_connect(client, e)
+    cutoff = time.time() + timeout if timeout is not None else None
+    poller = _Poller(pending.keys())
+    while pending:
+        remaining = cutoff - time.time() if cutoff is not None else None
+        if remaining is not None and remaining <= 0:
+            break
+        for fileno in poller.wait(remaining):
+            index = pending.pop(fileno)
+            poller.unregister(fileno)
+            try:
+                clients[index].finish_connect()
+                results[index] = time.time() - started[index]
+            except socket.error, e:
+                results[index] = _abort_connect(clients[index], e)
+    for index in pending.values():
+        results[index] = _abort_connect(clients[index], socket.timeout('Connect timed out'))
+    return results
+
+
+def _abort_connect(client, error):
+    client.abort_connect()
+    return error
+
+
+class _Poller(object):
+    """Waits for readable or writable sockets using poll where available and
+    select elsewhere."""
+
+    def __init__(self, filenos, readable=False):
+        self._filenos = set(filenos)
+        self._readable = readable
+        self._poll = select.poll() if hasattr(select, 'poll') else None
+        if self._poll:
+            event = select.POLLIN if readable else select.POLLOUT
+            for fileno in self._filenos:
+                self._poll.register(fileno, event)
+
+    def wait(self, timeout=None):
+        if self._poll:
+            timeout_ms = int(timeout * 1000) if timeout is not None else None
+            return [fileno for fileno, _ in self._poll.poll(timeout_ms)]
+        filenos = list(self._filenos)
+        if self._readable:
+            return select.select(filenos, [], [], timeout)[0]
+        # Like poll, report sockets in error also when they are not writable,
+        # so that the caller reads the error with SO_ERROR.
+        _, writable, failed = select.select([], filenos, filenos, timeout)
+        return writable + [fileno for fileno in failed if fileno not in writable]
+
+    def unregister(self, fileno):
+        self._filenos.discard(fileno)
+        if self._poll:
+            self._poll.unregister(fileno)
+
+
 class _NamedCache(object):
+    """Named values with the latest added value as the default.
+
+    Servers may add connections from a background thread, so the cache is
+    guarded with a lock.
+    """
 
     def __init__(self, basename):
         self._basename = basename
         self._counter = 0
-        self._cache = {}
+        self._cache = OrderedDict()
         self._current = None
+        self._lock = RLock()
 
-    def add(self, value, name=None):
-        name = name or self._next_name()
-        self._cache[name] = value
-        self._current = name
+    def add(self, value, name=None, select=True):
+        """Adds `value` with `name` and makes it the default if `select` is
+        true or there is no default yet."""
+        with self._lock:
+            name = name or self._next_name()
+            self._cache[name] = value
+            if select or self._current is None:
+                self._current = name
 
     def _next_name(self):
         self._counter += 1
         return self._basename + str(self._counter)
 
     def get_with_name(self, name=None):
-        if not name:
-            name = self._current
-            logger.debug("Choosing %s by default" % self._current)
-        return self._cache[name], name
+        with self._lock:
+            if not name:
+                name = self._current
+                logger.debug("Choosing %s by default" % self._current)
+            return self._cache[name], name
 
     def get(self, name=None):
         return self.get_with_name(name)[0]
 
+    def get_name(self, name=None):
+        return name or self._current
+
+    def remove(self, name=None):
+        with self._lock:
+            value, name = self.get_with_name(name)
+            del self._cache[name]
+            if name == self._current:
+                self._current = self._cache.keys()[-1] if self._cache else None
+            return value
+
+    def items(self):
+        with self._lock:
+            return self._cache.items()
+
+    def __contains__(self, name):
+        with self._lock:
+            return name in self._cache
+
     def __iter__(self):
-        return self._cache.itervalues()
+        # Copy of values, because servers may add connections in background.
+        with self._lock:
+            return iter(self._cache.values())
 
 
 class BufferedStream(_WithTimeouts):
@@ -381,3 +1224,107 @@ class BufferedStream(_WithTimeouts):
 
     def empty(self):
         self._buffer = ''
+
+
+class DatagramStream(_WithTimeouts):
+    """Keeps every received datagram as a separate frame.
+
+    Frames are queued per source address, so that messages from one peer
+    can be read without losing or mixing frames sent by other peers.
+    """
+
+    def __init__(self, connection, default_timeout):
+        self._connection = connection
+        self._default_timeout = default_timeout
+        self.empty()
+
+    def read_frame(self, address=None, timeout=None):
+        """Returns the next datagram and its source address.
+
+        If `address` is given, only frames from that address are returned and
+        frames from other addresses are queued for later reads.
+        """
+        return self._receive_until(lambda: self._pop_frame(address), timeout)
+
+    def next_address(self, timeout=None, accept=None):
+        """Returns the source address of the oldest queued frame, receiving a
+        new datagram if necessary. The frame itself is not consumed.
+
+        `accept` can be given to only consider addresses for which it returns
+        true.
+        """
+        if accept:
+            return self._receive_until(lambda: self._oldest_accepted_address(accept), timeout)
+        return self._receive_until(self._oldest_address, timeout)
+
+    def _receive_until(self, get_result, timeout):
+        timeout = self._get_timeout(timeout)
+        cutoff = time.time() + timeout if timeout is not None else None
+        result = get_result()
+        while result is None:
+            self._receive(self._remaining(cutoff))
+            result = get_result()
+        return result
+
+    def _remaining(self, cutoff):
+        if cutoff is None:
+            return 'blocking'
+        remaining = cutoff - time.time()
+        if remaining <= 0:
+            raise socket.timeout('timed out')
+        return remaining
+
+    def _receive(self, timeout):
+        data, ip, port = self._connection._receive_from_socket(timeout)
+        self._add_frame((ip, port), data)
+
+    def _add_frame(self, address, data):
+        index = self._counter
+        self._counter += 1
+        self._frames.setdefault(address, deque()).append((index, data))
+        self._arrivals.append((index, address))
+        self._pending += 1
+
+    def _pop_frame(self, address):
+        if address is None:
+            address = self._oldest_address()
+        frames = self._frames.get(address)
+        if not frames:
+            return None
+        _, data = frames.popleft()
+        if not frames:
+            del self._frames[address]
+        self._pending -= 1
+        self._prune_arrivals()
+        return data, address
+
+    def _oldest_address(self):
+        while self._arrivals:
+            index, address = self._arrivals[0]
+            frames = self._frames.get(address)
+            if frames and frames[0][0] == index:
+                return address
+            self._arrivals.popleft()
+        return None
+
+    def _oldest_accepted_address(self, accept):
+        candidates = [(frames[0][0], address) for address, frames in self._frames.items()
+                      if accept(address)]
+        return min(candidates)[1] if candidates else None
+
+    def _prune_arrivals(self):
+        # Frames read by address leave stale entries in the arrival order.
+        if len(self._arrivals) > 2 * self._pending + 64:
+            self._arrivals = deque(sorted((index, address)
+                                          for address, frames in self._frames.items()
+                                          for index, _ in frames))
+
+    def empty(self, address=None):
+        if address is None:
+            self._frames = {}
+            self._arrivals = deque()
+            self._counter = 0
+            self._pending = 0
+        elif address in self._frames:
+            self._pending -= len(self._frames.pop(address))
+            self._prune_arrivals()
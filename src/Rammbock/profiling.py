@@ -0,0 +1,215 @@
+#  Copyright 2012 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from __future__ import with_statement
+import cProfile
+import pstats
+import re
+
+import message
+from metrics import monotonic
+from networking import _NetworkNode, UDPServer, UnixDatagramServer
+from ordered_dict import OrderedDict
+from templates.containers import Protocol, MessageTemplate
+
+
+def _raw_assembly_targets():
+    return [(cls, name) for cls in vars(message).values() if isinstance(cls, type)
+            for name in ('_get_raw_bytes', '_collect_raw_segments') if name in vars(cls)]
+
+
+# Phases of sending and receiving messages outside the library instance.
+HOT_PATH = [('encode', [(MessageTemplate, 'encode')]),
+            ('raw assembly', _raw_assembly_targets()),
+            ('socket I/O', [(_NetworkNode, '_receive_from_socket'), (_NetworkNode, '_sendall'),
+                            (UDPServer, '_sendto'), (UnixDatagramServer, '_sendto')]),
+            ('framing', [(Protocol, 'read'), (Protocol, 'read_frame')]),
+            ('decode', [(MessageTemplate, 'decode')])]
+
+OUTSIDE_KEYWORDS = '(outside keywords)'
+
+
+class PhaseTimer(object):
+    """Measures time spent in the phases of sending and receiving messages
+    per keyword.
+
+    Timed methods are wrapped only when the timer is installed, so profiling
+    costs nothing when it is not enabled. The wrappers replace methods of the
+    classes, so only one timer is installed at a time: installing a timer
+    uninstalls the previously installed one, and the timer uninstalls itself
+    when the test execution ends. Times are exclusive: time spent in
+    a nested phase, e.g. socket I/O while framing, is only counted to the
+    nested phase. The timer is also a Robot Framework listener, which it uses
+    to attribute the phases to the running keyword.
+    """
+
+    ROBOT_LISTENER_API_VERSION = 2
+    _installed = None
+
+    def __init__(self, clock=monotonic):
+        self._clock = clock
+        self._patched = []
+        self.reset()
+
+    def reset(self):
+        self._stack = []
+        self._keywords = []
+        self._phases = OrderedDict()
+        self._keyword_times = OrderedDict()
+
+    def install(self, library=None, library_methods=()):
+        """Wraps the hot path methods and given `library_methods` of the
+        `library` instance with timers."""
+        if PhaseTimer._installed is self:
+            raise AssertionError('Phase timer is already installed.')
+        if PhaseTimer._installed:
+            PhaseTimer._installed.uninstall()
+        PhaseTimer._installed = self
+        for phase, targets in HOT_PATH:
+            for owner, name in targets:
+                self._patch(owner, name, phase)
+        for phase, name in library_methods:
+            self._patch(library, name, phase)
+
+    def _patch(self, owner, name, phase):
+        original = vars(owner).get(name)
+        function = getattr(owner, name)
+        if isinstance(owner, type):
+            function = getattr(function, 'im_func', function)
+        setattr(owner, name, self.timed(phase, function))
+        self._patched.append((owner, name, original))
+
+    def uninstall(self):
+        for owner, name, original in reversed(self._patched):
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        self._patched = []
+        if PhaseTimer._installed is self:
+            PhaseTimer._installed = None
+
+    @property
+    def installed(self):
+        return PhaseTimer._installed is self
+
+    def timed(self, phase, function):
+        def timed_function(*args, **kwargs):
+            self._stack.append([phase, self._clock(), 0.0])
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._stop()
+        timed_function.__name__ = function.__name__
+        timed_function.__doc__ = function.__doc__
+        return timed_function
+
+    def _stop(self):
+        phase, started, nested = self._stack.pop()
+        elapsed = self._clock() - started
+        keyword = self._keywords[-1] if self._keywords else None
+        if keyword:
+            keyword[2] = True
+        stats = self._phases.setdefault((keyword[0] if keyword else OUTSIDE_KEYWORDS, phase), [0, 0.0])
+        if phase not in [frame[0] for frame in self._stack]:
+            stats[0] += 1
+        stats[1] += elapsed - nested
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def start_keyword(self, name, attrs):
+        self._keywords.append([name, self._clock(), False])
+
+    def end_keyword(self, name, attrs):
+        if not self._keywords:
+            return
+        name, started, timed = self._keywords.pop()
+        if timed:
+            stats = self._keyword_times.setdefault(name, [0, 0.0])
+            stats[0] += 1
+            stats[1] += self._clock() - started
+
+    def close(self):
+        self.uninstall()
+
+    def breakdown(self):
+        """Returns rows of keyword, phase, calls and total seconds. Time of a
+        keyword not spent in any phase is reported as phase `other`."""
+        rows = []
+        for keyword in self._timed_keywords():
+            phase_total = 0.0
+            for (phase_keyword, phase), (calls, seconds) in self._phases.items():
+                if phase_keyword == keyword:
+                    rows.append((keyword, phase, calls, seconds))
+                    phase_total += seconds
+            if keyword in self._keyword_times:
+                calls, seconds = self._keyword_times[keyword]
+                rows.append((keyword, 'other', calls, max(seconds - phase_total, 0.0)))
+        return rows
+
+    def _timed_keywords(self):
+        keywords = []
+        for keyword, _ in self._phases:
+            if keyword not in keywords:
+                keywords.append(keyword)
+        return keywords
+
+    def format_breakdown(self):
+        rows = self.breakdown()
+        if not rows:
+            return 'No phases timed.'
+        width = max(len(row[0]) for row in rows)
+        lines = ['%-*s  %-12s %8s %12s %12s' % (width, 'Keyword', 'Phase', 'Calls', 'Total ms', 'Per call us')]
+        for keyword, phase, calls, seconds in rows:
+            lines.append('%-*s  %-12s %8d %12.3f %12.1f' %
+                         (width, keyword, phase, calls, seconds * 1000, seconds * 1000000 / calls if calls else 0))
+        return '\n'.join(lines)
+
+
+def profile_file_name(name):
+    """Returns `name`, like a test name, with characters not safe in file
+    names replaced with underscores."""
+    return re.sub(r'[^\w.-]', '_', name)
+
+
+class KeywordProfiler(object):
+    """Profiles everything run between `start` and `stop` with cProfile."""
+
+    def __init__(self):
+        self._profile = None
+
+    @property
+    def running(self):
+        return self._profile is not None
+
+    def start(self):
+        if self.running:
+            raise AssertionError('Profiling is already started.')
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self, path, top=20):
+        """Stops profiling and writes the profile to `path` with `.prof`
+        extension and `top` functions by cumulative time to `path` with
+        `.txt` extension. Returns the paths of the written files."""
+        if not self.running:
+            raise AssertionError('Profiling is not started.')
+        profile, self._profile = self._profile, None
+        profile.disable()
+        prof_path, summary_path = path + '.prof', path + '.txt'
+        profile.dump_stats(prof_path)
+        with open(summary_path, 'w') as output:
+            stats = pstats.Stats(profile, stream=output)
+            stats.strip_dirs().sort_stats('cumulative').print_stats(int(top))
+        return prof_path, summary_path
@@ -12,11 +12,14 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from __future__ import with_statement
 import os
 
 from core import RammbockCore
+from robot.api import logger
 from robot.libraries.BuiltIn import BuiltIn
 from message_sequence import SeqdiagGenerator
+from profiling import profile_file_name
 from version import VERSION
 
 
@@ -153,3 +156,46 @@ class Rammbock(RammbockCore):
         outputdir = BuiltIn().replace_variables('${OUTPUTDIR}')
         path = os.path.join(outputdir, test_name + '.seqdiag')
         SeqdiagGenerator().compile(path, self._message_sequence)
+
+    def start_profiling(self):
+        """Starts profiling the keywords run after this with Python cProfile.
+
+        Profiling continues until `Stop Profiling`, also over several tests.
+        Profiling slows down execution considerably, so measure timings
+        without it.
+
+        Examples:
+        | Start profiling |
+        | Client sends messages at rate | 1000 | count=10000 |
+        | Stop profiling |
+        """
+        self._profiler.start()
+
+    def stop_profiling(self, name=None, top=20):
+        """Stops profiling started with `Start Profiling` and writes the results
+        to output folder.
+
+        The profile is written to a file named `name`, or the current test or
+        suite name, with `.prof` extension. Characters other than letters,
+        digits, `.`, `-` and `_` in the name are replaced with `_`. The
+        profile can be examined further with Python pstats module or tools
+        like snakeviz. `top` functions sorted by
+        cumulative time are written to a `.txt` file and logged. Links to both
+        files, relative to the output folder, are added to the log.
+
+        Examples:
+        | Stop profiling |
+        | Stop profiling | name=send_at_rate | top=50 |
+        """
+        outputdir = BuiltIn().replace_variables('${OUTPUTDIR}')
+        if not name:
+            name = BuiltIn().get_variable_value('${TEST NAME}') or \
+                BuiltIn().replace_variables('${SUITE NAME}')
+        prof_path, summary_path = self._profiler.stop(os.path.join(outputdir, profile_file_name(name)), top)
+        with open(summary_path) as summary:
+            logger.info(summary.read())
+        # Paths relative to the output directory keep the links working when
+        # the outputs are moved.
+        prof_path, summary_path = [os.path.relpath(path, outputdir) for path in (prof_path, summary_path)]
+        logger.info('Profile: <a href="%s">%s</a>, summary: <a href="%s">%s</a>' %
+                    (prof_path, prof_path, summary_path, summary_path), True)
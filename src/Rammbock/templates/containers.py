@@ -13,14 +13,18 @@
 #  limitations under the License.
 
 from math import ceil
-import re
 
-from Rammbock.message import Field, Union, Message, Header, List, Struct, BinaryContainer, BinaryField, TBCDContainer
-from message_stream import MessageStream
-from primitives import Length, Binary, TBCD
+from Rammbock.message import Field, Union, Message, Header, List, Struct, BinaryContainer, BinaryField, TBCDContainer, \
+    LazyFields
+from message_stream import MessageStream, DatagramMessageStream
+from primitives import Length, Binary, TBCD, PlaceHolderField
+from parameters import ParameterTree, as_parameters
 from Rammbock.ordered_dict import OrderedDict
 from Rammbock.binary_tools import to_binary_string_of_length, to_bin, to_tbcd_value, to_tbcd_binary
 
+# Approximate size of the chunks of streamed messages.
+STREAM_CHUNK_SIZE = 65536
+
 
 class _Template(object):
 
@@ -31,13 +35,22 @@ class _Template(object):
         self._saved = False
 
     def _pretty_print_fields(self, fields):
-        return ', '.join('%s:%s' % (key, value) for key, value in fields.items())
+        return ', '.join('%s:%s' % (key, value) for key, value in fields.flatten())
 
     def _mark_referenced_field(self, field):
-        ref_field = self._get_field_recursive(field.length.field)
+        ref_field, levels = self._find_referenced_field(field.length.field)
         if not ref_field:
             raise AssertionError('Length field %s unknown' % field.length.field)
         ref_field.referenced_later = True
+        field.length.resolve(levels)
+
+    def _find_referenced_field(self, field_name, levels=0):
+        """Returns the field with `field_name` in this or an enclosing
+        template and the number of levels up it was found."""
+        field = self._get_field(field_name)
+        if field or not self.parent:
+            return field, levels
+        return self.parent._find_referenced_field(field_name, levels + 1)
 
     def add(self, field):
         if field.type == 'pdu':
@@ -58,9 +71,7 @@ class _Template(object):
         return self._get_field(field_name) or self.parent and self.parent._get_field_recursive(field_name)
 
     def _check_params_empty(self, message_fields, name):
-        for key in message_fields.keys():
-            if key.startswith('*'):
-                message_fields.pop(key)
+        message_fields.remove_wildcards()
         if message_fields:
             raise AssertionError("Unknown fields in '%s': %s" %
                                  (self._get_recursive_name(), self._pretty_print_fields(message_fields)))
@@ -69,6 +80,7 @@ class _Template(object):
         return (self.parent._get_recursive_name() + "." if self.parent else '') + self.name
 
     def _encode_fields(self, struct, params, little_endian=False):
+        params = as_parameters(params)
         for field in self._fields.values():
             encoded = field.encode(params, struct, little_endian=little_endian)
             # TODO: clean away this ugly hack that makes it possible to skip PDU
@@ -85,7 +97,37 @@ class _Template(object):
             data_index += len(message[field.name])
         return message
 
+    def decode_lazily(self, data, parent=None, name=None, little_endian=False):
+        return self.decode(data, parent, name, little_endian)
+
+    def _decode_fields_lazily(self, data, parent, name, little_endian):
+        message = self._get_struct(name, parent)
+        decode = lambda field, data, element, name: _decode_lazily(field, data, element, name, little_endian)
+        message._fields = LazyFields(message, data, decode)
+        data_index = 0
+        for field in self._fields.values():
+            length = field.decoded_length()
+            if length is None or data_index + length > len(data):
+                message[field.name] = decode(field, data[data_index:], message, None)
+                length = len(message[field.name])
+            else:
+                message._fields.add_lazy(field.name, field, data_index, length)
+            data_index += length
+        return message
+
+    def decoded_length(self):
+        """Length of decoded element in bytes or None if it depends on the
+        decoded data."""
+        lengths = [field.decoded_length() for field in self._fields.values()]
+        return None if None in lengths else sum(lengths)
+
+    def has_checks(self):
+        """Returns True if validating the element can fail even when no
+        values are expected for it."""
+        return any(field.has_checks() for field in self._fields.values())
+
     def validate(self, message, message_fields):
+        message_fields = as_parameters(message_fields)
         errors = []
         for field in self._fields.values():
             errors += field.validate(message, message_fields)
@@ -93,15 +135,7 @@ class _Template(object):
         return errors
 
     def _get_params_sub_tree(self, params, name=None):
-        result = {'*': params['*']} if '*' in params else {}
-        name = name or self.name
-        for key in params.keys():
-            prefix, _, ending = key.partition('.')
-            if prefix == name:
-                result[ending] = params.pop(key)
-            elif prefix == '*' and ending:
-                result[ending] = params[key]
-        return result
+        return as_parameters(params).subtree(name or self.name)
 
     def _get_struct(self, name, parent):
         return None
@@ -125,7 +159,7 @@ class Protocol(_Template):
             return -1
 
     def encode(self, message, header_params, little_endian=False):
-        header_params = header_params.copy()
+        header_params = ParameterTree(header_params)
         header = Header(self.name)
         self._encode_fields(header, header_params, little_endian=little_endian)
         return header
@@ -154,52 +188,197 @@ class Protocol(_Template):
         return data[data_index:]
 
     def read(self, stream, timeout=None):
+        header = self.read_header(stream, timeout)
+        pdu_bytes = None
+        if self.pdu:
+            pdu_bytes = stream.read(self._get_pdu_length(header))
+        return header, pdu_bytes
+
+    def read_header(self, stream, timeout=None):
+        """Reads only the header from the stream. The PDU is left to the
+        stream, see `get_pdu_length`."""
         #TODO: use all data if length cannot be obtained. Return amount of data
         #used to stream
         data = stream.read(self.header_length(), timeout=timeout)
         header = Header(self.name)
         unused_data = self._extract_values_from_data(data, header, self._fields.values())
         stream.return_data(unused_data)
+        return header
+
+    def get_pdu_length(self, header):
+        return self._get_pdu_length(header) if self.pdu else 0
+
+    def read_frame(self, data):
+        """Reads header and PDU from one complete frame, e.g. a datagram.
+
+        Bytes after the PDU are ignored.
+        """
+        header = Header(self.name)
+        unused_data = self._extract_values_from_data(data, header, self._fields.values())
         pdu_bytes = None
         if self.pdu:
-            length_param = header[self.pdu_length.field].int
-            pdu_bytes = stream.read(self.pdu_length.calc_value(length_param))
+            pdu_length = self._get_pdu_length(header)
+            if len(unused_data) < pdu_length:
+                raise AssertionError('Frame too short for %s PDU. Needs %d bytes, given %d' %
+                                     (self.name, pdu_length, len(unused_data)))
+            pdu_bytes = unused_data[:pdu_length]
         return header, pdu_bytes
 
-    def get_message_stream(self, buffered_stream):
-        return MessageStream(buffered_stream, self)
+    def _get_pdu_length(self, header):
+        length_param = header[self.pdu_length.field].int
+        return self.pdu_length.calc_value(length_param)
+
+    def get_message_stream(self, buffered_stream, statistics=None):
+        return MessageStream(buffered_stream, self, statistics)
+
+    def get_datagram_message_stream(self, datagram_stream, address=None, statistics=None):
+        return DatagramMessageStream(datagram_stream, self, address, statistics)
 
 
 class MessageTemplate(_Template):
 
     type = 'Message'
 
-    def __init__(self, message_name, protocol, header_params):
+    def __init__(self, message_name, protocol, header_params, lazy=False):
         _Template.__init__(self, message_name, None)
         self._protocol = protocol
         self.header_parameters = header_params
         self.length = protocol.pdu_length
+        self.lazy = lazy
 
     def decode(self, data, parent=None, name=None, little_endian=False):
+        if self.lazy:
+            return self.decode_lazily(data, parent, name, little_endian)
         msg = _Template.decode(self, data, parent, name, little_endian)
+        return self._verify_all_data_decoded(msg, data)
+
+    def decode_lazily(self, data, parent=None, name=None, little_endian=False):
+        """Decodes fields with a static length only when they are accessed."""
+        msg = self._decode_fields_lazily(data, parent, name, little_endian)
+        return self._verify_all_data_decoded(msg, data)
+
+    def _verify_all_data_decoded(self, msg, data):
         if len(msg) < len(data):
             raise AssertionError('Receiving %s failed, message too long' % self.name)
         return msg
 
     def encode(self, message_params, header_params, little_endian=False):
-        message_params = message_params.copy()
         if self.only_header:
             parameters = self._headers(message_params)
             return self._protocol.encode(None, parameters)
+        message_params = ParameterTree(message_params)
         msg = Message(self.name)
         self._encode_fields(msg, message_params, little_endian=little_endian)
         if self._protocol:
             # TODO: little endian support for protocol header
             header = self._protocol.encode(msg, self._headers(header_params))
-            self.length.find_length_and_set_if_necessary(header, len(msg._raw))
+            self.length.find_length_and_set_if_necessary(header, len(msg))
             msg._add_header(header)
         return msg
 
+    def encode_stream(self, message_params, header_params, length=None, chunk_size=STREAM_CHUNK_SIZE,
+                      little_endian=False):
+        """Encodes the message as binary chunks of about `chunk_size` bytes.
+
+        Lists directly in the message are encoded one element at a time and
+        other fields one field at a time, so the whole message is never in
+        memory. The header is sent first, so the PDU `length` must be given
+        unless all fields have a static length.
+        """
+        if self.only_header:
+            yield self.encode(message_params, header_params)._raw
+            return
+        pdu_length = self._stream_length(length)
+        header = self._protocol.encode(None, self._headers(header_params))
+        self.length.find_length_and_set_if_necessary(header, pdu_length)
+        for chunk in _chunks(header._raw_segments, chunk_size):
+            yield chunk
+        streamed = 0
+        for chunk in _chunks(self._stream_segments(ParameterTree(message_params), little_endian), chunk_size):
+            streamed += len(chunk)
+            yield chunk
+        if streamed != pdu_length:
+            raise AssertionError('Length of streamed %s does not match defined length. defined length:%s '
+                                 'streamed length:%s' % (self.name, pdu_length, streamed))
+
+    def _stream_length(self, length):
+        if length not in (None, ''):
+            return int(length)
+        try:
+            return sum(field.get_static_length() for field in self._fields.values())
+        except IndexError:
+            raise AssertionError('Length of %s is dynamic. Length must be given when streaming it.' % self.name)
+
+    def _stream_segments(self, params, little_endian):
+        msg = Message(self.name)
+        for field in self._fields.values():
+            if isinstance(field, ListTemplate):
+                for element in field.encode_elements(params, msg, little_endian=little_endian):
+                    for segment in element._raw_segments:
+                        yield segment
+                continue
+            encoded = field.encode(params, msg, little_endian=little_endian)
+            if isinstance(encoded, PlaceHolderField):
+                raise AssertionError("Value of %s must be given when streaming, it cannot be set afterwards."
+                                     % field._get_recursive_name(msg))
+            msg[field.name] = encoded
+            for segment in encoded._raw_segments:
+                yield segment
+        self._check_params_empty(params, self.name)
+
+    def decode_incrementally(self, read, little_endian=False):
+        """Decodes a message whose last field is a list from data returned by
+        `read(size)` without decoding the list elements.
+
+        Returns the message and a generator that decodes the list elements
+        one at a time as their data is read. The list in the message holds
+        only the latest element. Fields before the list and the elements
+        must have static lengths.
+        """
+        fields = self._fields.values()
+        if not fields or not isinstance(fields[-1], ListTemplate):
+            raise AssertionError('Last field of %s must be a list to decode it incrementally.' % self.name)
+        try:
+            length = sum(field.get_static_length() for field in fields[:-1])
+        except IndexError:
+            raise AssertionError('Fields before list %s must have static lengths to decode it incrementally.'
+                                 % fields[-1].name)
+        data = read(length)
+        if len(data) < length:
+            raise AssertionError('Receiving %s failed, message too short' % self.name)
+        msg = self._get_struct(self.name)
+        data_index = 0
+        for field in fields[:-1]:
+            msg[field.name] = field.decode(data[data_index:], msg, little_endian=little_endian)
+            data_index += len(msg[field.name])
+        return msg, fields[-1].decode_elements(read, msg, little_endian=little_endian)
+
+    def validate_incrementally(self, message, elements, message_fields, max_errors=10):
+        """Validates a message returned by `decode_incrementally` consuming
+        its list `elements` one at a time.
+
+        Returns the number of elements, the number of invalid elements and
+        errors of other fields and of the first `max_errors` invalid elements.
+        """
+        fields = self._fields.values()
+        message_fields = as_parameters(message_fields)
+        errors = []
+        for field in fields[:-1]:
+            errors += field.validate(message, message_fields)
+        list_template = fields[-1]
+        params = list_template._get_params_sub_tree(message_fields)
+        count = invalid = 0
+        for element in elements:
+            element_errors = list_template.field.validate(element._parent, params, name=element._name)
+            count += 1
+            if element_errors:
+                invalid += 1
+                if invalid <= max_errors:
+                    errors += element_errors
+        list_template._check_params_empty(params, list_template.name)
+        self._check_params_empty(message_fields, self.name)
+        return count, invalid, errors
+
     def _headers(self, header_params):
         result = {}
         result.update(self.header_parameters)
@@ -251,8 +430,22 @@ class StructTemplate(_Template):
             data = data[:length]
         return _Template.decode(self, data, parent, name, little_endian)
 
+    def decode_lazily(self, data, parent=None, name=None, little_endian=False):
+        if self.has_length:
+            data = data[:self.length.decode(parent)]
+        return self._decode_fields_lazily(data, parent, name, little_endian)
+
+    def decoded_length(self):
+        if self.has_length:
+            return None
+        return _Template.decoded_length(self)
+
+    def has_checks(self):
+        return self.has_length or bool(self._parameters) or _Template.has_checks(self)
+
     def encode(self, message_params, parent=None, name=None, little_endian=False):
         struct = self._get_struct(name, parent)
+        message_params = as_parameters(message_params)
         self._add_struct_params(message_params)
         self._encode_fields(struct,
                             self._get_params_sub_tree(message_params, name),
@@ -270,19 +463,21 @@ class StructTemplate(_Template):
         return struct
 
     def validate(self, parent, message_fields, name=None):
+        message_fields = as_parameters(message_fields)
         self._add_struct_params(message_fields)
         errors = []
         name = name or self.name
         message = parent[name]
         if self.has_length:
-            length = self.length.decode(message)
+            length = self.length.decode(parent)
             if len(message) != length:
                 errors.append('Length of struct %s does not match defined length. defined length:%s struct length:%s' % (message._name, length, len(message)))
         return errors + _Template.validate(self, message, self._get_params_sub_tree(message_fields, name))
 
     def _add_struct_params(self, params):
         for key in self._parameters.keys():
-            params[key] = self._parameters.pop(key) if key not in params else params[key]
+            if not params.contains(key):
+                params.add(key, self._parameters.pop(key))
 
 
 class UnionTemplate(_Template):
@@ -300,10 +495,24 @@ class UnionTemplate(_Template):
     def get_static_length(self):
         return max(field.get_static_length() for field in self._fields.values())
 
+    def decoded_length(self):
+        return self.get_static_length()
+
     def decode(self, data, parent=None, name=None, little_endian=False):
+        decode = lambda field, data, union, name: field.decode(data, union, name, little_endian=little_endian)
+        return self._decode_arms(data, parent, name, decode)
+
+    def decode_lazily(self, data, parent=None, name=None, little_endian=False):
+        decode = lambda field, data, union, name: _decode_lazily(field, data, union, name, little_endian)
+        return self._decode_arms(data, parent, name, decode)
+
+    def _decode_arms(self, data, parent, name, decode):
+        # All alternatives decode the same data, so each one is decoded only
+        # when it is accessed.
         union = self._get_struct(name, parent)
+        union._fields = LazyFields(union, data, decode)
         for field in self._fields.values():
-            union[field.name] = field.decode(data, union, little_endian=little_endian)
+            union._fields.add_lazy(field.name, field, 0, len(data))
         return union
 
     def encode(self, union_params, parent=None, name=None, little_endian=False):
@@ -327,15 +536,22 @@ class UnionTemplate(_Template):
 
     def validate(self, parent, message_fields, name=None):
         name = name or self.name
-        message = parent[name]
-        return _Template.validate(self, message, self._get_params_sub_tree(message_fields, name))
+        union = parent[name]
+        params = self._get_params_sub_tree(message_fields, name)
+        names = params.names
+        errors = []
+        for field in self._fields.values():
+            # Validating an alternative without expected values would only decode it.
+            if field.has_checks() or names is None or field.name in names:
+                errors += field.validate(union, params)
+        self._check_params_empty(params, self.name)
+        return errors
 
 
 #TODO: check that only one field is added to list
 #TODO: list field could be overriden
 class ListTemplate(_Template):
 
-    param_pattern = re.compile(r'([^.]*?)\[(.*?)\](.*)')
     has_length = True
     type = 'List'
 
@@ -344,19 +560,37 @@ class ListTemplate(_Template):
         _Template.__init__(self, name, parent)
 
     def get_static_length(self):
+        if not self.length.static:
+            raise IndexError('Length of %s is dynamic.' % self.name)
         return self.length.value * self.field.get_static_length()
 
+    def decoded_length(self):
+        element_length = self.field.decoded_length()
+        if not self.length.static or element_length is None:
+            return None
+        return self.length.value * element_length
+
     def encode(self, message_params, parent, name=None, little_endian=False):
+        list = self._get_struct(name, parent)
+        for index, element in enumerate(self._encode_elements(message_params, list, parent, name, little_endian)):
+            list[str(index)] = element
+        return list
+
+    def encode_elements(self, message_params, parent, name=None, little_endian=False):
+        """Encodes the elements of the list one at a time."""
+        return self._encode_elements(message_params, self._get_struct(name, parent), parent, name, little_endian)
+
+    def _encode_elements(self, message_params, holder, parent, name, little_endian):
+        # Elements are encoded in the list like when decoding, so length
+        # references are found the same number of levels up.
         name = name or self.name
         params_subtree = self._get_params_sub_tree(message_params, name)
-        list = self._get_struct(name, parent)
-        for index in range(self.length.decode(parent)):
-            list[str(index)] = self.field.encode(params_subtree,
-                                                 parent,
-                                                 name=str(index),
-                                                 little_endian=little_endian)
+        for index in xrange(self.length.decode(parent)):
+            yield self.field.encode(params_subtree,
+                                    holder,
+                                    name=str(index),
+                                    little_endian=little_endian)
         self._check_params_empty(params_subtree, name)
-        return list
 
     @property
     def field(self):
@@ -367,7 +601,66 @@ class ListTemplate(_Template):
         ls._parent = parent
         return ls
 
+    def decode_elements(self, read, parent, name=None, little_endian=False):
+        """Decodes the elements of the list one at a time from data returned
+        by `read(size)`.
+
+        The list is added to `parent` but holds only the latest element.
+        Elements must have a static length. A free length list ends when
+        `read` returns no more data.
+        """
+        name = name or self.name
+        try:
+            element_length = self.field.get_static_length()
+        except IndexError:
+            raise AssertionError('Elements of list %s must have static length to decode them incrementally.' % name)
+        count = None if self.length.free else self.length.decode(parent)
+        holder = self._get_struct(name, parent)
+        parent[name] = holder
+        return self._decode_elements(read, holder, element_length, count, little_endian)
+
+    def _decode_elements(self, read, holder, element_length, count, little_endian):
+        index = 0
+        while count is None or index < count:
+            data = read(element_length)
+            if not data and count is None:
+                return
+            holder._fields = OrderedDict()
+            holder[str(index)] = self.field.decode(data, holder, name=str(index), little_endian=little_endian)
+            yield holder[str(index)]
+            index += 1
+
     def decode(self, data, parent, name=None, little_endian=False):
+        decode = lambda field, data, list, name: field.decode(data, list, name=name, little_endian=little_endian)
+        return self._decode_static_elements(data, parent, name, decode) or \
+            self._decode_all_elements(data, parent, name, little_endian)
+
+    def decode_lazily(self, data, parent, name=None, little_endian=False):
+        decode = lambda field, data, list, name: _decode_lazily(field, data, list, name, little_endian)
+        return self._decode_static_elements(data, parent, name, decode) or \
+            self._decode_all_elements(data, parent, name, little_endian)
+
+    def _decode_static_elements(self, data, parent, name, decode):
+        # Element i of a list with static length elements starts at
+        # i * element length, so elements are decoded only when accessed.
+        element_length = self.field.decoded_length()
+        if not element_length:
+            return None
+        if self.length.free:
+            count, remainder = divmod(len(data), element_length)
+            if remainder:
+                return None
+        else:
+            count = self.length.decode(parent)
+            if count * element_length > len(data):
+                return None
+        message = self._get_struct(name or self.name, parent)
+        message._fields = LazyFields(message, data, decode)
+        for index in xrange(count):
+            message._fields.add_lazy(str(index), self.field, index * element_length, element_length)
+        return message
+
+    def _decode_all_elements(self, data, parent, name, little_endian):
         name = name or self.name
         message = self._get_struct(name, parent)
         data_index = 0
@@ -384,34 +677,20 @@ class ListTemplate(_Template):
         params_subtree = self._get_params_sub_tree(message_fields, name)
         list = parent[name]
         errors = []
-        for index in range(list.len):
+        if self.field.has_checks():
+            indices = xrange(list.len)
+        else:
+            indices = self._indices_with_params(params_subtree, list.len)
+        for index in indices:
             errors += self.field.validate(list, params_subtree, name=str(index))
         self._check_params_empty(params_subtree, name)
         return errors
 
-    def _get_params_sub_tree(self, params, name=None):
-        result = OrderedDict({'*': params['*']} if '*' in params else {})
-        name = name or self.name
-        for key in params.keys():
-            self._consume_params_with_brackets(name, params, result, key)
-            self._consume_dot_syntax(name, params, result, key)
-        return result
-
-    def _consume_params_with_brackets(self, name, params, result, key):
-        match = self.param_pattern.match(key)
-        if match:
-            prefix, child_name, ending = match.groups()
-            if prefix == name:
-                result[child_name + ending] = params.pop(key)
-            elif prefix == '*':
-                result[child_name + ending] = params[key]
-
-    def _consume_dot_syntax(self, name, params, result, key):
-        prefix, _, ending = key.partition('.')
-        if prefix == name:
-            result[ending] = params.pop(key)
-        elif prefix == '*' and ending:
-            result[ending] = params[key]
+    def _indices_with_params(self, params, length):
+        names = params.names
+        if names is None:
+            return xrange(length)
+        return sorted(int(name) for name in names if name.isdigit() and int(name) < length)
 
 
 class BinaryContainerTemplate(_Template):
@@ -422,6 +701,9 @@ class BinaryContainerTemplate(_Template):
     def get_static_length(self):
         return self.binlength / 8
 
+    def decoded_length(self):
+        return self.get_static_length()
+
     def add(self, field):
         if not isinstance(field, Binary):
             raise AssertionError('Binary container can only have binary fields.')
@@ -480,6 +762,9 @@ class TBCDContainerTemplate(_Template):
     def get_static_length(self):
         return self.binlength / 8
 
+    def decoded_length(self):
+        return None
+
     def _verify_not_little_endian(self, little_endian):
         if little_endian:
             raise AssertionError('Little endian TBCD fields are not supported.')
@@ -520,3 +805,20 @@ class TBCDContainerTemplate(_Template):
         tbcd = TBCDContainer(name or self.name)
         tbcd._parent = parent
         return tbcd
+
+
+def _decode_lazily(field, data, parent, name, little_endian):
+    decode = getattr(field, 'decode_lazily', field.decode)
+    return decode(data, parent, name=name, little_endian=little_endian)
+
+
+def _chunks(segments, chunk_size):
+    buffered, size = [], 0
+    for segment in segments:
+        buffered.append(segment)
+        size += len(segment)
+        if size >= chunk_size:
+            yield ''.join(buffered)
+            buffered, size = [], 0
+    if buffered:
+        yield ''.join(buffered)
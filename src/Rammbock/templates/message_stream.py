@@ -14,43 +14,95 @@
 from robot.api import logger
 
 from Rammbock.binary_tools import to_bin
+from Rammbock.metrics import NodeStatistics
 
 
 class MessageStream(object):
 
-    def __init__(self, stream, protocol):
+    def __init__(self, stream, protocol, statistics=None):
         self._cache = []
         self._stream = stream
         self._protocol = protocol
+        self._statistics = statistics or NodeStatistics()
 
-    def get(self, message_template, timeout=None, header_filter=None):
+    def get(self, message_template, timeout=None, header_filter=None, incremental=False):
+        """Returns the next message matching `message_template`.
+
+        With `incremental`, returns the message without the elements of its
+        last list and a generator decoding the elements as their data is
+        read, see `MessageTemplate.decode_incrementally`. The elements must
+        be consumed before reading the next message.
+        """
         header_fields = message_template.header_parameters
         logger.trace("Get message with params %s" % header_fields)
-        msg = self._get_from_cache(message_template, header_fields, header_filter)
+        msg = self.get_from_cache(message_template, header_filter, incremental)
         if msg:
-            logger.trace("Cache hit. Cache currently has %s messages" % len(self._cache))
+            self._statistics.cache_hits += 1
             return msg
+        self._statistics.cache_misses += 1
         while True:
-            header, pdu_bytes = self._protocol.read(self._stream, timeout=timeout)
-            if self._matches(header, header_fields, header_filter):
-                return self._to_msg(message_template, header, pdu_bytes)
-            self._cache.append((header, pdu_bytes))
+            msg = self.read_next(message_template, timeout, header_filter, incremental)
+            if msg:
+                return msg
+
+    def get_from_cache(self, message_template, header_filter=None, incremental=False):
+        msg = self._get_from_cache(message_template, message_template.header_parameters, header_filter, incremental)
+        if msg:
+            logger.trace("Cache hit. Cache currently has %s messages" % len(self._cache))
+        return msg
+
+    def read_next(self, message_template, timeout=None, header_filter=None, incremental=False):
+        """Reads one message from the stream and returns it if it matches the
+        template. Otherwise the message is cached and None is returned."""
+        if incremental:
+            return self._read_next_incrementally(message_template, timeout, header_filter)
+        header, pdu_bytes = self._read(timeout)
+        if self._matches(header, message_template.header_parameters, header_filter):
+            return self._to_msg(message_template, header, pdu_bytes)
+        self._cache.append((header, pdu_bytes))
+        return None
+
+    def _read_next_incrementally(self, message_template, timeout, header_filter):
+        header = self._protocol.read_header(self._stream, timeout=timeout)
+        pdu_length = self._protocol.get_pdu_length(header)
+        if self._matches(header, message_template.header_parameters, header_filter):
+            return self._to_incremental_msg(message_template, header, _PDUReader(self._stream, pdu_length, timeout))
+        pdu_bytes = self._stream.read(pdu_length, timeout=timeout) if self._protocol.pdu else None
+        self._cache.append((header, pdu_bytes))
+        return None
+
+    def _read(self, timeout):
+        return self._protocol.read(self._stream, timeout=timeout)
 
-    def _get_from_cache(self, template, fields, header_filter):
+    def _get_from_cache(self, template, fields, header_filter, incremental=False):
         for index in range(len(self._cache)):
             header, pdu = self._cache[index]
             if self._matches(header, fields, header_filter):
                 self._cache.pop(index)
+                if incremental:
+                    return self._to_incremental_msg(template, header, _DataReader(pdu))
                 return self._to_msg(template, header, pdu)
         return None
 
     def _to_msg(self, template, header, pdu_bytes):
         if template.only_header:
             return header
-        msg = template.decode(pdu_bytes, parent=header)
+        msg = self._decode(template.decode, pdu_bytes, parent=header)
         msg._add_header(header)
         return msg
 
+    def _to_incremental_msg(self, template, header, reader):
+        msg, elements = self._decode(template.decode_incrementally, reader.read)
+        msg._add_header(header)
+        return msg, elements
+
+    def _decode(self, decode, *args, **kwargs):
+        try:
+            return decode(*args, **kwargs)
+        except Exception:
+            self._statistics.decode_failures += 1
+            raise
+
     def _matches(self, header, fields, header_filter):
         if header_filter:
             if header_filter not in fields:
@@ -60,6 +112,76 @@ class MessageStream(object):
                 return False
         return True
 
-    def empty(self):
+    def is_empty(self):
+        """Returns True if no read messages are cached."""
+        return not self._cache
+
+    def clear_cache(self):
+        """Discards cached messages, but not data that has not been read
+        yet, and returns the number of discarded messages."""
+        discarded = len(self._cache)
+        self._statistics.evictions += discarded
         self._cache = []
+        return discarded
+
+    def empty(self):
+        self.clear_cache()
         self._stream.empty()
+
+
+class DatagramMessageStream(MessageStream):
+    """Message stream where every datagram is exactly one message.
+
+    If `address` is given, only messages from that source address are read.
+    """
+
+    def __init__(self, stream, protocol, address=None, statistics=None):
+        MessageStream.__init__(self, stream, protocol, statistics)
+        self.address = address
+
+    def _read(self, timeout):
+        data, _ = self._stream.read_frame(self.address, timeout=timeout)
+        return self._decode(self._protocol.read_frame, data)
+
+    def _read_next_incrementally(self, message_template, timeout, header_filter):
+        # The whole datagram has already arrived, but its elements are still
+        # decoded one at a time.
+        header, pdu_bytes = self._read(timeout)
+        if self._matches(header, message_template.header_parameters, header_filter):
+            return self._to_incremental_msg(message_template, header, _DataReader(pdu_bytes))
+        self._cache.append((header, pdu_bytes))
+        return None
+
+    def empty(self):
+        self.clear_cache()
+        self._stream.empty(self.address)
+
+
+class _PDUReader(object):
+    """Reads at most `length` bytes of a PDU from a buffered stream in parts."""
+
+    def __init__(self, stream, length, timeout=None):
+        self._stream = stream
+        self._remaining = length
+        self._timeout = timeout
+
+    def read(self, size):
+        size = min(size, self._remaining)
+        if size <= 0:
+            return ''
+        data = self._stream.read(size, timeout=self._timeout)
+        self._remaining -= len(data)
+        return data
+
+
+class _DataReader(object):
+    """Reads already received PDU bytes in parts."""
+
+    def __init__(self, data):
+        self._data = data or ''
+        self._index = 0
+
+    def read(self, size):
+        data = self._data[self._index:self._index + size]
+        self._index += len(data)
+        return data
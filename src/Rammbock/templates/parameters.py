@@ -0,0 +1,123 @@
+#  Copyright 2012 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+
+def as_parameters(params):
+    """Returns `params` as a `ParameterTree`. Dictionaries are parsed to a
+    new tree, trees are returned as they are."""
+    if isinstance(params, ParameterTree):
+        return params
+    return ParameterTree(params)
+
+
+def parse_path(key):
+    """Splits a parameter name like `list[1].field` to `['list', '1', 'field']`."""
+    return key.replace(']', '').replace('[', '.').split('.')
+
+
+class ParameterTree(dict):
+    """Field values of a template element parsed to a tree.
+
+    Values of the fields of the element are items of the dictionary keyed
+    with the field name, so fields consume them with `pop` and `get`. Values
+    of nested elements are in subtrees, which containers take with
+    `subtree`. Every name is parsed only once, so routing the values down the
+    template tree does not scan all names on each level.
+
+    The value of `*` is the default value of all fields in the element and
+    the elements nested in it. Subtree `*` has values for all nested elements,
+    for example `*.first` for field `first` of all nested elements and `*[0]`
+    for the first element of all nested lists.
+    """
+
+    def __init__(self, params=None):
+        dict.__init__(self)
+        self._children = {}
+        if isinstance(params, ParameterTree):
+            self._merge(params)
+        elif params:
+            for key, value in params.items():
+                self.add(key, value)
+
+    def add(self, key, value):
+        path = parse_path(key)
+        node = self
+        for name in path[:-1]:
+            node = node._child(name)
+        dict.__setitem__(node, path[-1], value)
+
+    def contains(self, key):
+        path = parse_path(key)
+        node = self
+        for name in path[:-1]:
+            node = node._children.get(name)
+            if node is None:
+                return False
+        return path[-1] in node
+
+    def _child(self, name):
+        if name not in self._children:
+            self._children[name] = ParameterTree()
+        return self._children[name]
+
+    def _merge(self, other):
+        self.update(other)
+        for name, child in other._children.iteritems():
+            self._child(name)._merge(child)
+
+    def subtree(self, name):
+        """Removes and returns the values of nested element `name`.
+
+        Wildcard values are copied to the subtree and also remain here.
+        Values given for `name` override wildcard values. A value given for
+        `name` itself, like the chosen alternative of a union, is in the
+        subtree with an empty name.
+        """
+        own = self._children.pop(name, None)
+        if name in self:
+            own = own if own is not None else ParameterTree()
+            dict.__setitem__(own, '', self.pop(name))
+        wildcard = self._children.get('*')
+        if '*' not in self and not wildcard:
+            return own if own is not None else ParameterTree()
+        result = ParameterTree()
+        if '*' in self:
+            dict.__setitem__(result, '*', self['*'])
+        if wildcard:
+            result._merge(wildcard)
+        if own is not None:
+            result._merge(own)
+        return result
+
+    @property
+    def names(self):
+        """Names of the fields and nested elements having values, or None if
+        a wildcard applies to all of them."""
+        if '*' in self or '*' in self._children:
+            return None
+        return set(self) | set(self._children)
+
+    def remove_wildcards(self):
+        self.pop('*', None)
+        self._children.pop('*', None)
+
+    def flatten(self, prefix=''):
+        """Returns remaining values as `(name, value)` pairs sorted by name."""
+        items = [(prefix + key, value) for key, value in self.items()]
+        for name, child in self._children.items():
+            items += child.flatten(prefix + name + '.')
+        return sorted(items)
+
+    def __nonzero__(self):
+        return bool(len(self) or any(self._children.itervalues()))
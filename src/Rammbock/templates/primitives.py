@@ -35,6 +35,17 @@ class _TemplateField(object):
             raise IndexError('Length of %s is dynamic.' % self._get_name())
         return self.length.value
 
+    def decoded_length(self):
+        """Length of decoded field in bytes or None if it depends on the
+        decoded data."""
+        if not self.length.static:
+            return None
+        return self.length.decode_lengths(None)[1]
+
+    def has_checks(self):
+        """Returns True if the field is validated against its default value."""
+        return bool(self.default_value)
+
     def _get_element_value(self, paramdict, name=None):
         return paramdict.get(self._get_name(name), self.default_value)
 
@@ -69,12 +80,12 @@ class _TemplateField(object):
 
     def validate(self, parent, paramdict, name=None):
         name = name or self.name
-        field = parent[name]
-        value = field.bytes
         forced_value = self._get_element_value_and_remove_from_params(paramdict, name)
         if not forced_value or forced_value == 'None':
             return []
-        elif forced_value.startswith('('):
+        field = parent[name]
+        value = field.bytes
+        if forced_value.startswith('('):
             return self._validate_pattern(forced_value, value, field)
         return self._validate_exact_match(forced_value, value, field)
 
@@ -183,6 +194,11 @@ class Char(_TemplateField):
         length, aligned_length = self.length.find_length_and_set_if_necessary(message, len(value))
         return value.ljust(length, '\x00'), aligned_length
 
+    def decoded_length(self):
+        if self._terminator:
+            return None
+        return _TemplateField.decoded_length(self)
+
     def _prepare_data(self, data):
         if self._terminator:
             return data[0:data.index(self._terminator) + 1]
@@ -327,6 +343,12 @@ class _DynamicLength(_Length):
     def __init__(self, value, align):
         self.field, self.value_calculator = parse_field_and_calculator(value)
         self.align = int(align)
+        self._levels = None
+
+    def resolve(self, levels):
+        """Sets the referenced field to be found `levels` containers up from
+        the container of the field, so it is not searched by name."""
+        self._levels = levels
 
     def calc_value(self, param):
         return self.value_calculator.calc_value(param)
@@ -341,9 +363,18 @@ class _DynamicLength(_Length):
         return self._get_aligned_lengths(self.calc_value(reference.int))
 
     def _find_reference(self, parent):
+        if self._levels is not None:
+            container = parent
+            for _ in xrange(self._levels):
+                container = getattr(container, '_parent', None)
+            if container is not None and self.field in container:
+                return container[self.field]
+        return self._search_reference(parent)
+
+    def _search_reference(self, parent):
         if self.field in parent:
             return parent[self.field]
-        return self._find_reference(parent._parent) or None
+        return self._search_reference(parent._parent) or None
 
     def _has_been_set(self, reference):
         return reference._type != 'referenced_later'
@@ -355,8 +386,7 @@ class _DynamicLength(_Length):
         return value_len, aligned_len
 
     def _encode_ref_length(self, aligned_len, reference):
-        return reference.template.encode({self.field: str(aligned_len)},
-                                         reference._parent)
+        return reference.template._to_field(None, str(aligned_len), reference._parent)
 
     def find_length_and_set_if_necessary(self, parent, min_length):
         min_value_for_reference = self.solve_parameter(min_length)
@@ -0,0 +1,171 @@
+#  Copyright 2012 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import random
+import re
+import socket
+import time
+
+from binary_tools import to_int
+from metrics import LatencyHistogram, monotonic
+
+
+GENERATOR_PATTERN = re.compile(r'^\{(counter|random)((?::[^:}]*)*)\}$')
+# Configs of sending at rate given to `TrafficGenerator` as keyword arguments.
+TRAFFIC_CONFIGS = ('count', 'duration', 'burst')
+
+
+def field_generator(value):
+    """Returns a function generating a field value for each message index,
+    or None if `value` is a plain field value.
+
+    Supported generators are `{counter}`, `{counter:start}`,
+    `{counter:start:step}` and `{random:min:max}`.
+    """
+    match = GENERATOR_PATTERN.match(str(value))
+    if not match:
+        return None
+    kind, args = match.group(1), match.group(2).split(':')[1:]
+    if kind == 'counter':
+        return _counter(*args)
+    return _random(*args)
+
+
+def _counter(start='0', step='1'):
+    start, step = to_int(start), to_int(step)
+    return lambda index: str(start + index * step)
+
+
+def _random(minimum, maximum):
+    minimum, maximum = to_int(minimum), to_int(maximum)
+    return lambda index: str(random.randint(minimum, maximum))
+
+
+class MessageEncoder(object):
+    """Encodes a message template with field values that may contain
+    generators. Messages without generators are encoded only once."""
+
+    def __init__(self, template, message_fields, header_fields):
+        self._template = template
+        self._fields, self._field_generators = self._split(message_fields)
+        self._headers, self._header_generators = self._split(header_fields)
+        self._static = None
+        if not (self._field_generators or self._header_generators):
+            self._static = self._encode(self._fields, self._headers)
+
+    def _split(self, fields):
+        static, generators = {}, {}
+        for name, value in fields.items():
+            generator = field_generator(value)
+            if generator:
+                generators[name] = generator
+            else:
+                static[name] = value
+        return static, generators
+
+    def encode(self, index):
+        if self._static is not None:
+            return self._static
+        return self._encode(self._generate(self._fields, self._field_generators, index),
+                            self._generate(self._headers, self._header_generators, index))
+
+    def _generate(self, fields, generators, index):
+        result = dict(fields)
+        for name, generator in generators.items():
+            result[name] = generator(index)
+        return result
+
+    def _encode(self, fields, headers):
+        return self._template.encode(fields, headers)._raw
+
+
+class TokenBucket(object):
+    """Paces events to `rate` per second allowing bursts of `burst` events
+    to catch up after late wake-ups."""
+
+    def __init__(self, rate, burst=1, clock=monotonic, sleep=time.sleep):
+        self._rate = float(rate)
+        self._burst = max(float(burst), 1.0)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = 1.0
+        self._updated = clock()
+
+    def take(self):
+        """Waits until a token is available and takes it. Returns the time
+        when the token became available."""
+        self._refill()
+        if self._tokens < 1:
+            due = self._updated + (1 - self._tokens) / self._rate
+            self._sleep(max(due - self._clock(), 0))
+            self._refill()
+        else:
+            due = self._updated - (self._tokens - 1) / self._rate
+        self._tokens -= 1
+        return due
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self._burst, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+
+class TrafficGenerator(object):
+    """Sends messages produced by `encode(index)` with `send(message)` at
+    `rate` messages per second until `count` messages have been sent or
+    `duration` seconds have passed."""
+
+    def __init__(self, send, encode, rate, count=None, duration=None, burst=None, clock=monotonic):
+        if not (count or duration):
+            raise AssertionError('Either count or duration must be given.')
+        self._send = send
+        self._encode = encode
+        self._rate = float(rate)
+        self._count = int(count) if count else None
+        self._duration = float(duration) if duration else None
+        # By default allow catching up 10 milliseconds worth of messages.
+        self._burst = float(burst) if burst else max(self._rate / 100, 1)
+        self._clock = clock
+        self.jitter = LatencyHistogram()
+
+    def run(self):
+        bucket = TokenBucket(self._rate, self._burst, clock=self._clock)
+        errors = {}
+        start = self._clock()
+        index = 0
+        while not self._finished(index, start):
+            message = self._encode(index)
+            due = bucket.take()
+            try:
+                self._send(message)
+            except socket.error, e:
+                errors[str(e)] = errors.get(str(e), 0) + 1
+            self.jitter.record(self._clock() - due)
+            index += 1
+        return self._statistics(index, self._clock() - start, errors)
+
+    def _finished(self, index, start):
+        if self._count is not None and index >= self._count:
+            return True
+        return self._duration is not None and self._clock() - start >= self._duration
+
+    def _statistics(self, messages, elapsed, errors):
+        failed = sum(errors.values())
+        return {'sent': messages - failed,
+                'failed': failed,
+                'errors': errors,
+                'duration': elapsed,
+                'target_rate': self._rate,
+                'rate': messages / elapsed if elapsed else 0.0,
+                'jitter': self.jitter.summary()}
@@ -0,0 +1,317 @@
+#  Copyright 2012 Nokia Siemens Networks Oyj
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import os
+import select
+import socket
+import traceback
+from itertools import cycle
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from metrics import LatencyHistogram, NodeStatistics, monotonic
+from networking import UDPServer
+from traffic import TrafficGenerator
+
+# Time a shard waits for a matching message after a datagram has arrived.
+SHARD_RECEIVE_TIMEOUT = 0.1
+
+
+def run_in_workers(workers, task):
+    """Runs `task(worker)` in `workers` forked processes and returns their
+    results in worker order.
+
+    Workers inherit the state of the parent, such as defined protocols and
+    message templates, so nothing needs to be serialized to them. Results
+    are pickled back to the parent. If a worker fails, its result is a
+    `WorkerError` with the formatted traceback.
+    """
+    if not hasattr(os, 'fork'):
+        raise AssertionError('Load workers require os.fork which is not available on this platform.')
+    children = [_fork(worker, task) for worker in range(int(workers))]
+    return [_collect(pid, pipe) for pid, pipe in children]
+
+
+def _fork(worker, task, close_in_child=()):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        for fd in close_in_child:
+            os.close(fd)
+        _run_child(worker, task, write_fd)
+    os.close(write_fd)
+    return pid, os.fdopen(read_fd, 'rb')
+
+
+def _run_child(worker, task, write_fd):
+    # Never returns: os._exit skips the atexit handlers and buffered output
+    # of the parent, e.g. Robot Framework's output files.
+    try:
+        try:
+            result = task(worker)
+        except BaseException:
+            result = WorkerError(worker, traceback.format_exc())
+        pipe = os.fdopen(write_fd, 'wb')
+        pickle.dump(result, pipe, pickle.HIGHEST_PROTOCOL)
+        pipe.close()
+    finally:
+        os._exit(0)
+
+
+def _collect(pid, pipe):
+    try:
+        data = pipe.read()
+    finally:
+        pipe.close()
+        os.waitpid(pid, 0)
+    if not data:
+        return WorkerError(None, 'Worker process %d exited without result.' % pid)
+    return pickle.loads(data)
+
+
+class BackgroundWorkers(object):
+    """Runs `task(worker, stop_fd)` in `workers` forked processes until
+    `stop` is called.
+
+    `stop_fd` becomes readable when the workers should stop, so tasks can
+    wait for it together with their sockets. `stop` returns the results like
+    `run_in_workers`.
+    """
+
+    def __init__(self, workers, task):
+        if not hasattr(os, 'fork'):
+            raise AssertionError('Workers require os.fork which is not available on this platform.')
+        stop_pipes = [os.pipe() for _ in range(int(workers))]
+        # Children close all write ends so that closing them in the parent
+        # is seen as end of file by every child.
+        self._stop_fds = [write_fd for _, write_fd in stop_pipes]
+        self._children = [_fork(worker, lambda worker, fd=read_fd: task(worker, fd), self._stop_fds)
+                          for worker, (read_fd, _) in enumerate(stop_pipes)]
+        for read_fd, _ in stop_pipes:
+            os.close(read_fd)
+
+    def stop(self):
+        for fd in self._stop_fds:
+            os.close(fd)
+        self._stop_fds = []
+        return [_collect(pid, pipe) for pid, pipe in self._children]
+
+
+class WorkerError(object):
+
+    def __init__(self, worker, error):
+        self.worker = worker
+        self.error = error
+
+    def __str__(self):
+        return 'Worker %s failed:\n%s' % (self.worker, self.error)
+
+
+def share(total, workers, worker):
+    """Returns the share of `total` of given `worker`, spreading the remainder
+    over the first workers."""
+    if total is None:
+        return None
+    base, remainder = divmod(int(total), workers)
+    return base + (1 if worker < remainder else 0)
+
+
+class LoadWorker(object):
+    """Sends messages from its own clients at its share of the total rate.
+
+    Message indices are interleaved between workers, so generated field
+    values such as `{counter}` stay unique over all workers.
+    """
+
+    def __init__(self, worker, workers, clients, encode, rate, count=None, duration=None, burst=None):
+        self._clients = clients
+        self._encode = lambda index: encode(index * workers + worker)
+        self._generator = TrafficGenerator(self._sender(), self._encode, float(rate) / workers,
+                                           count=share(count, workers, worker),
+                                           duration=duration, burst=burst)
+
+    def _sender(self):
+        clients = cycle(self._clients)
+        return lambda msg: clients.next().send(msg, log=False)
+
+    def run(self):
+        try:
+            stats = self._generator.run()
+        finally:
+            for client in self._clients:
+                client.close()
+        stats['histogram'] = self._generator.jitter
+        return stats
+
+
+def aggregate(results):
+    """Combines statistics of load workers to totals. Per worker counters are
+    preserved in `workers`."""
+    histogram = LatencyHistogram()
+    totals = {'sent': 0, 'failed': 0, 'errors': {}, 'duration': 0.0, 'workers': []}
+    for stats in results:
+        histogram.merge(stats.pop('histogram'))
+        totals['sent'] += stats['sent']
+        totals['failed'] += stats['failed']
+        totals['duration'] = max(totals['duration'], stats['duration'])
+        for error, count in stats['errors'].items():
+            totals['errors'][error] = totals['errors'].get(error, 0) + count
+        totals['workers'].append(stats)
+    messages = totals['sent'] + totals['failed']
+    totals['rate'] = messages / totals['duration'] if totals['duration'] else 0.0
+    totals['jitter'] = histogram.summary()
+    return totals
+
+
+class ShardedUDPServer(object):
+    """UDP server with `shards` sockets bound to the same address with
+    `SO_REUSEPORT`, each served by its own forked process.
+
+    The kernel spreads datagrams over the sockets by sender address, so
+    receiving, validating and responding scale over CPU cores. Each shard
+    receives messages with `template`, counts messages failing validation
+    with `fields` and, if `respond(index)` is given, sends the message it
+    returns back to the sender. Datagrams that cannot be decoded or handled,
+    or do not match `template`, are counted as failed and the shard keeps
+    serving. Statistics of the shards are collected when the server is
+    stopped. Messages cannot be received or sent with the keywords, as the
+    shards handle all of them.
+    """
+
+    def __init__(self, ip, port, shards, template, fields=None, respond=None, timeout=None, socket_options=None):
+        options = dict(socket_options or {}, reuseport='true')
+        self._template = template
+        self._fields = fields
+        self._respond = respond
+        self._servers = []
+        try:
+            for _ in range(int(shards)):
+                self._servers.append(UDPServer(ip, port, timeout, template._protocol, options))
+                # Other shards bind to the same port also when it was chosen by the system.
+                ip, port = self._servers[0].get_own_address()
+        except Exception:
+            self._close_servers()
+            raise
+        self._address = ip, port
+        self._stats = aggregate_shards([])
+        self._workers = BackgroundWorkers(len(self._servers), self._serve)
+        # Shard sockets are read only by the shard processes.
+        self._close_servers()
+
+    def _close_servers(self):
+        for server in self._servers:
+            server.close()
+
+    def _serve(self, shard, stop_fd):
+        server = self._servers[shard]
+        for other in self._servers:
+            if other is not server:
+                other.close()
+        server.log_traffic = False
+        return ShardWorker(server, self._template, self._fields, self._respond).run(stop_fd)
+
+    @property
+    def protocol_name(self):
+        return self._template._protocol.name
+
+    def get_own_address(self):
+        return self._address
+
+    def stop(self):
+        """Stops the shards and returns their combined statistics."""
+        if self._workers:
+            results, self._workers = self._workers.stop(), None
+            failures = [str(result) for result in results if isinstance(result, WorkerError)]
+            if failures:
+                raise AssertionError('\n'.join(failures))
+            self._stats = aggregate_shards(results)
+        return self._stats
+
+    def close(self):
+        self.stop()
+
+    def _raise_unsupported(self, *args, **kwargs):
+        raise AssertionError('Messages of sharded UDP server %s:%d are received and responded only by its shards. '
+                             'Use Stop Sharded UDP Server to get their statistics.' % self._address)
+
+    accept_connection = receive_from = get_message = empty = _raise_unsupported
+    send = send_to = send_stream = get_peer_address = _raise_unsupported
+
+    def get_statistics(self):
+        return dict((name, self._stats[name]) for name in NodeStatistics.COUNTERS)
+
+    def reset_statistics(self):
+        self._stats = aggregate_shards([])
+
+
+class ShardWorker(object):
+    """Receives, validates and responds to messages on one shard until
+    `stop_fd` becomes readable."""
+
+    def __init__(self, server, template, fields=None, respond=None):
+        self._server = server
+        self._template = template
+        self._fields = fields
+        self._respond = respond
+
+    def run(self, stop_fd):
+        stats = {'received': 0, 'responded': 0, 'invalid': 0, 'failed': 0}
+        start = monotonic()
+        try:
+            while self._wait_for_datagram(stop_fd):
+                try:
+                    self._handle_datagram(stats)
+                except socket.timeout:
+                    # Only datagrams not matching the template arrived.
+                    pass
+                except Exception:
+                    # A malformed datagram must not stop the shard.
+                    stats['failed'] += 1
+                # Nothing receives the datagrams not matching the template
+                # later, so they are dropped instead of cached.
+                stats['failed'] += self._server.clear_message_caches()
+        finally:
+            self._server.close()
+        stats['duration'] = monotonic() - start
+        stats.update(self._server.get_statistics())
+        return stats
+
+    def _handle_datagram(self, stats):
+        msg = self._server.get_message(self._template, timeout=SHARD_RECEIVE_TIMEOUT)
+        stats['received'] += 1
+        # Validation consumes the fields it checks.
+        if self._fields and self._template.validate(msg, dict(self._fields)):
+            stats['invalid'] += 1
+        if self._respond:
+            self._server.send(self._respond(stats['responded']), log=False)
+            stats['responded'] += 1
+
+    def _wait_for_datagram(self, stop_fd):
+        readable = select.select([self._server._socket, stop_fd], [], [])[0]
+        return stop_fd not in readable
+
+
+def aggregate_shards(results):
+    """Sums the statistics of shards. Statistics of each shard are preserved
+    in `shards`."""
+    totals = dict.fromkeys(NodeStatistics.COUNTERS + ('received', 'responded', 'invalid', 'failed'), 0)
+    for stats in results:
+        for name in totals:
+            totals[name] += stats[name]
+    totals['shards'] = list(results)
+    return totals
@@ -0,0 +1,102 @@
+from StringIO import StringIO
+from unittest import TestCase, main
+
+from benchmark.network import TransportBenchmark, all_benchmarks as network_benchmarks
+from benchmark.runner import all_benchmarks, compare, measure, report, retained_objects
+from benchmark.templates import BUILDERS
+
+
+class TestBenchmarkTemplates(TestCase):
+
+    def test_all_templates_validate_after_roundtrip(self):
+        for build in BUILDERS:
+            case = build()
+            raw = case.template.encode(case.fields, case.headers)._raw
+            header, pdu_bytes = case.protocol.read_frame(raw)
+            msg = header if case.template.only_header else case.template.decode(pdu_bytes, parent=header)
+            self.assertEquals(case.template.validate(msg, case.validation_fields), [], case.name)
+
+    def test_benchmark_names_are_unique(self):
+        names = [name for name, _ in all_benchmarks()]
+        self.assertEquals(len(names), len(set(names)))
+
+
+class TestMeasure(TestCase):
+
+    def test_measure(self):
+        result = measure(lambda: None, min_time=0.001, repeat=1)
+        self.assertTrue(result['ops_per_sec'] > 0)
+        self.assertEquals(result['objects'], 0)
+
+    def test_retained_objects(self):
+        self.assertEquals(retained_objects(lambda: [[], []]), 3)
+        self.assertEquals(retained_objects(lambda: 'string'), 0)
+
+
+class TestCompare(TestCase):
+
+    baseline = {'fast': {'ops_per_sec': 1000.0, 'objects': 5.0},
+                'slow': {'ops_per_sec': 10.0, 'objects': 100.0}}
+
+    def test_within_tolerance(self):
+        results = {'fast': {'ops_per_sec': 910.0, 'objects': 5.0},
+                   'slow': {'ops_per_sec': 20.0, 'objects': 90.0}}
+        self.assertEquals(compare(results, self.baseline), [])
+
+    def test_slowdown_is_regression(self):
+        results = {'fast': {'ops_per_sec': 890.0, 'objects': 5.0}}
+        self.assertEquals(compare(results, self.baseline), ['fast'])
+        self.assertEquals(compare(results, self.baseline, tolerance=20), [])
+
+    def test_more_objects_is_regression(self):
+        results = {'slow': {'ops_per_sec': 10.0, 'objects': 111.0}}
+        self.assertEquals(compare(results, self.baseline), ['slow'])
+        self.assertEquals(compare(results, self.baseline, tolerance=20), [])
+
+    def test_more_objects_within_tolerance(self):
+        results = {'slow': {'ops_per_sec': 10.0, 'objects': 109.0}}
+        self.assertEquals(compare(results, self.baseline), [])
+
+    def test_new_benchmark_is_not_regression(self):
+        results = {'new': {'ops_per_sec': 1.0, 'objects': 1000.0}}
+        self.assertEquals(compare(results, self.baseline), [])
+
+    def test_report_marks_regressions(self):
+        output = StringIO()
+        results = {'fast': {'ops_per_sec': 500.0, 'objects': 5.0}}
+        report(results, self.baseline, ['fast'], output=output)
+        self.assertTrue('-50.0%  REGRESSION' in output.getvalue())
+
+
+class TestTransportBenchmark(TestCase):
+
+    def _run(self, transport, pipelined=False):
+        result = TransportBenchmark(transport, 100, 5, pipelined).run()
+        self.assertEquals(result['messages'], 5)
+        self.assertTrue(result['ops_per_sec'] > 0)
+        self.assertTrue(0 < result['p50'] <= result['p99'])
+        return result
+
+    def test_tcp_lockstep(self):
+        self.assertEquals(self._run('tcp')['depth'], 1)
+
+    def test_tcp_pipelined(self):
+        self.assertEquals(self._run('tcp', pipelined=True)['depth'], 16)
+
+    def test_udp_pipelined(self):
+        self.assertEquals(self._run('udp', pipelined=True)['depth'], 16)
+
+    def test_udp_pipeline_fits_receive_buffer(self):
+        self.assertEquals(TransportBenchmark('udp', 60000, 1, pipelined=True).run()['depth'], 1)
+
+    def test_stream_pipeline_fits_socket_buffers(self):
+        for transport in ('tcp', 'unix', 'loopback'):
+            self.assertEquals(TransportBenchmark(transport, 60000, 3, pipelined=True).run()['depth'], 1)
+
+    def test_all_network_benchmarks_finish(self):
+        for name, factory in network_benchmarks(messages=3):
+            self.assertEquals(factory().run()['messages'], 3, name)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,5 @@
 from unittest import TestCase, main
-from Rammbock.message import Struct, Field, BinaryContainer, BinaryField
+from Rammbock.message import Struct, Field, BinaryContainer, BinaryField, LazyFields
 from Rammbock.binary_tools import to_bin
 
 
@@ -25,6 +25,16 @@ class TestMessages(TestCase):
         self.assertEquals(msg, child._parent)
         self.assertEquals(msg, child['field']._parent._parent)
 
+    def test_raw_segments(self):
+        msg = Struct('foo', 'foo_type')
+        msg['a'] = uint_field('0x01')
+        child = Struct('sub', 'subelement_type')
+        child['b'] = uint_field('0x02')
+        child['c'] = uint_field('0x03')
+        msg['sub'] = child
+        self.assertEquals(msg._raw_segments, ['\x01', '\x02', '\x03'])
+        self.assertEquals(''.join(msg._raw_segments), msg._raw)
+
     def test_conversions(self):
         field = Field('unit', 'name', to_bin('0x00616200'))
         self.assertEquals(field.int, 0x00616200)
@@ -60,6 +70,9 @@ class TestBinaryContainer(TestCase):
     def test_get_binary_container_bytes(self):
         self.assertEquals(self.cont._raw, to_bin('0b1011 0101 0010 1010'))
 
+    def test_binary_container_is_one_segment(self):
+        self.assertEquals(self.cont._raw_segments, [self.cont._raw])
+
     def test_binary_container_length(self):
         self.assertEquals(len(self.cont), 2)
 
@@ -118,5 +131,38 @@ class TestLittleEndian(TestCase):
         self.assertEquals(field.hex, '0x0001')
 
 
+
+class TestLazyFields(TestCase):
+
+    def _lazy_struct(self, decode):
+        struct = Struct('foo', 'Foo')
+        struct._fields = LazyFields(struct, to_bin('0xcafe'), decode)
+        struct._fields.add_lazy('bar', None, 0, 2)
+        return struct
+
+    def test_field_is_decoded_once_on_access(self):
+        decoded = []
+
+        def decode(template, data, parent, name):
+            decoded.append(name)
+            return Field('uint', name, data)
+        struct = self._lazy_struct(decode)
+        self.assertEquals(struct._fields.materialized, [])
+        self.assertEquals(struct.bar.hex, '0xcafe')
+        self.assertEquals(struct.bar._parent, struct)
+        self.assertEquals(decoded, ['bar'])
+        self.assertEquals(struct._fields.materialized, ['bar'])
+
+    def test_field_failing_to_decode_fails_on_every_access(self):
+        def decode(template, data, parent, name):
+            raise ValueError('substring not found')
+        struct = self._lazy_struct(decode)
+        self.assertRaises(ValueError, getattr, struct, 'bar')
+        self.assertRaises(ValueError, getattr, struct, 'bar')
+        self.assertRaises(ValueError, repr, struct)
+        self.assertEquals(struct._fields.materialized, [])
+        self.assertEquals(len(struct), 2)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,118 @@
+from unittest import TestCase, main
+from Rammbock.metrics import percentile, latency_summary, LatencyHistogram, LatencyTracker
+from Rammbock.templates import Protocol, MessageTemplate, UInt, PDU
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 10.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPercentiles(TestCase):
+
+    def test_nearest_rank(self):
+        self.assertEquals(percentile([1, 2, 3, 4], 50), 2)
+        self.assertEquals(percentile([1, 2, 3, 4], 99), 4)
+        self.assertEquals(percentile([], 50), None)
+
+    def test_summary_in_milliseconds(self):
+        self.assertEquals(latency_summary([0.002, 0.001]), {'p50': 1.0, 'p90': 2.0, 'p99': 2.0, 'max': 2.0})
+
+
+class TestLatencyHistogram(TestCase):
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        for micros in range(1, 1001):
+            histogram.record(micros / 1000000.0)
+        self.assertEquals(histogram.count, 1000)
+        self.assertAlmostEquals(histogram.percentile(50), 0.0005, 4)
+        self.assertAlmostEquals(histogram.percentile(99), 0.00099, 4)
+        self.assertEquals(histogram.percentile(100), 0.001)
+
+    def test_merge(self):
+        first, second = LatencyHistogram(), LatencyHistogram()
+        first.record(0.001)
+        second.record(0.003)
+        first.merge(second)
+        self.assertEquals((first.count, first.max), (2, 0.003))
+
+    def test_empty(self):
+        self.assertEquals(LatencyHistogram().summary()['p99'], None)
+
+
+class TestLatencyTracker(TestCase):
+
+    def setUp(self):
+        protocol = Protocol('Test')
+        protocol.add(UInt(1, 'id', None))
+        protocol.add(UInt(2, 'length', None))
+        protocol.add(PDU('length-3'))
+        self.template = MessageTemplate('Echo', protocol, {})
+        self.template.add(UInt(2, 'sequence', None))
+        self.clock = FakeClock()
+        self.tracker = LatencyTracker(clock=self.clock)
+
+    def _msg(self, sequence, id=1):
+        return self.template.encode({'sequence': sequence}, {'id': id})
+
+    def _seen_at(self, now, node, template, msg):
+        self.clock.now = now
+        self.tracker.seen(node, template, msg)
+
+    def test_pairs_in_order_without_correlation(self):
+        self.tracker.track('Request', 'Response')
+        self._seen_at(10.0, 'Client1', 'Request', self._msg(1))
+        self._seen_at(10.5, 'Client1', 'Request', self._msg(2))
+        self._seen_at(11.0, 'Client1', 'Response', self._msg(1))
+        self._seen_at(12.0, 'Client1', 'Response', self._msg(2))
+        histogram = self.tracker.combined('Request')
+        self.assertEquals((histogram.count, histogram.total, histogram.max), (2, 2.5, 1.5))
+
+    def test_pairs_by_correlation_field(self):
+        self.tracker.track('Request', 'Response', 'sequence')
+        self._seen_at(10.0, 'Client1', 'Request', self._msg(1))
+        self._seen_at(10.1, 'Client1', 'Request', self._msg(2))
+        self._seen_at(10.2, 'Client1', 'Response', self._msg(2))
+        self._seen_at(10.4, 'Client1', 'Response', self._msg(1))
+        self.assertAlmostEquals(self.tracker.combined('Request').max, 0.4)
+        self.assertAlmostEquals(self.tracker.combined('Request').total, 0.5)
+
+    def test_correlation_by_header_field(self):
+        self.tracker.track('Request', 'Response', 'header.id')
+        self._seen_at(10.0, 'Client1', 'Request', self._msg(1, id=5))
+        self._seen_at(11.0, 'Client1', 'Response', self._msg(1, id=6))
+        self.assertEquals(self.tracker.combined('Request').count, 0)
+        self._seen_at(12.0, 'Client1', 'Response', self._msg(1, id=5))
+        self.assertEquals(self.tracker.combined('Request').max, 2.0)
+
+    def test_missing_correlation_field(self):
+        self.tracker.track('Request', 'Response', 'nonexisting')
+        self.assertRaises(AssertionError, self.tracker.seen, 'Client1', 'Request', self._msg(1))
+
+    def test_latencies_per_node(self):
+        self.tracker.track('Request', 'Response')
+        self._seen_at(10.0, 'Client1', 'Request', self._msg(1))
+        self._seen_at(10.0, 'Client2', 'Request', self._msg(1))
+        self._seen_at(11.0, 'Client2', 'Response', self._msg(1))
+        self._seen_at(13.0, 'Client1', 'Response', self._msg(1))
+        self.assertEquals(self.tracker.combined('Request', 'Client2').max, 1.0)
+        self.assertEquals(self.tracker.combined('Request').count, 2)
+
+    def test_reset(self):
+        self.tracker.track('Request', 'Response')
+        self._seen_at(10.0, 'Client1', 'Request', self._msg(1))
+        self._seen_at(10.5, 'Client1', 'Request', self._msg(2))
+        self._seen_at(11.0, 'Client1', 'Response', self._msg(1))
+        self.tracker.reset()
+        self._seen_at(12.0, 'Client1', 'Response', self._msg(2))
+        self.assertEquals(self.tracker.combined('Request').count, 0)
+        self.assertTrue(self.tracker.is_tracked('Request'))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,17 @@
 from unittest import TestCase, main
+import os
+import select
+import shutil
+import tempfile
 import time
 import socket
 from threading import Timer
-from Rammbock.networking import UDPServer, TCPServer, UDPClient, TCPClient, BufferedStream
-from Rammbock.templates.containers import Protocol
+from Rammbock.networking import UDPServer, TCPServer, UDPClient, TCPClient, LoopbackServer, LoopbackClient, \
+    UnixStreamServer, UnixStreamClient, UnixDatagramServer, UnixDatagramClient, BufferedStream, connect_clients, \
+    SocketOptions, _to_size, _send_all, _send_to, _to_hex, _Poller
+from Rammbock.templates.containers import Protocol, MessageTemplate
 from Rammbock.templates.primitives import UInt, PDU
+from Rammbock.binary_tools import to_bin
 
 LOCAL_IP = '127.0.0.1'
 CONNECTION_ALIAS = "Connection alias"
@@ -155,6 +162,157 @@ class TestNetworking(_NetworkingTests):
         self._verify_emptying(server, client)
 
 
+class TestConcurrentConnect(_NetworkingTests):
+
+    def test_connect_many_clients(self):
+        server = TCPServer(LOCAL_IP, ports['SERVER_PORT'])
+        self.sockets.append(server)
+        clients = [TCPClient() for _ in range(4)]
+        self.sockets.extend(clients)
+        results = connect_clients(clients, LOCAL_IP, ports['SERVER_PORT'], timeout=1)
+        self.assertEquals([type(result) for result in results], [float] * 4)
+        server.accept_connection()
+        clients[0].send('foofaa')
+        self._assert_receive(server, 'foofaa')
+
+    def test_accept_pending_connections_with_backlog(self):
+        server = TCPServer(LOCAL_IP, ports['SERVER_PORT'], backlog=64)
+        self.sockets.append(server)
+        clients = [TCPClient() for _ in range(20)]
+        self.sockets.extend(clients)
+        connect_clients(clients, LOCAL_IP, ports['SERVER_PORT'], timeout=1)
+        addresses = server.accept_connections(count=20, alias='conn', timeout=1)
+        self.assertEquals(sorted(addresses), sorted(client.get_own_address() for client in clients))
+        self.assertEquals(server.get_peer_address('conn20'), addresses[-1])
+
+    def test_accept_connections_without_count_does_not_wait(self):
+        server = TCPServer(LOCAL_IP, ports['SERVER_PORT'])
+        self.sockets.append(server)
+        start_time = time.time()
+        self.assertEquals(server.accept_connections(), [])
+        self.assertTrue(time.time() - 0.5 < start_time)
+
+    def test_accept_in_background(self):
+        server = TCPServer(LOCAL_IP, ports['SERVER_PORT'])
+        self.sockets.append(server)
+        server.start_accepting(alias='conn')
+        clients = [TCPClient() for _ in range(3)]
+        self.sockets.extend(clients)
+        connect_clients(clients, LOCAL_IP, ports['SERVER_PORT'], timeout=1)
+        clients[0].send('foofaa')
+        time.sleep(0.3)
+        server.stop_accepting()
+        self.assertEquals(len(list(server._connections)), 3)
+
+    def test_connections_accepted_in_background_do_not_change_default(self):
+        server = TCPServer(LOCAL_IP, ports['SERVER_PORT'])
+        self.sockets.append(server)
+        clients = [TCPClient() for _ in range(3)]
+        self.sockets.extend(clients)
+        connect_clients(clients[:1], LOCAL_IP, ports['SERVER_PORT'], timeout=1)
+        server.accept_connection(alias='first')
+        server.start_accepting(alias='conn')
+        try:
+            self.assertRaises(Exception, server.accept_connection)
+            self.assertRaises(Exception, server.accept_connections)
+            connect_clients(clients[1:], LOCAL_IP, ports['SERVER_PORT'], timeout=1)
+            time.sleep(0.3)
+            self.assertEquals(len(list(server._connections)), 3)
+            clients[0].send('foofaa')
+            self.assertEquals(server.receive(), 'foofaa')
+        finally:
+            server.stop_accepting()
+        self.assertEquals(server._connections.get_name(), 'first')
+
+    def test_select_fallback_reports_sockets_in_error(self):
+        poller = _Poller([3, 4])
+        poller._poll = None
+        original = select.select
+        select.select = lambda readable, writable, failed, timeout: ([], [3], [3, 4])
+        try:
+            self.assertEquals(poller.wait(0), [3, 4])
+        finally:
+            select.select = original
+
+    def test_failed_connects_are_reported(self):
+        clients = [TCPClient() for _ in range(2)]
+        results = connect_clients(clients, LOCAL_IP, ports['SERVER_PORT'], timeout=1)
+        for result in results:
+            self.assertTrue(isinstance(result, socket.error))
+
+
+class TestClosingConnections(_NetworkingTests):
+
+    def _server_with_clients(self, count, **options):
+        server = TCPServer(LOCAL_IP, ports['SERVER_PORT'], **options)
+        self.sockets.append(server)
+        clients = [TCPClient().connect_to(LOCAL_IP, ports['SERVER_PORT']) for _ in range(count)]
+        self.sockets.extend(clients)
+        for index in range(count):
+            server.accept_connection(alias='conn%d' % index)
+        return server, clients
+
+    def test_close_connection(self):
+        server, clients = self._server_with_clients(2)
+        server.close_connection('conn0')
+        self.assertEquals(clients[0].receive(), '')
+        self.assertRaises(KeyError, server.get_peer_address, 'conn0')
+        clients[1].send('foofaa')
+        self._assert_receive(server, 'foofaa')
+
+    def test_closing_latest_connection_selects_previous(self):
+        server, clients = self._server_with_clients(2)
+        server.close_connection()
+        clients[0].send('foofaa')
+        self._assert_receive(server, 'foofaa')
+
+    def test_reap_connections_closed_by_peer(self):
+        server, clients = self._server_with_clients(3)
+        clients[1].close()
+        clients[2].send('unread data')
+        time.sleep(0.05)
+        self.assertEquals(server.reap_connections(), ['conn1'])
+        self.assertEquals(len(list(server._connections)), 2)
+        self.assertEquals(server.get_statistics()['connections_reaped'], 1)
+
+    def test_server_statistics_include_connections(self):
+        server, clients = self._server_with_clients(2)
+        clients[0].send('foo')
+        clients[1].send('barbar')
+        server.receive(alias='conn0')
+        server.receive(alias='conn1')
+        server.send('reply', alias='conn0')
+        stats = server.get_statistics()
+        self.assertEquals((stats['bytes_received'], stats['messages_sent'], stats['bytes_sent']), (9, 1, 5))
+
+    def test_reap_idle_connections(self):
+        server, clients = self._server_with_clients(2, idle_timeout=0.1)
+        time.sleep(0.15)
+        clients[1].send('foofaa')
+        server.receive(alias='conn1')
+        self.assertEquals(server.reap_connections(), ['conn0'])
+
+    def test_connections_with_cached_messages_are_not_reaped(self):
+        protocol = _get_template()
+        server, clients = self._server_with_clients(2, idle_timeout=0.1, protocol=protocol)
+        for message_id in (2, 1):
+            clients[0].send(_get_message_template(protocol, message_id).encode({'field': '0xcafe'}, {})._raw)
+        server.get_message(_get_message_template(protocol, 1), alias='conn0', header_filter='id')
+        time.sleep(0.15)
+        self.assertEquals(server.reap_connections(), ['conn1'])
+        self.assertEquals(server.get_message(_get_message_template(protocol, 2), alias='conn0',
+                                             header_filter='id')._header.id.int, 2)
+
+    def test_connections_are_only_reaped_explicitly(self):
+        server, clients = self._server_with_clients(2)
+        clients[1].close()
+        time.sleep(0.05)
+        server.empty()
+        server.accept_connections()
+        self.assertEquals(len(list(server._connections)), 2)
+        self.assertEquals(server.reap_connections(), ['conn1'])
+
+
 class TestGetEndPoints(_NetworkingTests):
 
     def test_get_udp_endpoints(self):
@@ -175,6 +333,260 @@ class TestGetEndPoints(_NetworkingTests):
         self.assertEquals(server.get_peer_address(), client_address)
 
 
+
+class TestLoopback(_NetworkingTests):
+
+    def _loopback_server_and_client(self, timeout=None, protocol=None):
+        server = LoopbackServer(timeout=timeout, protocol=protocol)
+        client = LoopbackClient(timeout=timeout, protocol=protocol).connect_to_server(server)
+        self.sockets.extend([server, client])
+        return server, client
+
+    def test_send_and_receive(self):
+        server, client = self._loopback_server_and_client()
+        client.send('foofaa')
+        server.accept_connection()
+        self._assert_receive(server, 'foofaa')
+        server.send('reply')
+        self._assert_receive(client, 'reply')
+
+    def test_endpoints(self):
+        server, client = self._loopback_server_and_client()
+        server.accept_connection()
+        self.assertEquals(server.get_own_address()[0], 'loopback')
+        self.assertEquals(client.get_peer_address(), server.get_own_address())
+        self.assertEquals(server.get_peer_address(), client.get_own_address())
+        self.assertNotEquals(client.get_own_address(), server.get_own_address())
+
+    def test_accept_without_pending_connection_fails(self):
+        server = LoopbackServer()
+        self.sockets.append(server)
+        self.assertRaises(AssertionError, server.accept_connection)
+
+    def test_accept_connections_with_alias(self):
+        server, _ = self._loopback_server_and_client()
+        client = LoopbackClient().connect_to_server(server)
+        self.sockets.append(client)
+        self.assertEquals(len(server.accept_connections(alias='conn')), 2)
+        client.send('second')
+        self.assertEquals(server.receive(alias='conn2'), 'second')
+
+    def test_accepting_in_background(self):
+        server, _ = self._loopback_server_and_client()
+        server.start_accepting(alias='conn')
+        client = LoopbackClient().connect_to_server(server)
+        self.sockets.append(client)
+        client.send('foofaa')
+        self.assertEquals(server.receive(alias='conn2'), 'foofaa')
+
+    def test_timeout(self):
+        server, client = self._loopback_server_and_client(timeout=0.1)
+        self._assert_timeout(client)
+
+    def test_close_connection(self):
+        server, client = self._loopback_server_and_client()
+        server.accept_connection()
+        server.close_connection()
+        self.assertEquals(client.receive(), '')
+
+    def test_connect_to_closed_server_fails(self):
+        server = LoopbackServer()
+        server.close()
+        self.assertRaises(socket.error, LoopbackClient().connect_to_server, server)
+
+    def test_messages(self):
+        protocol = _get_template()
+        server, client = self._loopback_server_and_client(timeout=0.5, protocol=protocol)
+        server.accept_connection()
+        client.send(_get_message_template(protocol, 1).encode({'field': '0xcafe'}, {})._raw)
+        msg = server.get_message(_get_message_template(protocol, 1))
+        self.assertEquals(msg.field.hex, '0xcafe')
+        self.assertEquals(server.get_statistics()['messages_received'], 1)
+
+
+
+class TestUnixSockets(_NetworkingTests):
+
+    def setUp(self):
+        _NetworkingTests.setUp(self)
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'server.sock')
+
+    def tearDown(self):
+        _NetworkingTests.tearDown(self)
+        shutil.rmtree(self.directory)
+
+    def _server_and_client(self, server_class, client_class, timeout=None, protocol=None):
+        server = server_class(self.path, timeout=timeout, protocol=protocol)
+        client = client_class(timeout=timeout, protocol=protocol)
+        client.connect_to(self.path)
+        self.sockets.extend([server, client])
+        return server, client
+
+    def test_stream_send_and_receive(self):
+        server, client = self._server_and_client(UnixStreamServer, UnixStreamClient)
+        server.accept_connection()
+        client.send('foofaa')
+        self._assert_receive(server, 'foofaa')
+        server.send('reply')
+        self._assert_receive(client, 'reply')
+
+    def test_datagram_send_and_receive(self):
+        server, client = self._server_and_client(UnixDatagramServer, UnixDatagramClient)
+        client.send('foofaa')
+        self._assert_receive(server, 'foofaa')
+        server.send('reply')
+        self._assert_receive(client, 'reply')
+
+    def test_endpoints(self):
+        server, client = self._server_and_client(UnixStreamServer, UnixStreamClient)
+        server.accept_connection()
+        self.assertEquals(server.get_own_address(), ('unix', self.path))
+        self.assertEquals(client.get_peer_address(), ('unix', self.path))
+        self.assertEquals(server.get_peer_address(), client.get_own_address())
+
+    def test_client_bound_to_path(self):
+        server, _ = self._server_and_client(UnixDatagramServer, UnixDatagramClient)
+        client_path = os.path.join(self.directory, 'client.sock')
+        client = UnixDatagramClient()
+        client.set_own_path(client_path)
+        client.connect_to(self.path)
+        self.sockets.append(client)
+        client.send('foofaa')
+        self.assertEquals(server.receive_from(), ('foofaa', 'unix', client_path))
+
+    def test_timeout(self):
+        _, client = self._server_and_client(UnixDatagramServer, UnixDatagramClient, timeout=0.1)
+        self._assert_timeout(client)
+
+    def test_socket_file_is_removed_on_close(self):
+        server = UnixStreamServer(self.path)
+        self.assertTrue(os.path.exists(self.path))
+        server.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_binding_to_used_path_fails(self):
+        self.sockets.append(UnixStreamServer(self.path))
+        self.assertRaises(Exception, UnixStreamServer, self.path)
+
+    def test_datagram_messages(self):
+        protocol = _get_template()
+        server, client = self._server_and_client(UnixDatagramServer, UnixDatagramClient, timeout=0.5,
+                                                 protocol=protocol)
+        client.send(_get_message_template(protocol, 1).encode({'field': '0xcafe'}, {})._raw)
+        msg = server.get_message(_get_message_template(protocol, 1))
+        self.assertEquals(msg.field.hex, '0xcafe')
+        server.send(_get_message_template(protocol, 2).encode({'field': '0xbeef'}, {})._raw)
+        self.assertEquals(client.get_message(_get_message_template(protocol, 2)).field.hex, '0xbeef')
+
+
+
+class TestSocketOptions(_NetworkingTests):
+
+    def _option(self, node, level, option):
+        return node._socket.getsockopt(level, option)
+
+    def test_sizes(self):
+        self.assertEquals(_to_size('65536'), 65536)
+        self.assertEquals(_to_size('64k'), 65536)
+        self.assertEquals(_to_size('4M'), 4 * 1024 * 1024)
+
+    def test_unknown_option(self):
+        self.assertRaises(Exception, SocketOptions, {'nodelai': 'true'})
+
+    def test_no_options(self):
+        self.assertFalse(SocketOptions())
+        self.assertTrue(SocketOptions({'nodelay': 'true'}))
+
+    def test_tcp_client_nodelay_and_buffer_size(self):
+        client = TCPClient(socket_options={'nodelay': 'true', 'sndbuf': '64K'})
+        self.sockets.append(client)
+        self.assertEquals(self._option(client, socket.IPPROTO_TCP, socket.TCP_NODELAY), 1)
+        # Linux doubles the requested size for bookkeeping overhead.
+        self.assertTrue(self._option(client, socket.SOL_SOCKET, socket.SO_SNDBUF) >= 65536)
+
+    def test_false_option(self):
+        client = TCPClient(socket_options={'nodelay': 'false'})
+        self.sockets.append(client)
+        self.assertEquals(self._option(client, socket.IPPROTO_TCP, socket.TCP_NODELAY), 0)
+
+    def test_accepted_connections_get_server_options(self):
+        server = TCPServer(LOCAL_IP, ports['SERVER_PORT'], socket_options={'nodelay': 'yes'})
+        client = TCPClient().connect_to(LOCAL_IP, ports['SERVER_PORT'])
+        self.sockets.extend([server, client])
+        server.accept_connection()
+        self.assertEquals(self._option(server._connections.get(), socket.IPPROTO_TCP, socket.TCP_NODELAY), 1)
+
+    def test_reuseport_lets_servers_share_port(self):
+        options = {'reuseport': 'true'}
+        self.sockets.append(UDPServer(LOCAL_IP, ports['SERVER_PORT'], socket_options=options))
+        self.sockets.append(UDPServer(LOCAL_IP, ports['SERVER_PORT'], socket_options=options))
+
+    def test_quickack_is_rearmed_after_receive(self):
+        server = TCPServer(LOCAL_IP, ports['SERVER_PORT'])
+        client = TCPClient(socket_options={'quickack': 'true'}).connect_to(LOCAL_IP, ports['SERVER_PORT'])
+        self.sockets.extend([server, client])
+        server.accept_connection()
+        server.send('foofaa')
+        self._assert_receive(client, 'foofaa')
+
+    def test_tcp_option_on_udp_fails(self):
+        self.assertRaises(Exception, UDPClient, socket_options={'nodelay': 'true'})
+
+
+class TestSendingSegments(_NetworkingTests):
+
+    def test_tcp_segments(self):
+        server, client = self._tcp_server_and_client(ports['SERVER_PORT'])
+        server.accept_connection()
+        client.send(['foo', '', 'bar'])
+        self._assert_receive(server, 'foobar')
+        self.assertEquals(client.get_statistics()['bytes_sent'], 6)
+
+    def test_udp_segments_are_sent_as_one_datagram(self):
+        server, client = self._udp_server_and_client(ports['SERVER_PORT'], ports['CLIENT_PORT'])
+        client.send(['foo', 'bar'])
+        self._assert_receive(server, 'foobar')
+        server.send(['bar', 'foo'])
+        self._assert_receive(client, 'barfoo')
+        self.assertEquals(server.get_statistics()['bytes_sent'], 6)
+
+    def test_tcp_stream(self):
+        server, client = self._tcp_server_and_client(ports['SERVER_PORT'])
+        server.accept_connection()
+        client.send_stream(iter(['foo', 'bar']))
+        self._assert_receive(server, 'foobar')
+        self.assertEquals((client.get_statistics()['messages_sent'], client.get_statistics()['bytes_sent']), (1, 6))
+
+    def test_udp_stream_is_sent_as_one_datagram(self):
+        server, client = self._udp_server_and_client(ports['SERVER_PORT'], ports['CLIENT_PORT'])
+        client.send_stream(iter(['foo', 'bar']))
+        self._assert_receive(server, 'foobar')
+        server.send_stream(iter(['bar', 'foo']))
+        self._assert_receive(client, 'barfoo')
+
+    def test_segments_are_sent_joined(self):
+        sock = MockSocket()
+        _send_all(sock, ['foo', 'barbaz', '', 'x'])
+        _send_to(sock, ['foo', 'bar'], ('127.0.0.1', 1234))
+        self.assertEquals(sock.sent, ['foobarbazx', ('foobar', ('127.0.0.1', 1234))])
+
+    def test_hex_of_segments(self):
+        self.assertEquals(_to_hex(['\x01', '', '\xca\xfe']), _to_hex('\x01\xca\xfe'))
+
+
+class MockSocket(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+    def sendto(self, data, address):
+        self.sent.append((data, address))
+
+
 def _get_template():
     protocol = Protocol('Test')
     protocol.add(UInt(1, 'id', 1))
@@ -183,6 +595,127 @@ def _get_template():
     return protocol
 
 
+def _get_message_template(protocol, message_id):
+    template = MessageTemplate('FooRequest', protocol, {'id': message_id})
+    template.add(UInt(2, 'field', None))
+    return template
+
+
+class TestDatagramMessages(_NetworkingTests):
+
+    def setUp(self):
+        _NetworkingTests.setUp(self)
+        self.protocol = _get_template()
+        self.server = UDPServer(LOCAL_IP, ports['SERVER_PORT'], timeout=0.5, protocol=self.protocol)
+        self.sockets.append(self.server)
+
+    def _client(self):
+        client = UDPClient(timeout=0.5, protocol=self.protocol)
+        client.connect_to(LOCAL_IP, ports['SERVER_PORT'])
+        self.sockets.append(client)
+        return client
+
+    def test_server_replies_to_sender_of_received_message(self):
+        client1, client2 = self._client(), self._client()
+        client2.send(to_bin('0x010004cafe'))
+        msg = self.server.get_message(_get_message_template(self.protocol, '0x01'))
+        self.assertEquals(msg.field.hex, '0xcafe')
+        self.assertEquals(self.server.get_peer_address(), client2.get_own_address())
+        self.server.send(to_bin('0x010004beef'))
+        self.assertEquals(client2.get_message(_get_message_template(self.protocol, '0x01')).field.hex, '0xbeef')
+
+    def test_cached_messages_keep_their_sender(self):
+        client1, client2 = self._client(), self._client()
+        client1.send(to_bin('0x010004cafe'))
+        client2.send(to_bin('0x020004beef'))
+        self.server.get_message(_get_message_template(self.protocol, '0x02'), header_filter='id')
+        self.assertEquals(self.server.get_peer_address(), client2.get_own_address())
+        self.server.get_message(_get_message_template(self.protocol, '0x01'), header_filter='id')
+        self.assertEquals(self.server.get_peer_address(), client1.get_own_address())
+
+    def test_receive_by_peer_alias(self):
+        client1, client2 = self._client(), self._client()
+        client1.send(to_bin('0x010004cafe'))
+        client2.send(to_bin('0x010004beef'))
+        self.assertEquals(self.server.accept_connection('first'), client1.get_own_address())
+        self.assertEquals(self.server.accept_connection('second'), client2.get_own_address())
+        template = _get_message_template(self.protocol, '0x01')
+        self.assertEquals(self.server.get_message(template, alias='second').field.hex, '0xbeef')
+        self.assertEquals(self.server.get_message(template, alias='first').field.hex, '0xcafe')
+
+    def test_send_by_peer_alias(self):
+        client1, client2 = self._client(), self._client()
+        client1.send('foo')
+        client2.send('bar')
+        self.server.accept_connection('first')
+        self.server.accept_connection('second')
+        self.server.send('to second', alias='second')
+        self.server.send('to first', alias='first')
+        self._assert_receive(client1, 'to first')
+        self._assert_receive(client2, 'to second')
+
+    def test_receive_binary_by_peer_alias(self):
+        client1, client2 = self._client(), self._client()
+        client1.send('foo')
+        client2.send('bar')
+        self.server.accept_connection('first')
+        self.server.accept_connection('second')
+        self.assertEquals(self.server.receive(alias='second'), 'bar')
+        self.assertEquals(self.server.receive(), 'foo')
+
+    def test_message_streams_of_senders_without_cached_messages_are_released(self):
+        clients = [self._client() for _ in range(3)]
+        clients[0].send(to_bin('0x020004beef'))
+        for client in clients:
+            client.send(to_bin('0x010004cafe'))
+        template = _get_message_template(self.protocol, '0x01')
+        for _ in clients:
+            self.server.get_message(template, header_filter='id')
+        self.assertEquals(self.server._message_streams.keys(), [clients[0].get_own_address()])
+        self.server.get_message(_get_message_template(self.protocol, '0x02'), header_filter='id')
+        self.assertEquals(self.server._message_streams.keys(), [])
+
+    def test_clear_message_caches_keeps_unread_datagrams(self):
+        client = self._client()
+        client.send(to_bin('0x020004beef'))
+        client.send(to_bin('0x010004cafe'))
+        client.send(to_bin('0x010004babe'))
+        template = _get_message_template(self.protocol, '0x01')
+        self.server.get_message(template, header_filter='id')
+        self.assertEquals(self.server.clear_message_caches(), 1)
+        self.assertEquals(self.server._message_streams.keys(), [])
+        self.assertEquals(self.server.get_message(template, header_filter='id').field.hex, '0xbabe')
+        self.assertEquals(self.server.get_statistics()['evictions'], 1)
+
+    def test_unknown_peer_alias(self):
+        self.assertRaises(AssertionError, self.server.receive, alias='unknown')
+
+    def test_bad_datagram_does_not_desynchronize_stream(self):
+        client = self._client()
+        client.send(to_bin('0x010004ca'))
+        client.send(to_bin('0x010004cafe'))
+        template = _get_message_template(self.protocol, '0x01')
+        self.assertRaises(AssertionError, self.server.get_message, template)
+        self.assertEquals(self.server.get_message(template).field.hex, '0xcafe')
+        self.assertEquals(self.server.get_statistics()['decode_failures'], 1)
+
+    def test_statistics(self):
+        client = self._client()
+        client.send(to_bin('0x010004cafe'))
+        client.send(to_bin('0x020004beef'))
+        client.send(to_bin('0x010004f00d'))
+        self.server.get_message(_get_message_template(self.protocol, '0x02'), header_filter='id')
+        self.server.get_message(_get_message_template(self.protocol, '0x01'), header_filter='id')
+        self.assertRaises(socket.timeout, self.server.get_message,
+                          _get_message_template(self.protocol, '0x03'), header_filter='id', timeout=0.05)
+        self.server.empty()
+        stats = self.server.get_statistics()
+        self.assertEquals((stats['messages_received'], stats['bytes_received']), (2, 15))
+        self.assertEquals((stats['cache_hits'], stats['cache_misses']), (1, 2))
+        self.assertEquals((stats['timeouts'], stats['evictions']), (1, 1))
+        self.assertEquals((client.get_statistics()['messages_sent'], client.get_statistics()['bytes_sent']), (3, 15))
+
+
 class TestBufferedStream(TestCase):
 
     DATA = 'foobardiibadaa'
@@ -0,0 +1,185 @@
+from unittest import TestCase, main
+import os
+import pstats
+import shutil
+import tempfile
+from Rammbock.profiling import PhaseTimer, KeywordProfiler, OUTSIDE_KEYWORDS, profile_file_name
+from Rammbock.templates.containers import MessageTemplate
+from Rammbock import networking
+from Rammbock import Rammbock
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPhaseTimer(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.timer = PhaseTimer(clock=self.clock)
+
+    def _spend(self, seconds, nested=None):
+        self.clock.now += seconds
+        if nested:
+            nested()
+
+    def test_nested_phases_are_exclusive(self):
+        inner = self.timer.timed('inner', lambda: self._spend(2))
+        outer = self.timer.timed('outer', lambda: self._spend(1, inner))
+        outer()
+        self.assertEquals(sorted(self.timer.breakdown()), [(OUTSIDE_KEYWORDS, 'inner', 1, 2.0),
+                                                           (OUTSIDE_KEYWORDS, 'outer', 1, 1.0)])
+
+    def test_recursive_phase_is_counted_once(self):
+        def recurse(depth):
+            self._spend(1)
+            if depth:
+                timed(depth - 1)
+        timed = self.timer.timed('phase', recurse)
+        timed(2)
+        self.assertEquals(self.timer.breakdown(), [(OUTSIDE_KEYWORDS, 'phase', 1, 3.0)])
+
+    def test_phases_per_keyword(self):
+        phase = self.timer.timed('phase', lambda: self._spend(1))
+        self.timer.start_keyword('Outer', {})
+        self.timer.start_keyword('Inner', {})
+        phase()
+        self._spend(0.5)
+        self.timer.end_keyword('Inner', {})
+        self.timer.end_keyword('Outer', {})
+        self.assertEquals(self.timer.breakdown(), [('Inner', 'phase', 1, 1.0), ('Inner', 'other', 1, 0.5)])
+
+    def test_install_and_uninstall(self):
+        original = MessageTemplate.__dict__['encode']
+        self.timer.install()
+        try:
+            self.assertNotEquals(MessageTemplate.__dict__['encode'], original)
+        finally:
+            self.timer.uninstall()
+        self.assertEquals(MessageTemplate.__dict__['encode'], original)
+
+    def test_all_socket_sends_are_timed(self):
+        targets = [(cls, name) for cls in vars(networking).values() if isinstance(cls, type)
+                   for name in ('_sendall', '_sendto', '_receive_from_socket') if name in vars(cls)]
+        originals = [vars(cls)[name] for cls, name in targets]
+        self.timer.install()
+        try:
+            untimed = [(cls.__name__, name) for (cls, name), original in zip(targets, originals)
+                       if vars(cls)[name] is original]
+        finally:
+            self.timer.uninstall()
+        # Calls the timed _sendall of _NetworkNode.
+        self.assertEquals(untimed, [('_TCPConnection', '_sendall')])
+
+    def test_install_only_once(self):
+        self.timer.install()
+        try:
+            self.assertRaises(AssertionError, self.timer.install)
+        finally:
+            self.timer.uninstall()
+        self.assertFalse(self.timer.installed)
+
+    def test_installing_uninstalls_previous_timer(self):
+        original = MessageTemplate.__dict__['encode']
+        other = PhaseTimer(clock=self.clock)
+        other.install()
+        self.timer.install()
+        try:
+            self.assertFalse(other.installed)
+            self.assertTrue(self.timer.installed)
+            self.assertEquals(self.timer._patched[0][2], original)
+        finally:
+            self.timer.uninstall()
+        self.assertEquals(MessageTemplate.__dict__['encode'], original)
+
+    def test_uninstalled_when_execution_ends(self):
+        original = MessageTemplate.__dict__['encode']
+        self.timer.install()
+        self.timer.close()
+        self.assertEquals(MessageTemplate.__dict__['encode'], original)
+
+
+class TestKeywordProfiler(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.profiler = KeywordProfiler()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_writes_profile_and_summary(self):
+        self.profiler.start()
+        sorted(range(1000), key=lambda x: -x)
+        prof_path, summary_path = self.profiler.stop(os.path.join(self.directory, 'test'), top=5)
+        self.assertEquals(prof_path, os.path.join(self.directory, 'test.prof'))
+        self.assertTrue(pstats.Stats(prof_path).total_calls > 0)
+        self.assertTrue('cumulative' in open(summary_path).read())
+        self.assertFalse(self.profiler.running)
+
+    def test_start_and_stop_only_once(self):
+        self.assertRaises(AssertionError, self.profiler.stop, os.path.join(self.directory, 'test'))
+        self.profiler.start()
+        try:
+            self.assertRaises(AssertionError, self.profiler.start)
+        finally:
+            self.profiler.stop(os.path.join(self.directory, 'test'))
+
+
+    def test_profile_file_name(self):
+        self.assertEquals(profile_file_name('Send 1/2: ok'), 'Send_1_2__ok')
+        self.assertEquals(profile_file_name('../suite.test-1'), '.._suite.test-1')
+
+
+class TestPhaseTimingKeywords(TestCase):
+
+    def setUp(self):
+        self.rammbock = Rammbock(profile_phases=True)
+
+    def tearDown(self):
+        self.rammbock.reset_rammbock()
+        self.rammbock._phase_timer.close()
+
+    def test_send_and_receive_phases(self):
+        self.rammbock.new_protocol('TestProtocol')
+        self.rammbock.uint(2, 'msgId', 5)
+        self.rammbock.uint(2, 'length', None)
+        self.rammbock.pdu('length-4')
+        self.rammbock.end_protocol()
+        self.rammbock.start_tcp_server('127.0.0.1', 12399, protocol='TestProtocol')
+        self.rammbock.start_tcp_client(protocol='TestProtocol')
+        self.rammbock.connect('127.0.0.1', 12399)
+        self.rammbock.accept_connection()
+        self.rammbock.new_message('FooRequest', 'TestProtocol')
+        self.rammbock.uint(2, 'foo', '0xcafe')
+        self.rammbock.client_sends_message()
+        self.rammbock.server_receives_message()
+        phases = set(row[1] for row in self.rammbock._phase_timer.breakdown())
+        self.assertEquals(phases, set(['parameters', 'encode', 'raw assembly', 'socket I/O',
+                                       'framing', 'decode', 'validate']))
+
+    def test_two_profiled_libraries_in_a_row(self):
+        original = self.rammbock._phase_timer._patched[0][2]
+        second = Rammbock(profile_phases=True)
+        try:
+            self.assertFalse(self.rammbock._phase_timer.installed)
+            self.assertTrue(second._phase_timer.installed)
+            self.assertEquals(second._phase_timer._patched[0][2], original)
+            self.assertNotEquals(MessageTemplate.__dict__['encode'], original)
+        finally:
+            second._phase_timer.close()
+        self.assertEquals(MessageTemplate.__dict__['encode'], original)
+
+    def test_disabled_by_default(self):
+        self.assertEquals(Rammbock()._phase_timer, None)
+        self.assertEquals(Rammbock(profile_phases='False')._phase_timer, None)
+
+
+if __name__ == "__main__":
+    main()
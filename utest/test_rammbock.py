@@ -1,4 +1,8 @@
 from unittest import TestCase, main
+import os
+import shutil
+import socket
+import tempfile
 from Rammbock import Rammbock
 
 
@@ -33,7 +37,7 @@ ports = {'SERVER_PORT': 12345,
          'CLIENT_PORT': 54321}
 
 
-class TestMessageSequence(TestCase):
+class _RammbockTests(TestCase):
 
     def setUp(self):
         self.rammbock = Rammbock()
@@ -59,6 +63,13 @@ class TestMessageSequence(TestCase):
                                        protocol=protocol, name='Client')
         self.rammbock.connect(LOCAL_IP, ports['SERVER_PORT'])
 
+    def _sequence_should_equal(self, seq_generator, expected):
+        list_seq = [list(row) for row in seq_generator]
+        self.assertEquals(list_seq, expected)
+
+
+class TestMessageSequence(_RammbockTests):
+
     def test_send_receive(self):
         self._example_protocol()
         self._start_client_server('TestProtocol')
@@ -93,9 +104,225 @@ class TestMessageSequence(TestCase):
         self._sequence_should_equal(self.rammbock._message_sequence.get(),
                                     [['Client', 'Server', 'binary', '', 'received']])
 
-    def _sequence_should_equal(self, seq_generator, expected):
-        list_seq = [list(row) for row in seq_generator]
-        self.assertEquals(list_seq, expected)
+
+class TestLazyDecoding(_RammbockTests):
+
+    def test_receive_lazily_decoded_message(self):
+        self._example_protocol()
+        self._start_client_server('TestProtocol')
+        self.rammbock.new_message('FooRequest', 'TestProtocol')
+        self.rammbock.uint(2, 'foo', '0xcafe')
+        self.rammbock.uint(2, 'bar', '0xbabe')
+        self.rammbock.client_sends_message()
+        self.rammbock.new_message('FooRequest', 'TestProtocol', 'lazy=true')
+        self.rammbock.uint(2, 'foo', None)
+        self.rammbock.uint(2, 'bar', None)
+        msg = self.rammbock.server_receives_message('bar:0xbabe')
+        self.assertEquals(msg._fields.materialized, ['_header', 'bar'])
+        self.assertEquals(msg.foo.hex, '0xcafe')
+
+
+class TestConnectClients(_RammbockTests):
+
+    def test_connect_tcp_clients(self):
+        self.rammbock.start_tcp_server(LOCAL_IP, ports['SERVER_PORT'], name='Server')
+        stats = self.rammbock.connect_tcp_clients(3, LOCAL_IP, ports['SERVER_PORT'], name='Client')
+        self.assertEquals((stats['connected'], stats['failed']), (3, 0))
+        self.assertTrue(stats['p50'] <= stats['max'])
+        self.rammbock.accept_connection()
+        self.rammbock.client_sends_binary('foobar', name='Client1')
+        self.assertEquals(self.rammbock.server_receives_binary(), 'foobar')
+
+
+class TestSendingAtRate(_RammbockTests):
+
+    def test_client_sends_messages_at_rate(self):
+        self._example_protocol()
+        self._start_client_server('TestProtocol')
+        self._foo_message()
+        stats = self.rammbock.client_sends_messages_at_rate(1000, 'count=3', 'foo:{counter:7}')
+        self.assertEquals(stats['sent'], 3)
+        for value in ('0x0007', '0x0008', '0x0009'):
+            self.assertEquals(self.rammbock.server_receives_without_validation().foo.hex, value)
+
+    def test_unknown_config_lists_valid_configs(self):
+        self._example_protocol()
+        self._start_client_server('TestProtocol')
+        self._foo_message()
+        try:
+            self.rammbock.client_sends_messages_at_rate(1000, 'count=3', 'durration=1')
+        except AssertionError, e:
+            self.assertEquals(str(e), 'Unknown configs when sending messages at rate: durration. '
+                                      'Valid configs are name, connection, count, duration, burst.')
+        else:
+            self.fail('AssertionError not raised')
+
+
+class TestWorkers(_RammbockTests):
+
+    def test_workers_send_messages_at_rate(self):
+        self._example_protocol()
+        self._start_client_server('TestProtocol')
+        self._foo_message()
+        stats = self.rammbock.workers_send_messages_at_rate(2, 1000, LOCAL_IP, ports['SERVER_PORT'],
+                                                            'count=5', 'foo:{counter}')
+        self.assertEquals((stats['sent'], stats['failed']), (5, 0))
+        self.assertEquals(sorted(worker['sent'] for worker in stats['workers']), [2, 3])
+        received = sorted(self.rammbock.server_receives_without_validation().foo.int for _ in range(5))
+        self.assertEquals(received, range(5))
+
+
+class TestLatency(_RammbockTests):
+
+    def test_request_response_latency(self):
+        self._example_protocol()
+        self._start_client_server('TestProtocol')
+        self.rammbock.measure_latency('FooRequest', 'FooResponse', correlation='foo')
+        self._foo_message()
+        self.rammbock.client_sends_message()
+        self.rammbock.server_receives_message()
+        self.rammbock.new_message('FooResponse', 'TestProtocol')
+        self.rammbock.uint(2, 'foo', '0xcafe')
+        self.rammbock.server_sends_message()
+        self.rammbock.client_receives_message()
+        self.assertEquals(self.rammbock.get_latency('FooRequest', name='Client')['count'], 1)
+        self.assertEquals(self.rammbock.get_latency('FooRequest')['count'], 2)
+        self.rammbock.reset_latencies()
+        self.assertEquals(self.rammbock.get_latency('FooRequest')['count'], 0)
+
+
+class TestNodeStatistics(_RammbockTests):
+
+    def test_node_statistics(self):
+        self._example_protocol()
+        self._start_client_server('TestProtocol')
+        self._foo_message()
+        self.rammbock.client_sends_message()
+        self.rammbock.server_receives_message()
+        self.assertEquals(self.rammbock.get_node_statistics('Client')['bytes_sent'], 6)
+        self.assertEquals(self.rammbock.get_node_statistics()['Server']['messages_received'], 1)
+        self.rammbock.reset_node_statistics()
+        self.assertEquals(self.rammbock.get_node_statistics('Server')['messages_received'], 0)
+        self.assertRaises(AssertionError, self.rammbock.get_node_statistics, 'Nonexisting')
+
+
+class TestLoopback(_RammbockTests):
+
+    def test_loopback_client_and_server(self):
+        self._example_protocol()
+        self.rammbock.start_loopback_server(name='Server', protocol='TestProtocol')
+        self.rammbock.start_loopback_client('Server', name='Client', protocol='TestProtocol')
+        self.rammbock.accept_connection()
+        self._foo_message()
+        self.rammbock.client_sends_message()
+        self.rammbock.server_receives_message('foo:0xcafe')
+        self.rammbock.server_sends_message()
+        self.rammbock.client_receives_message()
+        self._sequence_should_equal(self.rammbock._message_sequence.get(),
+                                    [['Client', 'Server', 'TestProtocol:FooRequest', '', 'received'],
+                                     ['Server', 'Client', 'TestProtocol:FooRequest', '', 'received']])
+
+    def test_loopback_client_requires_loopback_server(self):
+        self._start_client_server()
+        self.assertRaises(AssertionError, self.rammbock.start_loopback_client)
+        self.assertRaises(AssertionError, self.rammbock.start_loopback_client, 'Nonexisting')
+
+
+class TestUnixSockets(_RammbockTests):
+
+    def test_unix_datagram_client_and_server(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'server.sock')
+        self._example_protocol()
+        self.rammbock.start_unix_server(path, name='Server', protocol='TestProtocol', type='datagram')
+        self.rammbock.start_unix_client(name='Client', protocol='TestProtocol', type='datagram')
+        self.rammbock.connect(path)
+        self._foo_message()
+        self.rammbock.client_sends_message()
+        self.rammbock.server_receives_message('foo:0xcafe')
+        self.rammbock.server_sends_message()
+        self.rammbock.client_receives_message()
+
+    def test_unknown_unix_socket_type(self):
+        self.assertRaises(AssertionError, self.rammbock.start_unix_client, type='raw')
+
+
+class TestSocketOptions(_RammbockTests):
+
+    def test_socket_options(self):
+        self.rammbock.start_tcp_server(LOCAL_IP, ports['SERVER_PORT'], name='Server', nodelay='true')
+        self.rammbock.start_tcp_client(name='Client', rcvbuf='1M')
+        self.assertEquals(self.rammbock._servers.get('Server')._socket.getsockopt(socket.IPPROTO_TCP,
+                                                                                   socket.TCP_NODELAY), 1)
+        self.assertRaises(Exception, self.rammbock.start_udp_client, nodelay='true')
+        self.assertRaises(Exception, self.rammbock.start_tcp_client, unknown='1')
+
+
+class TestStreaming(_RammbockTests):
+
+    def test_client_streams_message(self):
+        self._example_protocol()
+        self.rammbock.start_tcp_server(LOCAL_IP, ports['SERVER_PORT'], name='Server', protocol='TestProtocol')
+        self.rammbock.start_tcp_client(name='Client', protocol='TestProtocol')
+        self.rammbock.connect(LOCAL_IP, ports['SERVER_PORT'])
+        self.rammbock.accept_connection()
+        self.rammbock.new_message('Bulk', 'TestProtocol')
+        self.rammbock.uint(2, 'count', None)
+        self.rammbock._new_list('count', 'items')
+        self.rammbock.uint(2, None, '0xcafe')
+        self.rammbock._end_list()
+        self.rammbock.client_streams_message('length=2002', 'count:1000')
+        msg = self.rammbock.server_receives_message('count:1000')
+        self.assertEquals(msg.items[999].hex, '0xcafe')
+        self.assertEquals(self.rammbock.get_node_statistics('Client')['bytes_sent'], 2006)
+        self.assertRaises(AssertionError, self.rammbock.client_streams_message, 'count:1000')
+
+
+class TestIncrementalReceiving(_RammbockTests):
+
+    def test_server_receives_message_incrementally(self):
+        self._example_protocol()
+        self.rammbock.start_tcp_server(LOCAL_IP, ports['SERVER_PORT'], name='Server', protocol='TestProtocol')
+        self.rammbock.start_tcp_client(name='Client', protocol='TestProtocol')
+        self.rammbock.connect(LOCAL_IP, ports['SERVER_PORT'])
+        self.rammbock.accept_connection()
+        self._records_message(1000)
+        self.rammbock.client_streams_message()
+        self.rammbock.client_sends_message()
+        self._records_message('*')
+        self.assertEquals(self.rammbock.server_receives_message_incrementally('kind:1', 'records.*:0xcafe'), 1000)
+        self.assertRaises(AssertionError, self.rammbock.server_receives_message_incrementally, 'records.3:0xbabe')
+
+    def _records_message(self, length):
+        self.rammbock.new_message('Records', 'TestProtocol')
+        self.rammbock.uint(2, 'kind', '1')
+        self.rammbock._new_list(length, 'records')
+        self.rammbock.uint(2, None, '0xcafe')
+        self.rammbock._end_list()
+
+
+class TestShardedUDPServer(_RammbockTests):
+
+    def test_sharded_udp_server(self):
+        self._example_protocol()
+        self.rammbock.new_message('FooResponse', 'TestProtocol')
+        self.rammbock.uint(2, 'foo', '0xbeef')
+        self.rammbock.save_template('FooResponse')
+        self._foo_message()
+        self.rammbock.start_sharded_udp_server(2, LOCAL_IP, 0, 'name=Shards', 'response=FooResponse',
+                                               'foo:0xcafe')
+        _, port = self.rammbock._servers.get('Shards').get_own_address()
+        self.rammbock.start_udp_client(protocol='TestProtocol', name='Client')
+        self.rammbock.connect(LOCAL_IP, port)
+        self.rammbock.client_sends_message()
+        self.rammbock.new_message('FooResponse', 'TestProtocol')
+        self.rammbock.uint(2, 'foo', '0xbeef')
+        self.rammbock.client_receives_message()
+        self.rammbock.clear_message_streams()
+        stats = self.rammbock.stop_sharded_udp_server('Shards')
+        self.assertEquals((stats['received'], stats['responded'], stats['invalid']), (1, 1, 0))
+        self.assertEquals(len(stats['shards']), 2)
 
 
 if __name__ == "__main__":
@@ -135,6 +135,19 @@ class TestMessageTemplate(TestCase):
         self.assertEquals(msg._header.msgId.int, 5)
         self.assertEquals(msg._header.length.int, 8)
 
+    def test_header_length_of_nested_elements(self):
+        struct = StructTemplate('Pair', 'pair', self.tmp)
+        struct.add(UInt(1, 'first', 1))
+        struct.add(UInt(3, 'id', 2, align=4))
+        struct.add(Char(3, 'name', 'ab'))
+        lst = ListTemplate(3, 'items', struct)
+        lst.add(UInt(2, None, 7))
+        struct.add(lst)
+        self.tmp.add(struct)
+        msg = self.tmp.encode({}, {})
+        self.assertEquals(msg._header.length.int, len(msg._raw))
+        self.assertEquals(msg._header.length.int, 4 + 4 + 1 + 4 + 3 + 6)
+
     def test_encode_to_bytes(self):
         msg = self.tmp.encode({}, {})
         self.assertEquals(msg._header.msgId.int, 5)
@@ -200,9 +213,7 @@ class TestStructuredTemplate(TestCase):
     def test_get_recursive_names(self):
         pair = _get_pair()
         names = pair._get_params_sub_tree({'pair.foo': 0, 'pairnotyourname.ploo': 2, 'pair.goo.doo': 3})
-        self.assertEquals(len(names), 2)
-        self.assertEquals(names['foo'], 0)
-        self.assertEquals(names['goo.doo'], 3)
+        self.assertEquals(names.flatten(), [('foo', 0), ('goo.doo', 3)])
 
     def test_set_recursive(self):
         str_str = _get_recursive_struct()
@@ -281,23 +292,17 @@ class TestListTemplate(TestCase):
     def test_parse_params(self):
         list = _get_list_of_three()
         params = list._get_params_sub_tree({'topthree[0]': 1, 'foo': 2, 'topthree[4][0]': 4})
-        self.assertEquals(params['0'], 1)
-        self.assertEquals(params['4[0]'], 4)
-        self.assertEquals(len(params), 2)
+        self.assertEquals(params.flatten(), [('0', 1), ('4.0', 4)])
 
     def test_parse_params_with_dot(self):
         list = _get_list_of_three()
         params = list._get_params_sub_tree({'topthree.0': 1, 'foo': 2, 'topthree.4.0': 4})
-        self.assertEquals(params['0'], 1)
-        self.assertEquals(params['4.0'], 4)
-        self.assertEquals(len(params), 2)
+        self.assertEquals(params.flatten(), [('0', 1), ('4.0', 4)])
 
     def test_parse_params_with_dots_and_brackets(self):
         list = _get_list_of_three()
         params = list._get_params_sub_tree({'topthree.0': 1, 'foo': 2, 'topthree.4[0]': 4})
-        self.assertEquals(params['0'], 1)
-        self.assertEquals(params['4[0]'], 4)
-        self.assertEquals(len(params), 2)
+        self.assertEquals(params.flatten(), [('0', 1), ('4.0', 4)])
 
     def test_set_list_values_with_defaults(self):
         pair_of_lists = _get_struct_with_two_lists()
@@ -343,6 +348,38 @@ List listlist[]
     1 = 3 (0x0003)
 """)
 
+    def test_static_elements_are_decoded_on_access(self):
+        decoded = _get_struct_list().decode(to_bin('0x0001 0002 0003 0004'), {})
+        self.assertEquals(decoded._fields.materialized, [])
+        self.assertEquals(decoded[1].second.int, 4)
+        self.assertEquals(decoded._fields.materialized, ['1'])
+        self.assertEquals((decoded.len, len(decoded)), (2, 8))
+
+    def test_index_and_slice_decoded_list(self):
+        decoded = _get_list_of_three().decode(to_bin('0x0001 0002 0003'), {})
+        self.assertEquals(decoded[-1].int, 3)
+        self.assertEquals([field.int for field in decoded[1:]], [2, 3])
+        self.assertEquals([field.int for field in decoded[::2]], [1, 3])
+
+    def test_free_length_list_of_static_elements(self):
+        template = ListTemplate('*', 'free', parent=None)
+        template.add(UInt(2, None, None))
+        self.assertEquals(template.decode(to_bin('0x0001 0002 0003'), {}).len, 3)
+        self.assertRaises(Exception, template.decode, to_bin('0x0001 00'), {})
+
+    def test_validation_decodes_only_referenced_elements(self):
+        template = ListTemplate(4, 'topfour', parent=None)
+        template.add(_get_empty_pair())
+        decoded = template.decode(to_bin('0x0001 0002' * 4), {})
+        errors = template.validate({'topfour': decoded}, {'topfour[2].first': '1', 'topfour[3].second': '1'})
+        self.assertEquals(len(errors), 1)
+        self.assertEquals(decoded._fields.materialized, ['2', '3'])
+
+    def test_validation_of_unknown_index_fails(self):
+        decoded = _get_struct_list().decode(to_bin('0x0001 0002 0003 0004'), {})
+        self.assertRaises(AssertionError, _get_struct_list().validate, {'liststruct': decoded},
+                          {'liststruct[2].first': '1'})
+
     def test_not_enough_data(self):
         template = _get_list_of_three()
         self.assertRaises(Exception, template.decode, to_bin('0x00010002'))
@@ -422,6 +459,45 @@ class TestDynamicMessageTemplate(TestCase):
         str = StructTemplate('FooType', 'foo', tmp)
         str.add(Char('len', "bar"))
 
+    def test_length_reference_is_resolved_when_field_is_added(self):
+        tmp = MessageTemplate('Dymagic', self._protocol, {})
+        tmp.add(UInt(1, 'len', None))
+        struct = StructTemplate('FooType', 'foo', tmp)
+        struct.add(UInt(1, 'other', None))
+        struct.add(Char('len', 'bar', None))
+        tmp.add(struct)
+        self.assertEquals(struct._fields['bar'].length._levels, 1)
+        decoded = tmp.decode(to_bin('0x 02 05 6162'))
+        self.assertEquals(decoded.foo.bar.ascii, 'ab')
+        encoded = tmp.encode({'foo.other': '5', 'foo.bar': 'abc'}, {})
+        self.assertEquals(encoded.len.int, 3)
+
+    def test_length_reference_from_list(self):
+        tmp = MessageTemplate('Dymagic', self._protocol, {})
+        tmp.add(UInt(1, 'len', None))
+        lst = ListTemplate('2', 'names', tmp)
+        lst.add(Char('len', None, None))
+        tmp.add(lst)
+        encoded = tmp.encode({'len': '3', 'names[0]': 'abc', 'names[1]': 'def'}, {})
+        self.assertEquals(encoded.names._raw, to_bin('0x 616263 646566'))
+        decoded = tmp.decode(to_bin('0x 02 6162 6364'))
+        self.assertEquals(decoded.names[1].ascii, 'cd')
+
+    def test_length_reference_from_struct_in_list(self):
+        tmp = MessageTemplate('Dymagic', self._protocol, {})
+        tmp.add(UInt(1, 'len', None))
+        lst = ListTemplate('2', 'names', tmp)
+        struct = StructTemplate('Name', 'name', lst)
+        struct.add(UInt(1, 'other', '0'))
+        struct.add(Char('len', 'text', None))
+        lst.add(struct)
+        tmp.add(lst)
+        self.assertEquals(struct._fields['text'].length._levels, 2)
+        encoded = tmp.encode({'len': '2', 'names[0].text': 'ab', 'names[1].text': 'cd'}, {})
+        self.assertEquals(encoded.names._raw, to_bin('0x 00 6162 00 6364'))
+        decoded = tmp.decode(to_bin('0x 01 05 61 06 62'))
+        self.assertEquals(decoded.names[1].text.ascii, 'b')
+
     def test_add_field_with_length_reference_missing(self):
         tmp = MessageTemplate('Dymagic', self._protocol, {})
         tmp.add(UInt(2, 'len', None))
@@ -429,6 +505,167 @@ class TestDynamicMessageTemplate(TestCase):
         self.assertRaises(AssertionError, str.add, Char('notfound', "bar"))
 
 
+class TestStreamingEncode(TestCase):
+
+    def setUp(self):
+        self._protocol = Protocol('TestProtocol')
+        self._protocol.add(UInt(2, 'msgId', 5))
+        self._protocol.add(UInt(2, 'length', None))
+        self._protocol.add(PDU('length-4'))
+
+    def _template(self, list_length=3):
+        tmp = MessageTemplate('Streamed', self._protocol, {})
+        tmp.add(UInt(2, 'len', None))
+        lst = ListTemplate(list_length, 'items', parent=None)
+        lst.add(_get_empty_pair())
+        tmp.add(lst)
+        tmp.add(UInt(1, 'last', 0xff))
+        return tmp
+
+    def _params(self):
+        return {'len': '3', '*': '1', 'items[1].second': '2'}
+
+    def test_stream_equals_encoded_message(self):
+        tmp = self._template()
+        expected = tmp.encode(self._params(), {})._raw
+        self.assertEquals(''.join(tmp.encode_stream(self._params(), {})), expected)
+
+    def test_stream_in_chunks(self):
+        chunks = list(self._template().encode_stream(self._params(), {}, chunk_size=4))
+        self.assertEquals([len(chunk) for chunk in chunks], [4, 4, 4, 4, 3])
+
+    def test_dynamic_length_must_be_given(self):
+        tmp = self._template('len')
+        self.assertRaises(AssertionError, list, tmp.encode_stream(self._params(), {}))
+        streamed = ''.join(tmp.encode_stream(self._params(), {}, length='15'))
+        self.assertEquals(streamed, tmp.encode(self._params(), {})._raw)
+
+    def test_wrong_length_fails(self):
+        tmp = self._template('len')
+        self.assertRaises(AssertionError, list, tmp.encode_stream(self._params(), {}, length='16'))
+
+    def test_referenced_value_must_be_given(self):
+        tmp = MessageTemplate('Streamed', self._protocol, {})
+        tmp.add(UInt(2, 'len', None))
+        tmp.add(Char('len', 'chars', 'abcd'))
+        self.assertRaises(AssertionError, list, tmp.encode_stream({}, {}, length='6'))
+        self.assertEquals(''.join(tmp.encode_stream({'len': '4'}, {}, length='6')), tmp.encode({}, {})._raw)
+
+    def test_unknown_params_fail(self):
+        self.assertRaises(AssertionError, list, self._template().encode_stream({'unknown': '1'}, {}))
+
+
+class TestIncrementalDecode(TestCase):
+
+    def setUp(self):
+        self._protocol = Protocol('TestProtocol')
+        self._protocol.add(UInt(2, 'msgId', 5))
+        self._protocol.add(UInt(2, 'length', None))
+        self._protocol.add(PDU('length-4'))
+
+    def _template(self, list_length='*'):
+        tmp = MessageTemplate('Records', self._protocol, {})
+        tmp.add(UInt(1, 'count', None))
+        lst = ListTemplate(list_length, 'records', parent=tmp)
+        lst.add(_get_empty_pair())
+        tmp.add(lst)
+        return tmp
+
+    def _reader(self, data):
+        data = [to_bin(data)]
+
+        def read(size):
+            result, data[0] = data[0][:size], data[0][size:]
+            return result
+        return read
+
+    def test_decode_free_length_list(self):
+        msg, elements = self._template().decode_incrementally(self._reader('0x02 0001 0002 0003 0004'))
+        self.assertEquals(msg.count.int, 2)
+        self.assertEquals([(pair.first.int, pair.second.int) for pair in elements], [(1, 2), (3, 4)])
+        self.assertEquals(msg.records.len, 1)
+
+    def test_decode_list_with_dynamic_length(self):
+        msg, elements = self._template('count').decode_incrementally(self._reader('0x01 0001 0002 0003 0004'))
+        self.assertEquals(len(list(elements)), 1)
+
+    def test_too_short_list_fails(self):
+        msg, elements = self._template('count').decode_incrementally(self._reader('0x02 0001 0002'))
+        self.assertRaises(Exception, list, elements)
+
+    def test_last_field_must_be_list(self):
+        tmp = MessageTemplate('Records', self._protocol, {})
+        tmp.add(UInt(1, 'count', None))
+        self.assertRaises(AssertionError, tmp.decode_incrementally, self._reader('0x01'))
+
+    def test_validate_incrementally(self):
+        tmp = self._template()
+        msg, elements = tmp.decode_incrementally(self._reader('0x03 0001 0002 0004 0003 0005 0002'))
+        count, invalid, errors = tmp.validate_incrementally(msg, elements, {'count': '3', 'records.*.first': '1',
+                                                                             'records[2].first': '5'})
+        self.assertEquals((count, invalid), (3, 1))
+        self.assertEquals(len(errors), 1)
+
+    def test_validate_incrementally_limits_errors(self):
+        tmp = self._template()
+        msg, elements = tmp.decode_incrementally(self._reader('0x00' + ' 0001 0002' * 5))
+        count, invalid, errors = tmp.validate_incrementally(msg, elements, {'records.*.first': '2'}, max_errors=2)
+        self.assertEquals((count, invalid, len(errors)), (5, 5, 2))
+
+
+class TestLazyDecode(TestCase):
+
+    def setUp(self):
+        self._protocol = Protocol('TestProtocol')
+        self._protocol.add(UInt(2, 'msgId', 5))
+        self._protocol.add(UInt(2, 'length', None))
+        self._protocol.add(PDU('length-4'))
+
+    def _template(self):
+        tmp = MessageTemplate('Lazy', self._protocol, {}, lazy=True)
+        tmp.add(UInt(1, 'count', None))
+        tmp.add(Char('count', 'name', None))
+        tmp.add(_get_empty_pair())
+        tmp.add(_get_list_of_three('topthree', None))
+        return tmp
+
+    def _data(self):
+        return to_bin('0x03 616263 0001 0002 0003 0004 0005')
+
+    def test_lazy_decode_equals_eager_decode(self):
+        tmp = self._template()
+        lazy = tmp.decode(self._data())
+        tmp.lazy = False
+        eager = tmp.decode(self._data())
+        self.assertEquals(repr(lazy), repr(eager))
+        self.assertEquals(lazy._raw, eager._raw)
+
+    def test_fields_are_decoded_on_access(self):
+        msg = self._template().decode(self._data())
+        self.assertEquals(msg._fields.materialized, ['count', 'name'])
+        self.assertEquals(msg.pair.second.int, 2)
+        self.assertEquals(msg._fields.materialized, ['count', 'name', 'pair'])
+        self.assertEquals(msg.pair._fields.materialized, ['second'])
+        self.assertEquals(msg.topthree[2].int, 5)
+
+    def test_length_does_not_decode_fields(self):
+        msg = self._template().decode(self._data())
+        self.assertEquals(len(msg), 14)
+        self.assertEquals(msg._fields.materialized, ['count', 'name'])
+
+    def test_validation_decodes_only_validated_fields(self):
+        tmp = self._template()
+        msg = tmp.decode(self._data())
+        self.assertEquals(tmp.validate(msg, {'pair.first': '1'}), [])
+        self.assertEquals(msg.pair._fields.materialized, ['first'])
+
+    def test_too_long_message_fails(self):
+        self.assertRaises(AssertionError, self._template().decode, self._data() + '\x00')
+
+    def test_too_short_message_fails(self):
+        self.assertRaises(Exception, self._template().decode, self._data()[:-1])
+
+
 class TestMessageTemplateValidation(TestCase):
 
     def setUp(self):
@@ -596,6 +833,38 @@ class TestUnions(TestCase, _WithValidation):
         self._should_pass(union.validate({'foo': decoded}, {'foo.small': '', 'foo.medium': ''}))
         self._should_fail(union.validate({'foo': decoded}, {'foo.small': '0xff', 'foo.medium': ''}), 1)
 
+    def test_union_alternatives_are_decoded_on_access(self):
+        decoded = self._get_foo_union().decode(to_bin('0xcafebabe'))
+        self.assertEquals(decoded._fields.materialized, [])
+        self.assertEquals(decoded.medium.hex, '0xcafe')
+        self.assertEquals(decoded._fields.materialized, ['medium'])
+
+    def test_repr_of_union_decodes_all_alternatives(self):
+        decoded = self._get_foo_union().decode(to_bin('0xcafebabe'))
+        self.assertEquals(repr(decoded), 'Union foo\n  small = 202 (0xca)\n  medium = 51966 (0xcafe)\n'
+                                         '  large = 3405691582 (0xcafebabe)\n')
+
+    def test_alternative_failing_to_decode_fails_on_every_access(self):
+        union = UnionTemplate('Foo', 'foo', parent=None)
+        union.add(UInt(2, 'small', None))
+        union.add(Char(4, 'text', None, terminator='0x00'))
+        decoded = union.decode(to_bin('0xcafebabe'))
+        self.assertEquals(decoded.small.hex, '0xcafe')
+        self.assertRaises(ValueError, repr, decoded)
+        self.assertRaises(ValueError, repr, decoded)
+        self.assertRaises(ValueError, union.validate, {'foo': decoded}, {'foo.text': 'abcd'})
+        self.assertRaises(ValueError, union.validate, {'foo': decoded}, {'foo.text': 'abcd'})
+
+    def test_validation_decodes_only_validated_alternatives(self):
+        union = UnionTemplate('Foo', 'foo', parent=None)
+        union.add(UInt(1, 'small', None))
+        union.add(_get_empty_pair())
+        decoded = union.decode(to_bin('0xcafebabe'))
+        self._should_fail(union.validate({'foo': decoded}, {'foo.small': '0xff'}), 1)
+        self.assertEquals(decoded._fields.materialized, ['small'])
+        self._should_fail(union.validate({'foo': decoded}, {'foo.pair.first': '0xcafe', 'foo.pair.second': '0'}), 1)
+        self.assertEquals(decoded._fields.materialized, ['small', 'pair'])
+
     def test_validat_struct_union(self):
         struct = _get_pair()
         union = self._get_foo_union()
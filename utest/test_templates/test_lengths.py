@@ -65,6 +65,16 @@ class TestLength(TestCase):
         dyn_len = Length('len-2')
         self.assertEquals(dyn_len.decode(msg), 2)
 
+    def test_decode_resolved_dynamic_from_parent(self):
+        msg = Struct('foo', 'foo_type')
+        msg['len'] = Field('uint', 'len', to_bin('0x04'))
+        inner = Struct('bar', 'bar_type')
+        msg['bar'] = inner
+        inner['len'] = Field('uint', 'len', to_bin('0x02'))
+        dyn_len = Length('len')
+        dyn_len.resolve(1)
+        self.assertEquals(dyn_len.decode(inner), 4)
+
     def test_decode_static(self):
         stat_len = Length('5')
         self.assertEquals(stat_len.decode(None), 5)
@@ -1,7 +1,7 @@
 from unittest import TestCase, main
 import socket
-from Rammbock.templates.message_stream import MessageStream
-from Rammbock.templates import Protocol, MessageTemplate, UInt, PDU
+from Rammbock.templates.message_stream import MessageStream, DatagramMessageStream
+from Rammbock.templates import Protocol, MessageTemplate, ListTemplate, UInt, PDU
 from Rammbock.binary_tools import to_bin
 
 
@@ -41,6 +41,18 @@ class TestProtocolMessageReceiving(TestCase):
         self.assertEquals(header.id.hex, '0xff')
         self.assertEquals(data, '\xca\xfe')
 
+    def test_read_frame(self):
+        header, data = self._protocol.read_frame(to_bin('0xff0004cafe'))
+        self.assertEquals(header.id.hex, '0xff')
+        self.assertEquals(data, '\xca\xfe')
+
+    def test_bytes_after_pdu_are_ignored_in_frame(self):
+        header, data = self._protocol.read_frame(to_bin('0xff0004cafebabe'))
+        self.assertEquals(data, '\xca\xfe')
+
+    def test_too_short_frame(self):
+        self.assertRaises(AssertionError, self._protocol.read_frame, to_bin('0xff0004ca'))
+
 
 class TestMessageStream(TestCase):
 
@@ -79,5 +91,85 @@ class TestMessageStream(TestCase):
         self.assertRaises(socket.timeout, self._msg_stream.get, self._msg, timeout=0.1, header_filter='id')
 
 
+class TestIncrementalMessageStream(TestCase):
+
+    def setUp(self):
+        self._protocol = Protocol('Test')
+        self._protocol.add(UInt(1, 'id', 1))
+        self._protocol.add(UInt(2, 'length', None))
+        self._protocol.add(PDU('length-2'))
+        self._msg = MessageTemplate('Records', self._protocol, {'id': '0xaa'})
+        self._msg.add(UInt(1, 'field_1', None))
+        records = ListTemplate('*', 'records', self._msg)
+        records.add(UInt(2, None, None))
+        self._msg.add(records)
+        self._stream = _MockStream(to_bin('0xff0003ca aa0007 01 cafe babe dd0005 02 f00d'))
+        self._msg_stream = MessageStream(self._stream, self._protocol)
+
+    def test_elements_are_read_from_stream_when_consumed(self):
+        msg, elements = self._msg_stream.get(self._msg, header_filter='id', incremental=True)
+        self.assertEquals(msg.field_1.hex, '0x01')
+        self.assertEquals(self._stream.data, to_bin('0xcafe babe dd0005 02 f00d'))
+        self.assertEquals(elements.next().hex, '0xcafe')
+        self.assertEquals(self._stream.data, to_bin('0xbabe dd0005 02 f00d'))
+        self.assertEquals([element.hex for element in elements], ['0xbabe'])
+        self.assertEquals(msg.records.len, 1)
+
+    def test_get_cached_message_incrementally(self):
+        self._msg.header_parameters = {'id': '0xdd'}
+        msg, elements = self._msg_stream.get(self._msg, header_filter='id', incremental=True)
+        self.assertEquals([element.hex for element in elements], ['0xf00d'])
+        self._msg.header_parameters = {'id': '0xaa'}
+        msg, elements = self._msg_stream.get(self._msg, header_filter='id', incremental=True)
+        self.assertEquals([element.hex for element in elements], ['0xcafe', '0xbabe'])
+
+
+class _MockDatagramStream(object):
+
+    def __init__(self, *frames):
+        self.frames = list(frames)
+
+    def read_frame(self, address=None, timeout=None):
+        for index, (data, frame_address) in enumerate(self.frames):
+            if address in (None, frame_address):
+                return self.frames.pop(index)
+        raise socket.timeout('timeout')
+
+    def empty(self, address=None):
+        self.frames = [frame for frame in self.frames if address not in (None, frame[1])]
+
+
+class TestDatagramMessageStream(TestCase):
+
+    def setUp(self):
+        self._protocol = Protocol('Test')
+        self._protocol.add(UInt(1, 'id', 1))
+        self._protocol.add(UInt(2, 'length', None))
+        self._protocol.add(PDU('length-2'))
+        self._msg = MessageTemplate('FooRequest', self._protocol, {'id': '0xaa'})
+        self._msg.add(UInt(1, 'field_1', None))
+        self._msg.add(UInt(1, 'field_2', None))
+        self._stream = _MockDatagramStream((to_bin('0xaa0004cafe'), 'first'),
+                                           (to_bin('0xaa0004be'), 'second'),
+                                           (to_bin('0xaa0004dead'), 'second'))
+
+    def test_get_message_from_address(self):
+        msg_stream = DatagramMessageStream(self._stream, self._protocol, 'second')
+        self.assertRaises(AssertionError, msg_stream.get, self._msg)
+        msg = msg_stream.get(self._msg)
+        self.assertEquals(msg.field_1.hex, '0xde')
+
+    def test_bad_datagram_does_not_break_framing(self):
+        msg_stream = DatagramMessageStream(self._stream, self._protocol)
+        self.assertEquals(msg_stream.get(self._msg).field_1.hex, '0xca')
+        self.assertRaises(AssertionError, msg_stream.get, self._msg)
+        self.assertEquals(msg_stream.get(self._msg).field_1.hex, '0xde')
+
+    def test_empty_only_own_address(self):
+        msg_stream = DatagramMessageStream(self._stream, self._protocol, 'second')
+        msg_stream.empty()
+        self.assertEquals(len(self._stream.frames), 1)
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,63 @@
+from unittest import TestCase, main
+from Rammbock.templates.parameters import ParameterTree, as_parameters, parse_path
+
+
+class TestParameterTree(TestCase):
+
+    def test_parse_path(self):
+        self.assertEquals(parse_path('foo'), ['foo'])
+        self.assertEquals(parse_path('foo.bar'), ['foo', 'bar'])
+        self.assertEquals(parse_path('list[1].bar'), ['list', '1', 'bar'])
+        self.assertEquals(parse_path('list[1][2]'), ['list', '1', '2'])
+        self.assertEquals(parse_path('*[0]'), ['*', '0'])
+
+    def test_fields_of_element_are_items(self):
+        params = ParameterTree({'foo': 1, 'bar.goo': 2})
+        self.assertEquals(params.pop('foo'), 1)
+        self.assertEquals(params.get('bar'), None)
+
+    def test_subtree_is_removed(self):
+        params = ParameterTree({'foo': 1, 'bar.goo': 2, 'bar.baz.zap': 3})
+        bar = params.subtree('bar')
+        self.assertEquals(bar.flatten(), [('baz.zap', 3), ('goo', 2)])
+        self.assertEquals(params.flatten(), [('foo', 1)])
+        self.assertEquals(params.subtree('bar').flatten(), [])
+
+    def test_wildcards_are_copied_to_subtrees(self):
+        params = ParameterTree({'*': 0, '*.first': 1, 'list.*[0]': 2, 'pair.first': 3})
+        self.assertEquals(params.subtree('list').flatten(), [('*', 0), ('*.0', 2), ('first', 1)])
+        self.assertEquals(params.subtree('pair').flatten(), [('*', 0), ('first', 3)])
+        self.assertEquals(params.subtree('other').flatten(), [('*', 0), ('first', 1)])
+        self.assertEquals(params.flatten(), [('*', 0), ('*.first', 1)])
+
+    def test_value_of_element_itself(self):
+        params = ParameterTree({'union': 'small', 'union.small': 1})
+        self.assertEquals(params.subtree('union').flatten(), [('', 'small'), ('small', 1)])
+
+    def test_names(self):
+        self.assertEquals(ParameterTree({'foo': 1, 'list[2].bar': 2}).names, set(['foo', 'list']))
+        self.assertEquals(ParameterTree({'foo': 1, '*.bar': 2}).names, None)
+
+    def test_empty_after_wildcards_are_removed(self):
+        params = ParameterTree({'*': 0, '*.first': 1})
+        self.assertTrue(params)
+        params.remove_wildcards()
+        self.assertFalse(params)
+        params.subtree('empty')
+        self.assertFalse(params)
+
+    def test_contains_and_add(self):
+        params = ParameterTree({'pair.first': 1})
+        self.assertTrue(params.contains('pair.first'))
+        self.assertFalse(params.contains('pair.second'))
+        params.add('pair.second', 2)
+        self.assertEquals(params.subtree('pair').flatten(), [('first', 1), ('second', 2)])
+
+    def test_as_parameters(self):
+        params = ParameterTree()
+        self.assertTrue(as_parameters(params) is params)
+        self.assertEquals(as_parameters({'foo.bar': 1}).flatten(), [('foo.bar', 1)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+from unittest import TestCase, main
+import socket
+from Rammbock.traffic import field_generator, MessageEncoder, TokenBucket, TrafficGenerator
+from Rammbock.templates import Protocol, MessageTemplate, UInt, PDU
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class TestFieldGenerators(TestCase):
+
+    def test_plain_value_is_not_generator(self):
+        self.assertEquals(field_generator('0xcafe'), None)
+        self.assertEquals(field_generator('{foo}'), None)
+
+    def test_counter(self):
+        self.assertEquals([field_generator('{counter}')(i) for i in range(3)], ['0', '1', '2'])
+
+    def test_counter_with_start_and_step(self):
+        generator = field_generator('{counter:0x10:2}')
+        self.assertEquals([generator(i) for i in range(3)], ['16', '18', '20'])
+
+    def test_random(self):
+        generator = field_generator('{random:5:7}')
+        for index in range(20):
+            self.assertTrue(5 <= int(generator(index)) <= 7)
+
+
+class TestMessageEncoder(TestCase):
+
+    def setUp(self):
+        protocol = Protocol('Test')
+        protocol.add(UInt(1, 'id', 1))
+        protocol.add(UInt(2, 'length', None))
+        protocol.add(PDU('length-3'))
+        self.template = MessageTemplate('FooRequest', protocol, {})
+        self.template.add(UInt(2, 'sequence', None))
+
+    def test_static_message_is_encoded_once(self):
+        encoder = MessageEncoder(self.template, {'sequence': '7'}, {})
+        self.assertTrue(encoder.encode(0) is encoder.encode(1))
+        self.assertEquals(encoder.encode(0), '\x01\x00\x05\x00\x07')
+
+    def test_generated_fields(self):
+        encoder = MessageEncoder(self.template, {'sequence': '{counter:1}'}, {'id': '{counter:5}'})
+        self.assertEquals(encoder.encode(0), '\x05\x00\x05\x00\x01')
+        self.assertEquals(encoder.encode(2), '\x07\x00\x05\x00\x03')
+
+
+class TestTokenBucket(TestCase):
+
+    def test_paces_to_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(10, clock=clock, sleep=clock.sleep)
+        dues = [bucket.take() for _ in range(4)]
+        self.assertEquals([round(due - 100, 3) for due in dues], [0, 0.1, 0.2, 0.3])
+
+    def test_burst_allows_catching_up(self):
+        clock = FakeClock()
+        bucket = TokenBucket(10, burst=3, clock=clock, sleep=clock.sleep)
+        bucket.take()
+        clock.now += 0.5
+        self.assertEquals([round(bucket.take() - 100, 3) for _ in range(4)], [0.3, 0.4, 0.5, 0.6])
+
+
+class TestTrafficGenerator(TestCase):
+
+    def test_send_count(self):
+        sent = []
+        stats = TrafficGenerator(sent.append, str, 1000, count=5).run()
+        self.assertEquals(sent, ['0', '1', '2', '3', '4'])
+        self.assertEquals((stats['sent'], stats['failed']), (5, 0))
+
+    def test_send_duration(self):
+        stats = TrafficGenerator(lambda msg: None, str, 1000, duration=0.05).run()
+        self.assertTrue(20 < stats['sent'] < 80)
+
+    def test_socket_errors_are_counted(self):
+        def send(msg):
+            raise socket.error(111, 'Connection refused')
+        stats = TrafficGenerator(send, str, 1000, count=3).run()
+        self.assertEquals((stats['sent'], stats['failed']), (0, 3))
+        self.assertEquals(stats['errors'].values(), [3])
+
+    def test_count_or_duration_required(self):
+        self.assertRaises(AssertionError, TrafficGenerator, None, str, 10)
+
+
+if __name__ == "__main__":
+    main()
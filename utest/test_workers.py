@@ -0,0 +1,150 @@
+from unittest import TestCase, main
+import os
+import select
+from Rammbock.networking import UDPClient
+from Rammbock.templates.containers import Protocol, MessageTemplate
+from Rammbock.templates.primitives import UInt, PDU
+from Rammbock.workers import run_in_workers, share, aggregate, aggregate_shards, BackgroundWorkers, LoadWorker, \
+    ShardedUDPServer, WorkerError
+
+
+class _FakeClient(object):
+
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def send(self, msg, log=True):
+        self.sent.append(msg)
+
+    def close(self):
+        self.closed = True
+
+
+class TestRunInWorkers(TestCase):
+
+    def test_results_in_worker_order(self):
+        results = run_in_workers(3, lambda worker: (worker, os.getpid()))
+        self.assertEquals([worker for worker, _ in results], [0, 1, 2])
+        self.assertTrue(os.getpid() not in [pid for _, pid in results])
+
+    def test_worker_failure(self):
+        def task(worker):
+            if worker == 1:
+                raise ValueError('bad worker')
+            return worker
+        results = run_in_workers(2, task)
+        self.assertEquals(results[0], 0)
+        self.assertTrue(isinstance(results[1], WorkerError))
+        self.assertTrue('bad worker' in str(results[1]))
+
+
+class TestLoadWorker(TestCase):
+
+    def test_share(self):
+        self.assertEquals([share(10, 3, worker) for worker in range(3)], [4, 3, 3])
+        self.assertEquals(share(None, 3, 0), None)
+
+    def test_interleaved_indices_over_clients(self):
+        clients = [_FakeClient(), _FakeClient()]
+        stats = LoadWorker(1, 3, clients, str, 10000, count=7).run()
+        self.assertEquals(stats['sent'], 2)
+        self.assertEquals([client.sent for client in clients], [['1'], ['4']])
+        self.assertTrue(all(client.closed for client in clients))
+
+    def test_aggregate(self):
+        results = [LoadWorker(worker, 2, [_FakeClient()], str, 10000, count=5).run() for worker in range(2)]
+        stats = aggregate(results)
+        self.assertEquals((stats['sent'], stats['failed']), (5, 0))
+        self.assertEquals(stats['jitter']['count'], 5)
+        self.assertEquals([worker['sent'] for worker in stats['workers']], [3, 2])
+
+
+class TestBackgroundWorkers(TestCase):
+
+    def test_workers_run_until_stopped(self):
+        def task(worker, stop_fd):
+            select.select([stop_fd], [], [])
+            return worker, os.getpid()
+        workers = BackgroundWorkers(2, task)
+        results = workers.stop()
+        self.assertEquals([worker for worker, _ in results], [0, 1])
+        self.assertTrue(os.getpid() not in [pid for _, pid in results])
+
+
+def _protocol():
+    protocol = Protocol('Test')
+    protocol.add(UInt(1, 'id', None))
+    protocol.add(UInt(2, 'length', None))
+    protocol.add(PDU('length-3'))
+    return protocol
+
+
+def _template(protocol, message_id):
+    template = MessageTemplate('Message%s' % message_id, protocol, {'id': message_id})
+    template.add(UInt(2, 'field', None))
+    return template
+
+
+class TestShardedUDPServer(TestCase):
+
+    def setUp(self):
+        self.protocol = _protocol()
+        self.request = _template(self.protocol, '1')
+        self.response = _template(self.protocol, '2')
+
+    def _respond(self, index):
+        return self.response.encode({'field': str(index)}, {})._raw
+
+    def _request(self, value):
+        return self.request.encode({'field': value}, {})._raw
+
+    def test_shards_receive_and_respond(self):
+        server = ShardedUDPServer('127.0.0.1', 0, 2, self.request, {'field': '1'}, self._respond)
+        clients = [UDPClient(timeout=5, protocol=self.protocol).connect_to(*server.get_own_address())
+                   for _ in range(4)]
+        try:
+            for client in clients:
+                client.send(self._request('1'))
+                client.get_message(self.response)
+            clients[0].send(self._request('2'))
+            clients[0].get_message(self.response)
+        finally:
+            stats = server.stop()
+            for client in clients:
+                client.close()
+        self.assertEquals((stats['received'], stats['responded'], stats['invalid']), (5, 5, 1))
+        self.assertEquals(stats['messages_received'], 5)
+        self.assertEquals(len(stats['shards']), 2)
+        self.assertEquals(server.get_statistics()['messages_sent'], 5)
+
+    def test_shard_keeps_serving_after_malformed_datagram(self):
+        server = ShardedUDPServer('127.0.0.1', 0, 1, self.request, {'field': '1'}, self._respond)
+        client = UDPClient(timeout=5, protocol=self.protocol).connect_to(*server.get_own_address())
+        try:
+            client.send('\x01\x00\x09\x00')
+            client.send(self._request('1'))
+            client.get_message(self.response)
+        finally:
+            stats = server.stop()
+            client.close()
+        self.assertEquals((stats['received'], stats['responded'], stats['failed']), (1, 1, 1))
+        self.assertEquals(stats['decode_failures'], 1)
+
+    def test_receiving_from_sharded_server_is_not_supported(self):
+        server = ShardedUDPServer('127.0.0.1', 0, 1, self.request)
+        try:
+            self.assertRaises(AssertionError, server.get_message, self.request)
+            self.assertRaises(AssertionError, server.send, 'foo')
+            self.assertRaises(AssertionError, server.empty)
+        finally:
+            server.stop()
+
+    def test_aggregate_shards(self):
+        shard = dict(aggregate_shards([]), received=2, bytes_received=10)
+        stats = aggregate_shards([shard, dict(shard, received=3)])
+        self.assertEquals((stats['received'], stats['bytes_received']), (5, 20))
+
+
+if __name__ == "__main__":
+    main()